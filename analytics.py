@@ -0,0 +1,175 @@
+# analytics.py - pick rate analytics kept on the wall, only the results go to the control application
+# Metrics, in ms:
+#   FILL  - an order in a compartment: first front confirmation to full (the operator at the front)
+#   EMPTY - full to the back confirmation (the operator at the back)
+#   SCAN  - gap between two put requests (U#S or SCAN), gaps over STATS_IDLE_MS are breaks and not counted
+#   BATCH - batch registration to BATCH FINISHED
+# Every metric keeps its last STATS_RING samples in a ring and the count and sum of all samples. Percentiles
+# are taken from the ring when asked for: the samples are copied into a buffer made at boot and sorted there,
+# so memory stays constant and the percentiles follow the recent trend, the mean of all samples is next to it.
+# FILL and EMPTY are also summed per compartment - a slow compartment shows as a high mean.
+# Samples are tagged with the batch slot of the compartment (group), so the percentiles of one batch can be taken
+# from the same ring (percentile(metric, p, group)); a SCAN gap belongs to a batch only if both put requests do.
+# STATS#B#9 returns STATS#S#<compartment>#<orders>#f=<mean fill>,e=<mean empty> for every compartment used, then
+# STATS#B#9#<metric>#n=<count>,a=<mean>,w=<samples in the ring>,p50=..,p90=..,x=<max in the ring> for every metric
+# (BATCH last); STATS#B#9#RESET clears everything first.
+
+from micropython import const
+from array import array
+import time
+import config
+
+FILL = const(0)
+EMPTY = const(1)
+SCAN = const(2)
+BATCH = const(3)
+NAMES = ('FILL', 'EMPTY', 'SCAN', 'BATCH')
+_METRICS = const(4)
+_SHELVES = const(9)
+NO_GROUP = const(0xFF)      # sample of no batch
+
+_ring = array('L', [0] * (_METRICS * config.STATS_RING))
+_group = bytearray(b'\xff' * (_METRICS * config.STATS_RING))    # batch slot of every sample
+_head = array('H', [0] * _METRICS)          # next slot of the ring
+_count = array('L', [0] * _METRICS)         # all samples
+_total = array('Q', [0] * _METRICS)         # ... and their sum
+_sorted = array('L', [0] * config.STATS_RING)
+_full = array('L', [0] * _SHELVES)          # ticks_ms when the compartment became full
+_orders = array('L', [0] * _SHELVES)        # orders emptied per compartment
+_fill = array('Q', [0] * _SHELVES)          # sums of their fill and empty times
+_empty = array('Q', [0] * _SHELVES)
+_scan = None                                # ticks_ms of the last put request
+_scan_group = NO_GROUP                      # ... and its batch slot
+
+
+def reset():
+    global _scan, _scan_group
+    for a in (_ring, _head, _count, _total, _full, _orders, _fill, _empty):
+        for i in range(len(a)):
+            a[i] = 0
+    forget(None)
+    _scan = None
+    _scan_group = NO_GROUP
+
+
+def forget(group):
+    # the samples of a batch slot (None - all) no longer belong to it - the slot is used by a new batch
+    global _scan_group
+    for i in range(len(_group)):
+        if group is None or _group[i] == group:
+            _group[i] = NO_GROUP
+    if group is None or _scan_group == group:
+        _scan_group = NO_GROUP
+
+
+def add(metric, ms, group=NO_GROUP):
+    if ms < 0:
+        return
+    i = _head[metric]
+    _ring[metric * config.STATS_RING + i] = ms
+    _group[metric * config.STATS_RING + i] = group
+    _head[metric] = i + 1 if i + 1 < config.STATS_RING else 0
+    _count[metric] += 1
+    _total[metric] += ms
+
+
+def full(shelf, group=NO_GROUP):
+    # the last item of the order is in the compartment
+    now = time.ticks_ms()
+    _full[shelf.shelf_no] = now
+    add(FILL, time.ticks_diff(now, shelf.start_time), group)
+
+
+def emptied(shelf, group=NO_GROUP):
+    # back confirmation, shelf.end_time is set by the button IRQ
+    no = shelf.shelf_no
+    fill = time.ticks_diff(_full[no], shelf.start_time)
+    empty = time.ticks_diff(shelf.end_time, _full[no])
+    add(EMPTY, empty, group)
+    if fill >= 0 and empty >= 0:
+        _orders[no] += 1
+        _fill[no] += fill
+        _empty[no] += empty
+
+
+def scan(group=NO_GROUP):
+    # a put request - the order and the compartment of the next item are known
+    global _scan, _scan_group
+    now = time.ticks_ms()
+    if _scan is not None:
+        gap = time.ticks_diff(now, _scan)
+        if gap <= config.STATS_IDLE_MS:
+            add(SCAN, gap, group if group == _scan_group else NO_GROUP)
+    _scan = now
+    _scan_group = group
+
+
+def batch(b):
+    # the batch is finished
+    b.end_time = time.ticks_ms()
+    add(BATCH, time.ticks_diff(b.end_time, b.start_time))
+
+
+def window(metric, group=None):
+    # samples in the ring (of one batch slot if group is given), sorted into the buffer, returns their number
+    count = _count[metric]
+    if count > config.STATS_RING:
+        count = config.STATS_RING
+    base = metric * config.STATS_RING
+    n = 0
+    for i in range(count):
+        if group is not None and _group[base + i] != group:
+            continue
+        # insertion sort, the ring holds a few dozen samples
+        value = _ring[base + i]
+        j = n
+        while j and _sorted[j - 1] > value:
+            _sorted[j] = _sorted[j - 1]
+            j -= 1
+        _sorted[j] = value
+        n += 1
+    return n
+
+
+def percentile(metric, p, group=None):
+    # p-th percentile of the ring (of one batch slot), None without samples
+    n = window(metric, group)
+    if not n:
+        return None
+    return _sorted[min(n - 1, n * p // 100)]
+
+
+def mean(metric):
+    return _total[metric] // _count[metric] if _count[metric] else None
+
+
+def report(metric):
+    # without samples only n=0,w=0 - the mean and the percentiles are left out
+    n = window(metric)
+    text = 'n=' + str(_count[metric])
+    if _count[metric]:
+        text += ',a=' + str(mean(metric))
+    text += ',w=' + str(n)
+    if n:
+        text += (',p50=' + str(_sorted[min(n - 1, n // 2)]) + ',p90=' + str(_sorted[min(n - 1, n * 9 // 10)]) +
+                 ',x=' + str(_sorted[n - 1]))
+    return text
+
+
+def shelf_report(shelf_no):
+    # None for a compartment without emptied orders
+    n = _orders[shelf_no]
+    if not n:
+        return None
+    return 'f=' + str(_fill[shelf_no] // n) + ',e=' + str(_empty[shelf_no] // n)
+
+
+def orders(shelf_no):
+    return _orders[shelf_no]
+
+
+def seconds(ms):
+    # 12345 -> '12.3s' for the display
+    if ms is None:
+        return '-'
+    return str(ms // 1000) + '.' + str(ms % 1000 // 100) + 's'
@@ -0,0 +1,42 @@
+# config.py - configuration of one picking wall
+# values that differ between walls connected to the same control application
+
+# multi-drop (RS-485) addressing
+# None - point to point UART, frames without addresses: !<command>%
+# 1..254 - node address on the shared bus, frames: !<destination>:<source>:<command>%
+# (two hex digits each, the control application is 00, FF is a broadcast to all walls)
+NODE_ADDRESS = None
+
+# GPIO driving DE/RE of the RS-485 transceiver, None for transceivers with automatic direction control
+RS485_DE_PIN = None
+
+# logging (log.py) - 10 debug, 20 info, 30 warning, 40 error
+LOG_LEVEL = 20
+LOG_BUFFER = 64         # records kept in RAM until they are drained
+LOG_SINK = 'USB'        # 'USB' - console, 'UART' - L frames to the control application, None - RAM only
+
+# heap management (heap.py)
+GC_THRESHOLD = 24 * 1024    # bytes allocated between automatic collections, -1 - only when the heap is full, None - keep
+GC_IDLE_MS = 1000           # collect in a quiet window of the main loop at least this often
+GC_IDLE_ALLOC = 8 * 1024    # ... or as soon as this many bytes were allocated since the last collection
+HEAP_WARN_FREE = 16 * 1024  # heap pressure - less free heap than this after a collection
+HEAP_WARN_FRAG = 25         # ... or the largest free block smaller than this percentage of the free heap
+HEAP_PROBE_MS = 60000       # how often the largest free block is measured (may cost a few collections)
+
+# MCP23017 bus scheduler (scheduler.py)
+BUS_BUDGET_US = 4000        # display / buzzer work per main loop iteration
+I2C_TIMEOUT_US = 2000       # longest I2C transaction, a byte at 400 kHz takes 25 us
+I2C_BACKOFF_MS = 50         # first wait before the next recovery of a bus that is down, doubled every time
+I2C_BACKOFF_MAX_MS = 5000
+LCD_OFFLINE_FAILS = 3       # bus faults in a row while one display is written before it goes offline (own backoff)
+
+# traffic capture for replay in the simulator (trace.py, tools/replay.py)
+TRACE = None                # None - off, 'FLASH' - TRACE_FILE, 'USB' - '@T' lines on the console
+TRACE_FILE = '/trace.bin'
+TRACE_BUFFER = 2048         # records collected in RAM before they are written
+TRACE_FLUSH_MS = 2000       # ... written at least this often
+TRACE_MAX = 512 * 1024      # the file stops growing here (records are counted as dropped)
+
+# pick rate analytics (analytics.py)
+STATS_RING = 32             # last samples of every metric kept for the percentiles
+STATS_IDLE_MS = 60000       # a longer gap between two put requests is a break, not a scan gap
@@ -0,0 +1,140 @@
+# fmt.py - text rendered into preallocated buffers
+# LCD rows and UART frames are written into bytearrays created at boot: strings and bytes are copied character
+# by character and integers are written digit by digit in place, so a display update or a reply does not
+# allocate (str(), concatenation and ' ' * n all create new objects on every call).
+# Text - a frame that is built piece by piece (UART_com), row() / center() - one fixed width LCD row
+# None is written as 'None', like str() did before.
+
+_NONE = 'None'
+
+
+def width(value):
+    # number of characters put() writes for the value
+    if value is None:
+        return 4
+    if isinstance(value, int):
+        n = 1
+        if value < 0:
+            n = 2
+            value = -value
+        while value >= 10:
+            value //= 10
+            n += 1
+        return n
+    return len(value)
+
+
+def put(buf, pos, value, end=None):
+    # writes str / bytes / bytearray / memoryview / int / None into buf from pos, cut at end (default len(buf))
+    # returns the position after the value
+    if end is None:
+        end = len(buf)
+    if value is None:
+        value = _NONE
+    if isinstance(value, int):
+        n = width(value)
+        if value < 0:
+            if pos < end:
+                buf[pos] = 45       # '-'
+            pos += 1
+            n -= 1
+            value = -value
+        stop = pos + n
+        i = stop
+        while i > pos:
+            i -= 1
+            if i < end:
+                buf[i] = 48 + value % 10
+            value //= 10
+        return stop if stop < end else end
+    if isinstance(value, str):
+        for c in value:
+            if pos >= end:
+                break
+            buf[pos] = ord(c)
+            pos += 1
+        return pos
+    for c in value:
+        if pos >= end:
+            break
+        buf[pos] = c
+        pos += 1
+    return pos
+
+
+def _spaces(buf, pos, end):
+    while pos < end:
+        buf[pos] = 32
+        pos += 1
+    return pos
+
+
+def row(buf, l1, l2, r1, r2=None, r3=None):
+    # label template: l1 l2 on the left, r1 r2 r3 aligned to the right, spaces between (l2, r2, r3 None - unused)
+    end = len(buf)
+    pos = put(buf, 0, l1)
+    if l2 is not None:
+        pos = put(buf, pos, l2)
+    right = width(r1)
+    if r2 is not None:
+        right += width(r2)
+    if r3 is not None:
+        right += width(r3)
+    pos = _spaces(buf, pos, end - right)
+    pos = put(buf, pos, r1)
+    if r2 is not None:
+        pos = put(buf, pos, r2)
+    if r3 is not None:
+        pos = put(buf, pos, r3)
+    _spaces(buf, pos, end)
+    return buf
+
+
+def at(buf, pos, text):
+    # text from column pos, spaces around it
+    _spaces(buf, put(buf, _spaces(buf, 0, pos), text), len(buf))
+    return buf
+
+
+def center(buf, text):
+    # text in the middle of the row
+    end = len(buf)
+    pos = _spaces(buf, 0, end // 2 - width(text) // 2)
+    _spaces(buf, put(buf, pos, text), end)
+    return buf
+
+
+class Text():
+    # growing frame in one bytearray, view() returns the filled part as a memoryview
+    # (the views are cached per length, so sending the same length again does not create a new one)
+    def __init__(self, size=64):
+        self.n = 0
+        self._set_buffer(bytearray(size))
+
+    def _set_buffer(self, buf):
+        self.buf = buf
+        self._mv = memoryview(buf)
+        self._views = [None] * (len(buf) + 1)
+
+    def clear(self):
+        self.n = 0
+        return self
+
+    def add(self, value):
+        need = self.n + width(value)
+        if need > len(self.buf):
+            # longer than any frame before - replaced by a bigger buffer, the only allocation here
+            size = 2 * len(self.buf)
+            while size < need:
+                size *= 2
+            buf = bytearray(size)
+            buf[:self.n] = self.buf[:self.n]
+            self._set_buffer(buf)
+        self.n = put(self.buf, self.n, value)
+        return self
+
+    def view(self):
+        view = self._views[self.n]
+        if view is None:
+            view = self._views[self.n] = self._mv[:self.n]
+        return view
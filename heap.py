@@ -0,0 +1,121 @@
+# heap.py - memory policy of the picking wall
+# The automatic collection runs whenever gc.threshold() bytes were allocated - possibly in the middle of a
+# confirmation or an LED frame. idle() collects earlier, in the windows the main loop knows to be quiet
+# (right after an LED frame, nothing received), so the threshold is reached only under unusual load.
+# After every collection the free heap is checked, every HEAP_PROBE_MS also the largest free block
+# (fragmentation), and heap pressure is reported to the control application: E#B#9#<free bytes>#HP
+# HEAP#B#9 returns the telemetry: H#B#9#None#f=<free>,a=<allocated>,l=<largest block>,c=<idle collections>,
+#                                        g=<automatic collections>,p=<last pause us>,m=<longest pause us>
+
+from micropython import const
+import gc
+import time
+import config
+import log
+
+_CHECK_MS = const(50)   # mem_alloc() walks the allocation table, not on every loop
+
+collections = 0         # idle collections
+auto = 0                # automatic collections noticed between the checks
+pause_us = 0            # the last idle collection
+max_pause_us = 0
+free = 0                # free heap after the last collection
+largest = 0             # largest free block at the last probe (0 - not measured yet)
+pressure = False
+_uart = None
+_check = 0              # ticks_ms of the last check
+_last = 0               # ticks_ms of the last idle collection
+_probe = 0              # ticks_ms of the last largest block probe
+_alloc = 0              # gc.mem_alloc() after the last collection
+_seen = 0               # gc.mem_alloc() at the last check
+
+
+def init(uart=None):
+    # boot: collects and sets the threshold of the automatic collection
+    global _uart, _check, _last, _probe, _alloc, _seen, free
+    _uart = uart
+    gc.collect()
+    if config.GC_THRESHOLD is not None:
+        gc.threshold(config.GC_THRESHOLD)
+    _check = _last = _probe = time.ticks_ms()
+    _alloc = _seen = gc.mem_alloc()
+    free = gc.mem_free()
+
+
+def probe():
+    # largest free block now - several collections, deferred at boot until READY is sent
+    global largest, _probe
+    _probe = time.ticks_ms()
+    largest = largest_block()
+    log.info('heap', free, largest, config.GC_THRESHOLD)
+
+
+def largest_block(step=256):
+    # the biggest bytearray that can be allocated now, every failed attempt costs a collection
+    lo = 0
+    hi = gc.mem_free() // step
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        try:
+            buf = bytearray(mid * step)
+            buf = None
+            lo = mid
+        except MemoryError:
+            hi = mid - 1
+    return lo * step
+
+
+def idle():
+    # called by the main loop in a quiet window, collects when it is due
+    # returns True if it collected
+    global _check, _alloc, _seen, auto
+    now = time.ticks_ms()
+    if time.ticks_diff(now, _check) < _CHECK_MS:
+        return False
+    _check = now
+    alloc = gc.mem_alloc()
+    if alloc < _seen:
+        # the heap shrank without idle() - the threshold was reached in between
+        auto += 1
+        _alloc = alloc
+    _seen = alloc
+    if alloc - _alloc < config.GC_IDLE_ALLOC and time.ticks_diff(now, _last) < config.GC_IDLE_MS:
+        return False
+    collect(now)
+    return True
+
+
+def collect(now=None):
+    global collections, pause_us, max_pause_us, free, _last, _alloc, _seen
+    if now is None:
+        now = time.ticks_ms()
+    start = time.ticks_us()
+    gc.collect()
+    pause_us = time.ticks_diff(time.ticks_us(), start)
+    if pause_us > max_pause_us:
+        max_pause_us = pause_us
+    collections += 1
+    _last = now
+    free = gc.mem_free()
+    if time.ticks_diff(now, _probe) >= config.HEAP_PROBE_MS:
+        probe()
+    _alloc = _seen = gc.mem_alloc()
+    _check_pressure()
+
+
+def _check_pressure():
+    global pressure
+    low = free < config.HEAP_WARN_FREE or 0 < largest * 100 < free * config.HEAP_WARN_FRAG
+    if low and not pressure:
+        if _uart is not None:
+            _uart.send_message('E', 9, 'HP', free)      # logged as a warning by send_message
+        else:
+            log.warning('heap pressure', free, largest)
+    elif pressure and not low:
+        log.info('heap ok', free, largest)
+    pressure = low
+
+
+def report():
+    return ('f=' + str(free) + ',a=' + str(_alloc) + ',l=' + str(largest) + ',c=' + str(collections) +
+            ',g=' + str(auto) + ',p=' + str(pause_us) + ',m=' + str(max_pause_us))
@@ -0,0 +1,46 @@
+# hotloops.py - the innermost loops of the LED and LCD drivers
+# The bytecode versions below are used everywhere; where the port has the native and viper emitters
+# (rp2, unix) native.py replaces them with machine code. NATIVE tells which ones are in use,
+# tm_byte_sio is None unless the RP2040 GPIO registers can be written directly.
+# tools/native_bench.py compares the per-call cost of both.
+
+NATIVE = False
+tm_byte_sio = None
+
+
+def tm_byte(clk, dio, b):
+    # TM1638 byte, LSB first - the clock and data Pin objects are called 24 times
+    for i in range(8):
+        clk(0)
+        dio((b >> i) & 1)
+        clk(1)
+
+
+def lcd_nibble(nibble, pins):
+    # MCP23017 bits of the HD44780 D4-D7 lines for one nibble, pins - GPIO numbers of D4-D7 (bytes)
+    bits = 0
+    for i in range(4):
+        if (nibble >> i) & 1:
+            bits |= 1 << pins[i]
+    return bits
+
+
+def led_merge(on, off, shelf_on, shelf_off):
+    # ORs the TM1638 registers of one shelf (bytearray(8) each) into the frame
+    for i in range(8):
+        on[i] |= shelf_on[i]
+        off[i] |= shelf_off[i]
+
+
+bytecode = (tm_byte, lcd_nibble, led_merge)     # kept for the benchmark
+
+try:
+    import native
+    tm_byte = native.tm_byte
+    lcd_nibble = native.lcd_nibble
+    led_merge = native.led_merge
+    if native.SIO:
+        tm_byte_sio = native.tm_byte_sio
+    NATIVE = True
+except (ImportError, SyntaxError):
+    pass
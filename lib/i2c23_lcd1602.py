@@ -22,6 +22,7 @@
 # - shortened version, adapted to the Put to Wall project, modified by Tomasz Zgrys - 08-01-2022
 
 import utime
+import hotloops
 
 # Commands
 LCD_CLEARDISPLAY        = 0x01
@@ -69,7 +70,7 @@ LCD_ROW_OFFSETS         = (0x00, 0x40)
 class display(object):
     """Class to represent and interact with an HD44780 character LCD display."""
 
-    def __init__(self, rs, en, d4, d5, d6, d7, cols, lines, gpio):
+    def __init__(self, rs, en, d4, d5, d6, d7, cols, lines, gpio, init=True):
 
 
         # Save column and line state.
@@ -84,22 +85,37 @@ class display(object):
         self._d6 = d6
         self._d7 = d7
 
+        # RS and D4-D7 are written in one GPIO write per nibble, the other pins keep their values.
+        self._data_pins = bytes((d4, d5, d6, d7))
+        self._rs_bit = 1 << rs
+        self._keep = 0xFFFF & ~(self._rs_bit | (1 << d4) | (1 << d5) | (1 << d6) | (1 << d7))
+
         # All pins as values.
         for pin in (rs, en, d4, d5, d6, d7):
             gpio.pin(pin,mode=0,value=0)
 
-        # Initialize the display.
-        self.write8(0x033)
-        self.write8(0x032)
         # Initialize display control, function, and mode registers.
         self.displaycontrol = LCD_DISPLAYON | LCD_CURSOROFF | LCD_BLINKOFF
         self.displayfunction = LCD_4BITMODE | LCD_1LINE | LCD_2LINE | LCD_5x8DOTS
         self.displaymode = LCD_ENTRYLEFT | LCD_ENTRYSHIFTDECREMENT
-        # Write registers.
-        self.write8(LCD_DISPLAYCONTROL | self.displaycontrol)
-        self.write8(LCD_FUNCTIONSET | self.displayfunction)
-        self.write8(LCD_ENTRYMODESET | self.displaymode)  # set the entry mode
-        self.clear()
+        if init:
+            self.initialize()
+
+    def initialize(self):
+        """HD44780 initialization sequence - skipped in __init__ (init=False) when
+        a display_group has already initialized the display."""
+        for command in self.init_commands():
+            utime.sleep_ms(2)  # the display is still in an unknown mode, plenty of time
+            self.write8(command)
+        utime.sleep_ms(2)  # the last command clears the display, it takes a long time
+
+    def init_commands(self):
+        """Commands of the initialization sequence, the last one clears the display.
+        Each one needs 2 ms before the next - the bus scheduler writes them one
+        by one without waiting (scheduler.py)."""
+        return (0x033, 0x032, LCD_DISPLAYCONTROL | self.displaycontrol,
+                LCD_FUNCTIONSET | self.displayfunction,
+                LCD_ENTRYMODESET | self.displaymode, LCD_CLEARDISPLAY)
 
     def home(self):
         """Move the cursor back to its home (first line and first column)."""
@@ -130,7 +146,14 @@ class display(object):
   
 
     def message(self, text):
-        """Write text to display.  Note that text can include newlines."""
+        """Write text to display.  Note that text can include newlines.
+        bytes, bytearray or memoryview are written as they are (character codes,
+        no newline handling) - a preallocated row is displayed without allocating.
+        """
+        if not isinstance(text, str):
+            for value in text:
+                self.write8(value, True)
+            return
         line = 0
         # Iterate through each character.
         for char in text:
@@ -148,27 +171,20 @@ class display(object):
         """Write 8-bit value in character or data mode.  Value should be an int
         value from 0-255, and char_mode is True if character data or False if
         non-character data (default).
+        Characters and most commands take 37us, the enable pulse waits 40us
+        after each nibble - only clear() and home() need their own delay.
         """
-        # One millisecond delay to prevent writing too quickly.
-        utime.sleep_ms(2)
-        
-        # Set character / data bit.
-        self._gpio.pin(self._rs,mode=0,value=(char_mode))
-        
-        # Write upper 4 bits.
-        self._gpio.pin(self._d4,mode=0,value=(((value1 & 0b00010000) >> 4)))
-        self._gpio.pin(self._d5,mode=0,value=(((value1 & 0b00100000) >> 5)))
-        self._gpio.pin(self._d6,mode=0,value=(((value1 & 0b01000000) >> 6)))
-        self._gpio.pin(self._d7,mode=0,value=(((value1 & 0b10000000) >> 7)))
+        # Set character / data bit, keep the E lines and the buzzer (shadow latches, nothing read over the bus).
+        gpio = self._gpio.olat & self._keep
+        if char_mode:
+            gpio |= self._rs_bit
 
+        # Write upper 4 bits.
+        self._gpio.gpio = gpio | hotloops.lcd_nibble(value1 >> 4, self._data_pins)
         self._pulse_enable()
-        
-        # Write lower 4 bits.
-        self._gpio.pin(self._d4,mode=0,value=((value1 & 0b00000001) >> 0))
-        self._gpio.pin(self._d5,mode=0,value=((value1 & 0b00000010) >> 1))
-        self._gpio.pin(self._d6,mode=0,value=((value1 & 0b00000100) >> 2))
-        self._gpio.pin(self._d7,mode=0,value=((value1 & 0b00001000) >> 3))
 
+        # Write lower 4 bits.
+        self._gpio.gpio = gpio | hotloops.lcd_nibble(value1 & 0x0F, self._data_pins)
         self._pulse_enable()
 
     def create_char(self, location, pattern):
@@ -186,18 +202,34 @@ class display(object):
 
 
     def _pulse_enable(self):
-        # Pulse the clock enable line off, on, off to send command.
-        self._gpio.pin(self._en,mode=0,value=False)
+        # Pulse the clock enable line off, on, off to send command - one register write each.
+        self._gpio.output(self._en, 0)
         utime.sleep_us(1)      # 1 microsecond pause - enable pulse must be > 450ns
-        self._gpio.pin(self._en,mode=0,value=1)
+        self._gpio.output(self._en, 1)
         utime.sleep_us(1)      # 1 microsecond pause - enable pulse must be > 450ns
-        self._gpio.pin(self._en,mode=0,value=0)
+        self._gpio.output(self._en, 0)
         utime.sleep_us(40)       # commands need > 37us to settle
 
 
+class display_group(display):
+    """Displays sharing the RS and D4-D7 lines, each with its own E line - every
+    command written to the group reaches all of them at once (initialization,
+    clear, the same text on every display).
+    """
 
+    def __init__(self, rs, ens, d4, d5, d6, d7, cols, lines, gpio):
+        self._mask = 0
+        for en in ens:
+            self._mask |= 1 << en
+            gpio.pin(en,mode=0,value=0)
+        display.__init__(self, rs, ens[0], d4, d5, d6, d7, cols, lines, gpio)
 
-
-
-
-
+    def _pulse_enable(self):
+        # All E lines at once, the other pins keep their values.
+        value = self._gpio.olat & ~self._mask
+        self._gpio.gpio = value
+        utime.sleep_us(1)
+        self._gpio.gpio = value | self._mask
+        utime.sleep_us(1)
+        self._gpio.gpio = value
+        utime.sleep_us(40)
@@ -26,6 +26,10 @@ class Port():
     def __init__(self, port, mcp):
         self._port = port & 1  # 0=PortA, 1=PortB
         self._mcp = mcp
+        self._buf = bytearray(1)  # register value, reused so a pin change does not allocate
+        # shadow of the registers written - restore() writes them again after a bus fault or a reset of the chip
+        self._iodir = None
+        self._olat = None
 
     def _which_reg(self, reg):
         if self._mcp._config & 0x80 == 0x80:
@@ -42,15 +46,21 @@ class Port():
             setattr(self, reg, getattr(self, reg) & ~bit)
 
     def _read(self, reg):
-        return self._mcp._i2c.readfrom_mem(self._mcp._address, self._which_reg(reg), 1)[0]
+        self._mcp._i2c.readfrom_mem_into(self._mcp._address, self._which_reg(reg), self._buf)
+        return self._buf[0]
 
     def _write(self, reg, val):
         val &= 0xff
-        self._mcp._i2c.writeto_mem(self._mcp._address, self._which_reg(reg), bytearray([val]))
+        self._buf[0] = val
+        self._mcp._i2c.writeto_mem(self._mcp._address, self._which_reg(reg), self._buf)
         # if writing to the config register, make a copy in mcp so that it knows
         # which bank you're using for subsequent writes
         if reg == _MCP_IOCON:
             self._mcp._config = val
+        elif reg == _MCP_IODIR:
+            self._iodir = val
+        elif reg == _MCP_GPIO:
+            self._olat = val
 
     @property
     def mode(self):
@@ -76,8 +86,10 @@ class MCP23017():
         self.init()
 
     def init(self):
-        # error if device not found at i2c addr
-        if self._i2c.scan().count(self._address) == 0:
+        # error if device not found at i2c addr (one register read instead of a scan of the whole bus)
+        try:
+            self._i2c.readfrom_mem(self._address, _MCP_IODIR, 1)
+        except OSError:
             raise OSError('MCP23017 not found at I2C address {:#x}'.format(self._address))
 
         self.porta = Port(0, self)
@@ -94,6 +106,17 @@ class MCP23017():
         self.pullup = 0x0000                     # gpio weak pull up resistor - when configured as input (0=disabled, 1=enabled)
         self.gpio = 0x0000                       # port (0=logic low, 1=logic high)
 
+    def restore(self):
+        # configuration and outputs from the shadow registers, the outputs before the directions - no glitch
+        config = self._config
+        self._config = 0x00     # a chip that was reset addresses its registers in bank 0
+        self.porta._write(_MCP_IOCON, config)
+        for port in (self.porta, self.portb):
+            if port._olat is not None:
+                port._write(_MCP_GPIO, port._olat)
+            if port._iodir is not None:
+                port._write(_MCP_IODIR, port._iodir)
+
     def config(self):
         io_config = self.porta.io_config
 
@@ -126,6 +149,25 @@ class MCP23017():
             return port.gpio & bit == bit
 
 
+    def output(self, pin, value):
+        # output pin set from the shadow of its port - one register write instead of the read-modify-write
+        # of pin() (IODIR and GPIO read and written, four transactions)
+        port = self.portb if pin > 7 else self.porta
+        olat = port._olat
+        if olat is None:
+            olat = port.gpio
+        bit = 1 << (pin & 7)
+        port._write(_MCP_GPIO, olat | bit if value else olat & ~bit)
+
+    # output latches as last written (shadow), read from the chip only before the first write
+    @property
+    def olat(self):
+        a = self.porta._olat
+        b = self.portb._olat
+        if a is None or b is None:
+            return self.gpio
+        return a | (b << 8)
+
     # gpio (GPIO register)
     @property
     def gpio(self):
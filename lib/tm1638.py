@@ -6,21 +6,32 @@
 
 from machine import Pin
 from time import sleep_us, sleep_ms
+import hotloops
 
 TM1638_CMD1 = const(64)  # 0x40 data command
 TM1638_CMD2 = const(192) # 0xC0 address command
 TM1638_CMD3 = const(128) # 0x80 display control command
 TM1638_DSP_ON = const(8) # 0x08 display on
 TM1638_FIXED = const(4)  # 0x04 fixed address mode
+TM1638_READ = const(2)   # 0x02 read key scan data
+TM1638_SPIN = const(16)  # busy loop of the SIO clock - clock pulses > 400 ns at 125 MHz
 
 
 class TM1638(object):
     """Library for the TM1638 LED display driver."""
-    def __init__(self, stb, clk, dio, brightness=7):
+    def __init__(self, stb, clk, dio, brightness=7, pins=None):
         self.stb = stb
         self.clk = clk
         self.dio = dio
 
+        # machine code for _byte where available (hotloops.py), pins - (clk, dio) GPIO numbers
+        # let it write the RP2040 GPIO registers directly instead of calling the Pin objects
+        if pins is not None and hotloops.tm_byte_sio is not None:
+            clk_mask, dio_mask = 1 << pins[0], 1 << pins[1]
+            self._byte = lambda b: hotloops.tm_byte_sio(clk_mask, dio_mask, b, TM1638_SPIN)
+        elif hotloops.NATIVE:
+            self._byte = lambda b: hotloops.tm_byte(clk, dio, b)
+
         if not 0 <= brightness <= 7:
             raise ValueError("Brightness out of range")
         self._brightness = brightness
@@ -84,6 +95,26 @@ class TM1638(object):
             self._byte(0x00)
         self.stb(1)
 
+    def keys(self, data=None):
+        """Read the 4 key scan bytes (K1-K3 x KS1-KS8) into data.
+        Bits 3 and 7 of every byte are always 0 on the chip."""
+        if data is None:
+            data = bytearray(4)
+        self.stb(0)
+        self._byte(TM1638_CMD1 | TM1638_READ)
+        self.dio.init(Pin.IN, Pin.PULL_UP)
+        sleep_us(2)  # Twait - the chip switches dio to output
+        for i in range(4):
+            value = 0
+            for bit in range(8):
+                self.clk(0)
+                value |= self.dio() << bit
+                self.clk(1)
+            data[i] = value
+        self.stb(1)
+        self.dio.init(Pin.OUT, value=0)
+        return data
+
     def write(self, data, pos=0):
         """Write to all 16 addresses from a given position.
         Order is left to right, 1st segment, 1st LED, 2nd segment, 2nd LED etc."""
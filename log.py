@@ -0,0 +1,157 @@
+# log.py - leveled logging of the picking wall
+# A log call only stores the level, ticks_ms, the message and up to three arguments in a preallocated
+# ring buffer - no formatting, no allocation, so it may be called from a hard IRQ. The records are formatted
+# later by drain() (main loop, or drain_task() under uasyncio) and written to the sink:
+#   'USB'  - print() to the USB console
+#   'UART' - L#B#9#<level>#<text> frames to the control application
+#   None   - kept in RAM, read with the LOG#B#9#DUMP command
+# The level is set in config.py and can be changed at runtime (LOG#B#9#<level>). Hot paths guard their debug
+# calls with "if __debug__:", a production build (mpy-cross -O1) removes those calls completely.
+# When the buffer is full the oldest records are overwritten and counted in dropped.
+
+from micropython import const
+from array import array
+import machine
+import time
+import config
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+_names = {DEBUG: 'D', INFO: 'I', WARNING: 'W', ERROR: 'E'}
+
+_size = config.LOG_BUFFER
+_levels = bytearray(_size)
+_ticks = array('L', [0] * _size)
+_msgs = [None] * _size
+_args = [None] * (3 * _size)
+_head = 0           # next record is written here
+_count = 0          # records waiting for drain
+_level = config.LOG_LEVEL
+dropped = 0
+sink = None         # callable(level, text), set by set_sink()
+
+
+def level(value=None):
+    # current level, or sets a new one
+    global _level
+    if value is not None:
+        _level = value
+    return _level
+
+
+def _put(lv, msg, a, b, c):
+    global _head, _count, dropped
+    state = machine.disable_irq()
+    i = _head
+    _levels[i] = lv
+    _ticks[i] = time.ticks_ms()
+    _msgs[i] = msg
+    _args[3 * i] = a
+    _args[3 * i + 1] = b
+    _args[3 * i + 2] = c
+    _head = i + 1 if i + 1 < _size else 0
+    if _count < _size:
+        _count += 1
+    else:
+        dropped += 1
+    machine.enable_irq(state)
+
+
+def debug(msg, a=None, b=None, c=None):
+    if _level <= DEBUG:
+        _put(DEBUG, msg, a, b, c)
+
+
+def info(msg, a=None, b=None, c=None):
+    if _level <= INFO:
+        _put(INFO, msg, a, b, c)
+
+
+def warning(msg, a=None, b=None, c=None):
+    if _level <= WARNING:
+        _put(WARNING, msg, a, b, c)
+
+
+def error(msg, a=None, b=None, c=None):
+    if _level <= ERROR:
+        _put(ERROR, msg, a, b, c)
+
+
+def _pop():
+    # the oldest record as (level, text) or None
+    global _count
+    state = machine.disable_irq()
+    if not _count:
+        machine.enable_irq(state)
+        return None
+    i = _head - _count
+    if i < 0:
+        i += _size
+    lv, t, msg = _levels[i], _ticks[i], _msgs[i]
+    a, b, c = _args[3 * i], _args[3 * i + 1], _args[3 * i + 2]
+    _msgs[i] = _args[3 * i] = _args[3 * i + 1] = _args[3 * i + 2] = None
+    _count -= 1
+    machine.enable_irq(state)
+    text = str(t) + ' ' + _names.get(lv, '?') + ' ' + str(msg)
+    for arg in (a, b, c):
+        if arg is not None:
+            text += ' ' + str(arg)
+    return lv, text
+
+
+def pending():
+    return _count
+
+
+def drain(limit=4):
+    # formats up to limit records and writes them to the sink, returns how many were written
+    if sink is None:
+        return 0
+    n = 0
+    while n < limit:
+        record = _pop()
+        if record is None:
+            break
+        sink(record[0], record[1])
+        n += 1
+    return n
+
+
+def dump(write):
+    # all buffered records to write(level, text), regardless of the sink
+    while True:
+        record = _pop()
+        if record is None:
+            return
+        write(record[0], record[1])
+
+
+async def drain_task(period_ms=100, limit=8):
+    # background drain for uasyncio based firmware
+    import uasyncio as asyncio
+    while True:
+        drain(limit)
+        await asyncio.sleep(period_ms / 1000)
+
+
+def usb_sink(lv, text):
+    print(text)
+
+
+def uart_sink(uart):
+    # L frames through the UART_com object, '!' and '%' in the text would break the framing
+    return lambda lv, text: uart.uart_write('L#B#9#' + _names.get(lv, '?') + '#' +
+                                            text.replace('!', ' ').replace('%', ' '))
+
+
+def set_sink(name, uart=None):
+    # 'USB', 'UART' (uart - UART_com object) or None
+    global sink
+    if name == 'USB':
+        sink = usb_sink
+    elif name == 'UART' and uart is not None:
+        sink = uart_sink(uart)
+    else:
+        sink = None
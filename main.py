@@ -3,35 +3,64 @@
 # Copyright: Tomasz Zgrys & WWSIS Horyzont
 
 
+import startup
+startup.phase('python')     # reset to main.py: interpreter, boot.py
 import micropython
 from machine import Timer
 from ptw import *
+import config
+import log
+import heap
+import trace
+import selftest
+import analytics
+from manifest import NO_SHELF
+from sync import WallSync
+from hotloops import led_merge
 
 micropython.alloc_emergency_exception_buf(100)
-micropython.mem_info()
 
 # turn on onboard LED to show it works ;
 __onboard_led_pin = Pin(25, Pin.OUT)
 __onboard_led_pin.high()
 
-# batch intitialization
+# all displays initialized together, the Display objects below only take their lcd
+init_displays()
+
+# batch intitialization - up to MAX_BATCHES active batches share the batch display,
+# b is the first one and is also used for wall-wide messages
+MAX_BATCHES = 3
+ROTATE_MS = 2500    # how long each active batch is shown on the batch display
 b = Batch()
+batches = [b]
+for i in range(MAX_BATCHES - 1):
+    batches.append(Batch(b.lcd))
+shown = 0           # index of the batch on the batch display
+rotate_time = 0
 
 # shelf intitialization - 9 pcs
 s = [None] * 9
 for i in range(len(s)):
     s[i] = Shelf(i)
+startup.phase('displays')
 
 # Uart initialization
 u = UART_com()
+log.set_sink(config.LOG_SINK, u)
+heap.init(u)        # gc threshold, heap telemetry - replaces the mem_info() printout
+startup.later(heap.probe)
+trace.start()       # capture for replay if config.TRACE is set
+
+# wall state for the control application - snapshot / delta subscription
+ws = WallSync(s, batches, u, state)
+startup.phase('uart')
 
-counter = 0         # counter of the number of beeps after the end of the process
 sound = 'ENABLED'
-time.sleep(5)       # wait 5s for other ICs to initialize
 t = True
 
 # timer initialization - for led flashing
 timer = Timer()
+led_frame = 0       # ticks_ms of the last frame sent to tm1638 - the quiet window for the gc starts there
 
 def blink_timer(state):
     # timer intitialization or deinitialization
@@ -53,7 +82,41 @@ def blink(l_on,l_off):
             __onboard_led_pin.low()
         t = not t
 
-def selftest():
+def selftest_result(quiet, shelf_no, device, probe):
+    # one probe result to the host, returns 1 if it failed
+    passed, us = probe
+    if not quiet:
+        u.send_message('SELFTEST', shelf_no, device + (' PASS' if passed else ' FAIL'), us)
+    if passed:
+        return 0
+    log.warning('selftest', device, shelf_no, us)
+    return 1
+
+
+def restore_lcd(shelf):
+    # the compartment display back to its order after the test wrote on it
+    if shelf.order_no is None:
+        shelf.clear_lcd()
+    else:
+        shelf.update_lcd()
+
+
+PICKING = ('U', 'M', 'Q', 'SCAN', 'UNREGISTER')     # commands that change orders, LEDs and displays
+walking = False     # the visual selftest walk owns the LEDs and the displays, picking and the buttons wait
+
+
+def run_selftest(quiet=False):
+    # generator run by test.step() in the main loop (selftest.py) - yields the ms to wait, commands are
+    # processed in the meantime (picking ones after the visual walk); quiet - started by a broadcast, nothing is sent
+    # electrical probes first, one display per main loop iteration
+    global walking
+    failures = selftest_result(quiet, 9, 'MCP', selftest.mcp(i2c))
+    failures += selftest_result(quiet, 9, 'TM1638', selftest.tm1638(tm))
+    for display in s + [b]:
+        failures += selftest_result(quiet, display.shelf_no, 'LCD', selftest.lcd(bus, display.screen))
+        yield 0
+    # visual walk of the LEDs and the displays
+    walking = True
     blink_timer("off")
     b.buzzer(4, 70, 40, sound)
     counter = 0
@@ -72,34 +135,54 @@ def selftest():
             s[counter].print_message(str(counter + 1), 0)
         tm.write([val1, val2, val1, val2, val1, val2, val1, val2])
         if counter > 0:
-            s[counter - 1].clear_lcd()
-        time.sleep_ms(250)
+            restore_lcd(s[counter - 1])
+        yield 250
         val1 *= 2
         counter += 1
     for i in range(3):      
         b.buzzer(1, 70, 40,sound)
         tm.write([255, 3, 255, 1, 255, 1, 255, 1])
-        time.sleep_ms(250)
+        yield 250
         tm.write([0, 0, 0, 0, 0, 0, 0, 0])
-        time.sleep_ms(250)
+        yield 250
     tm.write([0, 2])
     b.print_message('Test', 0)
     b.print_message('finished', 1)
     b.buzzer(4,70,40,sound)
-    b.clear_lcd()
+    yield 440       # 'Test finished' while it beeps
+    show_next_batch()
     blink_timer("on")
+    walking = False
+    if not quiet:
+        u.send_message('SELFTEST', 9, 'FINISHED', failures)
+    if u.update_list:
+        update_ptw()        # the picking commands that waited for the walk
+
+
+test = selftest.Task()     # the selftest in progress, stepped by the main loop
+
+l_on = bytearray(8)     # tm1638 registers - led on / led off phase of the blinking
+l_off = bytearray(8)
 
 def lonloff_clear():
     # clearing variables for tm1638 registers
-    global l_on, l_off
-    l_on = [0, 0, 0, 0, 0, 0, 0, 0]
-    l_off = [0, 0, 0, 0, 0, 0, 0, 0]
+    for i in range(8):
+        l_on[i] = 0
+        l_off[i] = 0
     check_batch()
 
 
+def finished_batch():
+    # True if an active batch is finished - indexed loop, no generator: called from the LED timer callback
+    for i in range(len(batches)):
+        if batches[i].finished and batches[i].batch_no is not None:
+            return True
+    return False
+
+
 def check_batch():
-    # updates data of tm1638 registers depending on the b.blink_batch_display flag or batch ending
-    if not b.blink_batch_display or b.finished:
+    # updates data of tm1638 registers depending on the b.blink_batch_display flag or the end of any active batch
+    if not b.blink_batch_display or finished_batch():
         l_on[1] |= 2
         l_off[1] |= 2
     else:
@@ -108,66 +191,205 @@ def check_batch():
 
 def tm1638_led_blink(timer):
     # computes data for tm1638 data registers
+    global led_frame
     lonloff_clear()
     for i in range(9):
         l1, l2 = s[i].led_value()
-        for j in range(8):
-            l_on[j] |= l1[j]
-            l_off[j] |= l2[j]
+        led_merge(l_on, l_off, l1, l2)      # hotloops.py - machine code where the port has it
     blink(l_on, l_off)
+    led_frame = time.ticks_ms()
+
+def fields(data, n):
+    # IndexError if the frame has less than n fields
+    if len(data) < n:
+        raise IndexError(n)
+
+
+def check_fields(data):
+    # the fields of a command checked before anything is changed - ValueError / IndexError for a malformed frame
+    # (missing fields, a number that is not one, no such compartment, a separator in a batch or order number)
+    command = data[0]
+    if command == 'U':
+        fields(data, 5)
+        if data[1] == 'S':
+            fields(data, 6)
+            shelf_index(data[2])
+            identifier(data[3])
+            quantity(data[4])
+            quantity(data[5])
+        else:
+            int(data[2])
+        if data[1] == 'B':
+            fields(data, 6)
+            identifier(data[3])
+            quantity(data[4])
+            quantity(data[5])
+            if len(data) > 6:
+                for c in data[6]:
+                    shelf_index(c)
+    elif command == 'M':
+        fields(data, 5)
+        if data[1] == 'S' and len(data) >= 6:
+            shelf_index(data[2])
+            identifier(data[3])
+            int(data[5])
+        elif data[1] == 'Q' and len(data) >= 7:
+            identifier(data[4])
+            int(data[6])
+    elif command == 'Q':
+        fields(data, 6)
+        identifier(data[4])
+        int(data[5])
+    elif command in ('SCAN', 'UNREGISTER'):
+        fields(data, 4)
+    elif command == 'SOUND':
+        fields(data, 5)
+    elif command == 'BLIP':
+        fields(data, 6)
+        if data[3] and data[4] and data[5]:
+            quantity(data[3])
+            quantity(data[4])
+            quantity(data[5])
+
 
 def update_ptw():
     # take action based on control commands
     global sound
-    for data in u.update_list:
-                      
+    for data in u.update_list[:]:
+        if data not in u.update_list:
+            # already consumed in this pass (READY? clears the list)
+            continue
+        if walking and data[0].lstrip('*') in PICKING:
+            # kept for the end of the selftest walk (run_selftest)
+            continue
+        u.muted = data[0][:1] == '*'
+        if u.muted:
+            # broadcast to all walls on the bus - executed without any reply
+            data[0] = data[0][1:]
+
+        try:
+            check_fields(data)
+        except (ValueError, IndexError) as e:
+            # malformed frame - answered with an error and dropped before anything changed, the wall goes on
+            log.warning('rx bad', data, e)
+            u.send_message('E', 9, 'ERROR', data[0])
+            u.update_list.remove(data)
+            continue
+
         if data[0] == 'U':
-            if len(data) >= 5:
-                update_data(data)
-            else:
-                u.send_message('E',9,'ERROR') 
+            update_data(data)
+        elif data[0] == 'M':
+            update_manifest(data)
+            u.update_list.remove(data)
+        elif data[0] == 'Q':
+            enqueue_order(data)
+            u.update_list.remove(data)
+        elif data[0] == 'SCAN':
+            scan_sku(data[3])
+            u.update_list.remove(data)
         elif data[0] == 'UNREGISTER':
-            if data[3] == b.batch_no:
+            batch = find_batch(data[3])
+            if batch is not None:
                 b.print_message('UNREGISTERING')
-                b.end_time = time.ticks_ms()
-                for shelf in s:
+                batch.end_time = time.ticks_ms()
+                if not state.done(batch.shelves):
+                    log.warning('unregister open', batch.batch_no, batch.shelves & state.mask(shelfstate.ORDER))
+                shelves = batch.shelves
+                while shelves:
+                    shelf = s[state.first(shelves)]
+                    shelves &= ~shelf.bit
                     shelf.shelf_init()
                     shelf.clear_lcd()
                 u.update_list.remove(data)            
                 b.buzzer(3,20,20,sound)      
-                u.send_message('UNREGISTER',9,'BATCH UNREGISTERED',b.batch_no)
-                tm.write([0, 2])
+                bus.sleep_ms(3 * (20 + 20))     # 'UNREGISTERING' while it beeps, with the sound on or off
+                u.send_message('UNREGISTER',9,'BATCH UNREGISTERED',batch.batch_no)
                 b.print_message('BATCH',0)
                 b.print_message('UNREGISTERED',1)
-                b.batch_init()
-                time.sleep_ms(500)
+                batch.batch_init()
+                bus.sleep_ms(500)
                 b.buzzer(1,500,1,sound)
+                bus.sleep_ms(500)
                 b.clear_lcd()
+                show_next_batch()
             else:
                 b.print_message('Batch  number',0)
                 b.print_message("doesn't match",1)
                 b.buzzer(5,20,20,sound)
-                time.sleep_ms(1000)
-                u.send_message('UNREGISTER',9,'FAILED',b.batch_no)
-                b.update_lcd()
+                bus.sleep_ms(1000)
+                u.send_message('UNREGISTER',9,'FAILED',data[3])
+                u.update_list.remove(data)
+                show_next_batch()
         elif data[0] == 'SOUND':
             if data[4] == 'ENABLED':
                 sound = 'ENABLED'
             elif data[4] == 'DISABLED':
-                sound == 'DISABLED'
+                sound = 'DISABLED'
             u.update_list.remove(data)
         elif data[0] == 'SELFTEST':
+            # runs in the background (run_selftest), the results and FINISHED follow
             u.send_message('SELFTEST',9,'IN PROGRESS')
-            selftest()
-            u.send_message('SELFTEST',9,'FINISHED')
+            if not test.running():
+                test.start(run_selftest(u.muted))
+            u.update_list.remove(data)
+        elif data[0] == 'SNAPSHOT':
+            ws.send_snapshot()
+            u.update_list.remove(data)
+        elif data[0] == 'SUBSCRIBE':
+            ws.subscribe(len(data) > 3 and data[3] == 'ON')
+            u.update_list.remove(data)
+        elif data[0] == 'LOG':
+            # LOG#B#9#<level> - runtime log level, LOG#B#9#DUMP - buffered records as L frames
+            if len(data) > 3 and data[3] == 'DUMP':
+                log.dump(log.uart_sink(u))
+            elif len(data) > 3 and data[3].isdigit():
+                log.level(int(data[3]))
+            u.update_list.remove(data)
+        elif data[0] == 'BOOT':
+            # boot phase timings - ms from reset to READY, ms of every phase
+            u.send_message('BOOT', 9, startup.report(), startup.ready_ms())
+            u.update_list.remove(data)
+        elif data[0] == 'TRACE':
+            # TRACE#B#9#FLASH|USB - start a capture (trace.py), TRACE#B#9#OFF - stop it; reply: its counters
+            if len(data) > 3 and data[3] == 'OFF':
+                trace.stop()
+            elif len(data) > 3:
+                trace.start(data[3])
+            u.send_message('TRACE', 9, trace.report())
+            u.update_list.remove(data)
+        elif data[0] == 'HEAP':
+            # heap telemetry - free / allocated / largest block, collections and their pauses
+            u.send_message('H', 9, heap.report())
+            u.update_list.remove(data)
+        elif data[0] == 'BUS':
+            # I2C bus health (scheduler.py) - errors, recoveries and their us, down, offline displays
+            u.send_message('BUS', 9, bus.report())
+            u.update_list.remove(data)
+        elif data[0] == 'STATS':
+            # pick rate analytics - the compartments, then every metric (BATCH last); STATS#B#9#RESET clears them
+            if len(data) > 3 and data[3] == 'RESET':
+                analytics.reset()
+            for shelf_no in range(len(s)):
+                n = analytics.orders(shelf_no)
+                if n:
+                    u.send_message('STATS', shelf_no, analytics.shelf_report(shelf_no), n)
+            for metric in range(len(analytics.NAMES)):
+                u.send_message('STATS', 9, analytics.report(metric), analytics.NAMES[metric])
+            u.update_list.remove(data)
+        elif data[0] == 'POLL':
             u.update_list.remove(data)
+            u.poll_reply()
         elif data[0] == 'READY?':
             u.send_message('READY',9,'SELFTEST?')
             u.update_list.clear()
         elif data[0] == 'BLIP':
             if data[3] and data[4] and data[5]:
-                b.buzzer(int(data[3]),int(data[4]),int(data[5]),sound)    
+                b.buzzer(quantity(data[3]),quantity(data[4]),quantity(data[5]),sound)
             u.update_list.remove(data)
+        else:
+            u.send_message('E', 9, 'ERROR', data[0])
+            u.update_list.remove(data)
+    u.muted = False
                 
         
 
@@ -194,72 +416,313 @@ def check_conformation(data, shelf_no):
         return False
 
 
+def shelf_index(text):
+    # compartment number from a frame, ValueError if the wall has no such compartment
+    shelf_no = int(text)
+    if not 0 <= shelf_no < len(s):
+        raise ValueError(text)
+    return shelf_no
+
+
+def quantity(text):
+    # count from a frame (orders, carts, items, beeps), ValueError outside 0..65535 - the limit of the manifest
+    value = int(text)
+    if not 0 <= value < 0x10000:
+        raise ValueError(text)
+    return value
+
+
+def identifier(text):
+    # batch / order number from a frame, ValueError if empty or holding a separator of the SNAP / D frames (sync.py)
+    if not text or ',' in text or ';' in text or '|' in text or '=' in text:
+        raise ValueError(text)
+    return text
+
+
+def find_batch(batch_no):
+    # active batch with the given number, find_batch(None) returns a free batch slot
+    for batch in batches:
+        if batch.batch_no == batch_no:
+            return batch
+    return None
+
+
+def shelf_batch(shelf_no):
+    # active batch owning the shelf or None
+    for batch in batches:
+        if batch.batch_no is not None and batch.shelves & (1 << shelf_no):
+            return batch
+    return None
+
+
+def batch_slot(shelf_no):
+    # index of the batch owning the shelf - its analytics group, analytics.NO_GROUP without one
+    for k in range(len(batches)):
+        if batches[k].batch_no is not None and batches[k].shelves & (1 << shelf_no):
+            return k
+    return analytics.NO_GROUP
+
+
+def owned_shelves():
+    # bitmask of the shelves owned by the active batches
+    mask = 0
+    for batch in batches:
+        mask |= batch.shelves
+    return mask
+
+
+def show_batch(batch, l=2):
+    # puts the batch on the batch display, a different batch needs both lines redrawn
+    global shown, rotate_time
+    if batches[shown] is not batch:
+        shown = batches.index(batch)
+        l = 2
+    rotate_time = time.ticks_ms()
+    batch.update_lcd(l)
+    if batch.finished:
+        b.print_message('Unregister Batch' if batch.finish_beeps % 2 else 'Batch completed', 0)
+        # the analytics of this batch (its slot, the samples of its compartments) take turns with the batch number
+        phase = batch.finish_beeps % 4
+        if phase == 1:
+            b.print_message('Time ' + analytics.seconds(time.ticks_diff(batch.end_time, batch.start_time)), 1)
+        elif phase == 2:
+            b.print_message('Fill p50 ' + analytics.seconds(analytics.percentile(analytics.FILL, 50, shown)), 1)
+        elif phase == 3:
+            b.print_message('Scan p50 ' + analytics.seconds(analytics.percentile(analytics.SCAN, 50, shown)), 1)
+
+
+def next_batch():
+    # next active batch after the displayed one (the displayed one if it is the only one) or None
+    for i in range(1, len(batches) + 1):
+        batch = batches[(shown + i) % len(batches)]
+        if batch.batch_no is not None:
+            return batch
+    return None
+
+
+def show_next_batch():
+    # rotates the batch display to the next active batch
+    batch = next_batch()
+    if batch is None:
+        b.clear_lcd()
+    else:
+        show_batch(batch)
+
+
+def rotate_batch_display():
+    # every ROTATE_MS the next active batch is shown on the batch display,
+    # a finished batch alternates its completion messages and beeps until it is unregistered
+    global rotate_time
+    if walking or time.ticks_diff(time.ticks_ms(), rotate_time) < ROTATE_MS:
+        return
+    batch = next_batch()
+    if batch is None or (batch is batches[shown] and not batch.finished):
+        rotate_time = time.ticks_ms()
+        return
+    if batch.finished:
+        batch.finish_beeps += 1
+        if batch.finish_beeps <= 4:
+            b.buzzer(5,40,40,sound)
+    show_batch(batch)
+
+
+def register_batch(data):
+    # U#B#9#<batch_no>#<orders_qty>#<carts_qty>[#<shelves>] - shelves as digits (e.g. 0123),
+    # without them the batch gets all shelves not owned by other batches
+    if find_batch(identifier(data[3])) is not None:
+        b.print_message("Batch exist !!!", 0)
+        u.send_message('E', 9, 'NE')
+        u.update_list.remove(data)
+        return
+    orders_qty = quantity(data[4])     # numbers first - a malformed frame leaves the slot free
+    carts_qty = quantity(data[5])
+    batch = find_batch(None)
+    free = ((1 << len(s)) - 1) & ~owned_shelves()
+    wanted = free
+    if len(data) > 6 and data[6]:
+        wanted = 0
+        for c in data[6]:
+            wanted |= 1 << int(c)
+    if batch is None or not wanted or wanted & ~free:
+        b.print_message("Batch error", 0)
+        u.send_message('E', 9, 'FI')
+        u.update_list.remove(data)
+        return
+    batch.blink_batch_display = False
+    batch.batch_no = data[3]
+    batch.orders_qty = orders_qty
+    batch.carts_qty = carts_qty
+    batch.shelves = wanted
+    batch.start_time = time.ticks_ms()
+    analytics.forget(batches.index(batch))      # the samples of the previous batch in this slot
+    show_batch(batch)
+    u.send_message('C', 9,'BA',batch.batch_no)
+    u.update_list.remove(data)
+    b.buzzer(3,30,40,sound)
+
+
 def update_data(data):
     # updating objects data
-    shelf_no = int(data[2])
+    shelf_no = shelf_index(data[2]) if data[1] == 'S' else int(data[2])
     if data[0] == 'U':
-        if b.batch_no is not None:
-            if data[1] == 'S':
-                if s[shelf_no].order_no is not None:
-                    if check_conformation(data, shelf_no):
-                        s[shelf_no].waiting_front_conf = True
-                        u.to_confirm.update({int(data[2]): data})
-                        u.update_list.remove(data)
-                else:
-                    s[shelf_no].order_no = data[3]
-                    s[shelf_no].items_qty = int(data[5])
-                    s[shelf_no].shelf_empty = False
-                    s[shelf_no].shelf_full = False
+        if data[1] == 'B':
+            register_batch(data)
+        elif owned_shelves() == 0:
+            b.print_message('First', 0)
+            b.print_message('assign batch !', 1)
+            b.blink_batch_display = True
+            u.send_message('E', 9,'BNA')
+            u.update_list.clear()
+        elif data[1] == 'S':
+            if shelf_batch(shelf_no) is None:
+                u.send_message('E', shelf_no, 'BNA')
+                u.update_list.remove(data)
+            elif s[shelf_no].order_no is not None:
+                if check_conformation(data, shelf_no):
                     s[shelf_no].waiting_front_conf = True
-                    u.to_confirm.update({shelf_no: data})
-                    s[shelf_no].update_lcd()
-                    u.update_list.remove(data)
-            elif data[1] == 'B':                    
-                if data[3] == b.batch_no:
-                    b.print_message("Batch exist !!!", 0)
-                    u.send_message('E', 9, 'NE')
-                    u.update_list.remove(data)
-                else:
-                    b.print_message("Batch error", 0)
-                    u.send_message('E', 9, 'FI')
+                    analytics.scan(batch_slot(shelf_no))
+                    u.to_confirm.update({int(data[2]): data})
                     u.update_list.remove(data)
             else:
-                b.print_message('Type error', 0)
-                u.send_message('E', 9, 'TE')
+                items_qty = quantity(data[5])
+                quantity(data[4])       # the item number is compared at the front confirmation
+                s[shelf_no].order_no = data[3]
+                s[shelf_no].items_qty = items_qty
+                s[shelf_no].shelf_empty = False
+                s[shelf_no].shelf_full = False
+                s[shelf_no].waiting_front_conf = True
+                analytics.scan(batch_slot(shelf_no))
+                u.to_confirm.update({shelf_no: data})
+                s[shelf_no].update_lcd()
                 u.update_list.remove(data)
         else:
-            if data[1] == 'B':
-                b.blink_batch_display = False
-                b.batch_no = data[3]
-                b.orders_qty = int(data[4])
-                b.carts_qty = int(data[5])
-                b.start_time = time.ticks_ms()
-                b.update_lcd()
-                u.send_message('C', 9,'BA',b.batch_no)
-                u.update_list.remove(data)
-                b.buzzer(3,30,40,sound)
-            else:
-                b.print_message('First', 0)
-                b.print_message('assign batch !', 1)
-                b.blink_batch_display = True
-                u.send_message('E', 9,'BNA')
-                u.update_list.clear()
+            b.print_message('Type error', 0)
+            u.send_message('E', 9, 'TE')
+            u.update_list.remove(data)
+
+
+def update_manifest(data):
+    # manifest upload after batch registration:
+    # M#S#<shelf_no>#<order_no>#<sku>#<qty> - expected SKU of the order assigned to the compartment
+    # M#Q#9#<batch_no>#<order_no>#<sku>#<qty> - expected SKU of a queued order
+    # M#B#9#<batch_no>#END - manifest complete, compartments get their orders
+    if data[1] == 'S' and len(data) >= 6:
+        shelf_no = shelf_index(data[2])
+        batch = shelf_batch(shelf_no)
+        if batch is None:
+            u.send_message('E', 9, 'BNA')
+        elif s[shelf_no].order_no not in (None, identifier(data[3])):
+            u.send_message('E', 9, 'SO', data[3])
+        elif not batch.manifest.add(shelf_no, data[3], data[4], int(data[5])):
+            u.send_message('E', 9, 'MF', data[3])
+    elif data[1] == 'Q' and len(data) >= 7:
+        batch = find_batch(data[3])
+        if batch is None:
+            u.send_message('E', 9, 'BNA')
+        elif not batch.manifest.add(NO_SHELF, identifier(data[4]), data[5], int(data[6])):
+            u.send_message('E', 9, 'MF', data[4])
+        else:
+            # the order may already sit in a compartment while its lines are still arriving
+            m = batch.manifest
+            o = m.order_index(data[4])
+            if m.order_shelf[o] < len(s) and s[m.order_shelf[o]].order_no == data[4]:
+                s[m.order_shelf[o]].items_qty = m.order_qty[o]
+                s[m.order_shelf[o]].update_lcd(1)
+    elif data[1] == 'B' and data[4] == 'END':
+        batch = find_batch(data[3])
+        if batch is None:
+            u.send_message('E', 9, 'BNA')
+            return
+        m = batch.manifest
+        for o in range(len(m.order_no)):
+            if m.order_shelf[o] >= len(s):
+                continue
+            shelf = s[m.order_shelf[o]]
+            if shelf.order_no is None:
+                shelf.order_no = m.order_no[o]
+                shelf.shelf_empty = False
+                shelf.shelf_full = False
+            shelf.items_qty = m.order_qty[o]
+            shelf.update_lcd()
+        u.send_message('C', 9, 'MA', m.entries)
+        assign_queued(batch)
+    else:
+        b.print_message('Type error', 0)
+        u.send_message('E', 9, 'TE')
+
+
+def enqueue_order(data):
+    # Q#B#9#<batch_no>#<order_no>#<items_qty> - pending order of the batch, it goes to the first
+    # compartment of the batch that is free
+    batch = find_batch(data[3])
+    if batch is None:
+        u.send_message('E', 9, 'BNA')
+    elif not batch.manifest.enqueue(identifier(data[4]), int(data[5])):
+        u.send_message('E', 9, 'QF', data[4])
+    else:
+        assign_queued(batch)
+
+
+def assign_queued(batch):
+    # moves queued orders of the batch into its free compartments, the host is notified with QA
+    m = batch.manifest
+    free = state.free() & batch.shelves
+    while free:
+        o = m.next_queued()
+        if o < 0:
+            return
+        shelf = s[state.first(free)]
+        free &= ~shelf.bit
+        m.assign(o, shelf.shelf_no)
+        shelf.order_no = m.order_no[o]
+        shelf.items_qty = m.order_qty[o]
+        shelf.shelf_empty = False
+        shelf.update_lcd()
+        u.send_message('C', shelf.shelf_no, 'QA', shelf.order_no)
+
+
+def scan_sku(sku):
+    # SKU scanned without order data - the manifests of the active batches resolve the compartment
+    busy = state.free() | state.mask(shelfstate.WAIT_FRONT) | state.mask(shelfstate.FULL)
+    slot = -1
+    for batch in batches:
+        if batch.batch_no is not None:
+            found = batch.manifest.resolve(sku, busy)
+            if found >= 0:
+                slot = found
+                break
+            slot = min(slot, found)
+    if slot == -1:
+        u.send_message('E', 9, 'SU', sku)
+    elif slot == -2:
+        u.send_message('E', 9, 'SW', sku)
+    else:
+        shelf = s[batch.manifest.take(slot)]
+        shelf.waiting_front_conf = True
+        analytics.scan(batches.index(batch))
+        u.to_confirm.update({shelf.shelf_no: ['SCAN', 'S', str(shelf.shelf_no), shelf.order_no,
+                                              str(shelf.item_no + 1), str(shelf.items_qty)]})
+        u.send_message('C', shelf.shelf_no, 'SR', shelf.order_no)
 
 
 lonloff_clear()      # clear register data for tm1638
 blink_timer("on")    # start timer for led flashing
 
+# the wall is ready - the control application learns it without asking, the id is the boot time in ms;
+# BOOTED instead of the SELFTEST? of the READY? reply, so the host can tell it from an answer
+startup.phase('ready')
+u.send_message('READY', 9, 'BOOTED', startup.ready_ms())
+startup.run_later()
+startup.phase('later')
+
 # main loop
 while True:
     
-    if b.batch_no is None:
-        b.blink_batch_display = True
-    else:
-        b.blink_batch_display = False
+    b.blink_batch_display = owned_shelves() == 0
 
     u.uart_read()
 
-    if u.__rx_data:
+    if u._rx_data:
         #read data from uart buffer
         u.receive_commands()
         if u.received_commands:
@@ -267,18 +730,24 @@ while True:
             update_ptw()
             #micropython.mem_info() # - for debugging purposes
 
-    for shelf in s:
-        # checking shelf objects
+    # shelves with a confirmation to handle - front pressed, or back pressed on a full shelf
+    # (kept while the selftest walk runs)
+    pressed = 0 if walking else (state.mask(shelfstate.BUTTON_FRONT) |
+                                 (state.mask(shelfstate.BUTTON_BACK) & state.mask(shelfstate.FULL)))
+    while pressed:
+        shelf = s[state.first(pressed)]
+        pressed &= ~shelf.bit
         if shelf.button_front:
             if int(u.to_confirm.get(shelf.shelf_no)[4]) == shelf.item_no:
                 b.buzzer(1,8,1,sound)            
                 u.send_message('C', shelf.shelf_no, 'BFP', shelf.order_no)
-                shelf.update_lcd(1)
-                time.sleep_ms(350) 
+                shelf.update_lcd(1, scheduler.ACTIVE)
+                bus.sleep_ms(350)
                 if shelf.item_no == shelf.items_qty:
                     shelf.shelf_full = True
                     shelf.waiting_back_conf = True
                     shelf.waiting_front_conf = False
+                    analytics.full(shelf, batch_slot(shelf.shelf_no))
                     u.send_message('C', shelf.shelf_no, 'SFD',shelf.order_no)
                 shelf.button_front = False
                 u.to_confirm.pop(shelf.shelf_no)
@@ -286,27 +755,34 @@ while True:
         elif shelf.button_back is True and shelf.shelf_full is True:
             b.buzzer(1,10,1,sound) 
             u.send_message('C', shelf.shelf_no, 'BBP',shelf.order_no)
+            batch = shelf_batch(shelf.shelf_no)
+            analytics.emptied(shelf, batch_slot(shelf.shelf_no))
             shelf.shelf_init()
-            shelf.clear_lcd()
-            if b.orders_qty > 0:
-                b.orders_qty -= 1
-                if b.orders_qty == 0:
-                    u.send_message('C',9,'BATCH FINISHED',b.batch_no)
-                    b.finished = True
+            shelf.clear_lcd(prio=scheduler.ACTIVE)
+            if batch is not None and batch.orders_qty > 0:
+                batch.orders_qty -= 1
+                batch.manifest.release(shelf.shelf_no)
+                assign_queued(batch)
             else:
                 b.print_message('Qty. orders error', 0)
                 u.send_message('E', 9, 'FQ')
-            b.update_lcd(1)
-    if b.finished == False:
-        counter = 0
-    if b.orders_qty == 0 and b.finished == True:
-        b.print_message('Batch completed',0)
-        time.sleep_ms(900)
-        b.print_message('Unregister Batch',0)
-        if counter <4:
-            b.buzzer(5,40,40,sound)
-            counter += 1
-        time.sleep_ms(500)
+            if batch is not None and not batch.finished:
+                # all orders counted and none of them left in the compartments of the batch
+                if batch.orders_qty == 0 and state.done(batch.shelves):
+                    u.send_message('C',9,'BATCH FINISHED',batch.batch_no)
+                    batch.finished = True
+                    analytics.batch(batch)
+                show_batch(batch, 1)
+
+    rotate_batch_display()
+    bus.run()           # display text and beeps (scheduler.py)
+    test.step()         # selftest in progress
+    ws.poll()           # deltas for the subscribed control application
+    log.drain()
+    trace.drain()
+    if not u.update_list and time.ticks_diff(time.ticks_ms(), led_frame) < 200:
+        # nothing to do and the next LED frame is 250+ ms away - collect now, not in a confirmation
+        heap.idle()
 
 
 
@@ -0,0 +1,153 @@
+# manifest.py - batch manifest for the picking wall
+# Orders of the registered batch, the compartment assigned to each order and the expected
+# SKUs with quantities, kept in a compact open addressing hash index (no SKU strings stored)
+# Orders without a compartment form the queue of the batch, they get a compartment as soon as one is freed
+# Manifest class - building the index from 'M'/'Q' frames and resolving scanned SKUs
+
+from micropython import const
+from array import array
+
+_MAX_ORDERS = const(64)     # orders per batch (on the wall and queued)
+_SLOTS = const(512)         # hash table size - power of two
+_MAX_ENTRIES = const(384)   # SKU lines per batch - keeps the table at most 75% full
+NO_SHELF = const(0xFF)      # order queued, not assigned to any compartment yet
+_DONE = const(0xFE)         # order emptied from its compartment
+
+
+_FNV_BASIS = const(0x011c9dc5)      # 0x811c9dc5 cut to 30 bits
+
+
+def sku_hash(sku):
+    # 30-bit FNV-1a hash of the SKU, 0 marks an empty slot
+    # h * 0x01000193 (2^24 + 403) modulo 2^30 on 15-bit halves - every intermediate stays below 2^30,
+    # a small int on the PICO, so hashing a scanned SKU does not allocate
+    h = _FNV_BASIS
+    for c in sku:
+        h ^= ord(c)
+        lo = (h & 0x7fff) * 403
+        hi = ((h >> 15) * 403 + (lo >> 15) + ((h & 0x3f) << 9)) & 0x7fff
+        h = (hi << 15) | (lo & 0x7fff)
+    return h or 1
+
+
+class Manifest():
+    # SKU -> order -> compartment index, all lookups are O(1) on average
+    def __init__(self):
+        self.keys = array('L', [0] * _SLOTS)      # SKU hash per slot
+        self.left = array('H', [0] * _SLOTS)      # items still expected per slot
+        self.entry_order = bytearray(_SLOTS)      # order index per slot
+        self.order_shelf = bytearray(_MAX_ORDERS)
+        self.order_qty = array('H', [0] * _MAX_ORDERS)
+        self.manifest_init()
+
+    def manifest_init(self):
+        # forget the previous batch, the buffers are reused
+        for i in range(_SLOTS):
+            self.keys[i] = 0
+            self.left[i] = 0
+        for i in range(_MAX_ORDERS):
+            self.order_shelf[i] = NO_SHELF
+            self.order_qty[i] = 0
+        self.order_no = []
+        self.entries = 0
+        self.queue_head = 0         # all orders below it have been assigned a compartment
+
+    def order_index(self, order_no):
+        # index of the order in the manifest or -1
+        for i in range(len(self.order_no)):
+            if self.order_no[i] == order_no:
+                return i
+        return -1
+
+    def shelf_order(self, shelf_no):
+        # index of the order assigned to the compartment or -1
+        for i in range(len(self.order_no)):
+            if self.order_shelf[i] == shelf_no:
+                return i
+        return -1
+
+    def add_order(self, shelf_no, order_no):
+        # new order in the compartment or in the queue (shelf_no NO_SHELF), -1 if it does not fit
+        if len(self.order_no) >= _MAX_ORDERS or (shelf_no != NO_SHELF and self.shelf_order(shelf_no) >= 0):
+            return -1
+        o = len(self.order_no)
+        self.order_no.append(order_no)
+        self.order_shelf[o] = shelf_no
+        return o
+
+    def enqueue(self, order_no, qty):
+        # queued order without SKU lines, only its quantity is known
+        if self.order_index(order_no) >= 0 or not 0 < qty < 0x10000:
+            return False
+        o = self.add_order(NO_SHELF, order_no)
+        if o < 0:
+            return False
+        self.order_qty[o] = qty
+        return True
+
+    def add(self, shelf_no, order_no, sku, qty):
+        # adds one manifest line, returns False if the line does not fit or contradicts the manifest
+        if self.entries >= _MAX_ENTRIES or not 0 < qty < 0x10000:
+            return False
+        o = self.order_index(order_no)
+        if o < 0:
+            o = self.add_order(shelf_no, order_no)
+            if o < 0:
+                return False
+        elif (shelf_no != NO_SHELF and self.order_shelf[o] != shelf_no) or self.order_shelf[o] == _DONE:
+            return False
+        elif self.order_qty[o] + qty > 0xFFFF:
+            return False
+        h = sku_hash(sku)
+        i = h & (_SLOTS - 1)
+        while self.keys[i]:
+            if self.keys[i] == h and self.entry_order[i] == o:
+                # the same SKU listed twice for one order
+                self.left[i] += qty
+                self.order_qty[o] += qty
+                return True
+            i = (i + 1) & (_SLOTS - 1)
+        self.keys[i] = h
+        self.left[i] = qty
+        self.entry_order[i] = o
+        self.order_qty[o] += qty
+        self.entries += 1
+        return True
+
+    def resolve(self, sku, busy=0):
+        # slot of an order on the wall still waiting for this SKU, compartments set in the busy
+        # bitmask are skipped; -1 if the SKU is unknown, -2 if no compartment can take it now
+        h = sku_hash(sku)
+        i = h & (_SLOTS - 1)
+        found = -1
+        while self.keys[i]:
+            if self.keys[i] == h:
+                shelf_no = self.order_shelf[self.entry_order[i]]
+                if self.left[i] and shelf_no < _DONE and not busy & (1 << shelf_no):
+                    return i
+                found = -2
+            i = (i + 1) & (_SLOTS - 1)
+        return found
+
+    def take(self, slot):
+        # one item of the slot goes to its compartment, returns the compartment number
+        self.left[slot] -= 1
+        return self.order_shelf[self.entry_order[slot]]
+
+    def next_queued(self):
+        # oldest order waiting for a compartment or -1
+        while self.queue_head < len(self.order_no):
+            if self.order_shelf[self.queue_head] == NO_SHELF:
+                return self.queue_head
+            self.queue_head += 1
+        return -1
+
+    def assign(self, o, shelf_no):
+        # queued order goes to the freed compartment
+        self.order_shelf[o] = shelf_no
+
+    def release(self, shelf_no):
+        # the compartment was emptied, its order is done
+        o = self.shelf_order(shelf_no)
+        if o >= 0:
+            self.order_shelf[o] = _DONE
@@ -0,0 +1,65 @@
+# native.py - machine code versions of the hot loops (micropython.native / micropython.viper)
+# Never imported directly - hotloops.py imports it and falls back to its bytecode versions when this module
+# cannot be compiled (a port without the emitters raises SyntaxError) or when it runs under CPython.
+
+import sys
+import micropython
+
+if sys.implementation.name != 'micropython':
+    raise ImportError('native code needs MicroPython')
+
+SIO = sys.platform == 'rp2'     # the RP2040 GPIO set / clear registers can be written directly
+
+
+@micropython.native
+def tm_byte(clk, dio, b):
+    # TM1638 byte, LSB first, through the Pin objects
+    for i in range(8):
+        clk(0)
+        dio((b >> i) & 1)
+        clk(1)
+
+
+@micropython.viper
+def tm_byte_sio(clk: int, dio: int, b: int, spin: int):
+    # TM1638 byte through the SIO registers of the RP2040, clk / dio - GPIO bit masks
+    # spin - busy loop after each clock edge, the TM1638 needs 400 ns clock pulses
+    out_set = ptr32(0xd0000014)
+    out_clr = ptr32(0xd0000018)
+    i = 0
+    while i < 8:
+        out_clr[0] = clk
+        if (b >> i) & 1:
+            out_set[0] = dio
+        else:
+            out_clr[0] = dio
+        n = 0
+        while n < spin:
+            n += 1
+        out_set[0] = clk
+        n = 0
+        while n < spin:
+            n += 1
+        i += 1
+
+
+@micropython.viper
+def lcd_nibble(nibble: int, pins: ptr8) -> int:
+    # MCP23017 bits of the HD44780 D4-D7 lines for one nibble, pins - GPIO numbers of D4-D7
+    bits = 0
+    i = 0
+    while i < 4:
+        if (nibble >> i) & 1:
+            bits |= 1 << pins[i]
+        i += 1
+    return bits
+
+
+@micropython.viper
+def led_merge(on: ptr8, off: ptr8, shelf_on: ptr8, shelf_off: ptr8):
+    # ORs the TM1638 registers of one shelf into the frame
+    i = 0
+    while i < 8:
+        on[i] = on[i] | shelf_on[i]
+        off[i] = off[i] | shelf_off[i]
+        i += 1
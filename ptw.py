@@ -7,145 +7,237 @@
 # Display class - control of displays
 # LED1638 class - controlling the appriopriate LED's
 # Uart_com class - cummunication via UART
+# (the batch manifest with the SKU index is in manifest.py)
 
 from micropython import const
 from machine import Pin, I2C, UART
+import startup
 
 # turn on onboard LED to show it works ;
-__onboard_led_pin = Pin(25, Pin.OUT)
+_onboard_led_pin = Pin(25, Pin.OUT)
 
 import uasyncio as asyncio
 import tm1638
 import i2c23_lcd1602 as D
 import mcp23017 as MCP
 import time
+import config
+import log
+import fmt
+import scheduler
+import trace
+import shelfstate
+from manifest import Manifest
+startup.phase('imports')
 
 # initialization of MCP23017 - GPIO Extender & LCD Displays
-i2c = I2C(0, scl=Pin(5), sda=Pin(4), freq=400_000)
-
-__gpio_mcp = MCP.MCP23017(i2c, 0x20)
-__lcd_mcp_e_pins = (5, 6, 7, 8, 9, 10, 11, 12, 13, 14)
-__buzzer_mcp_pin = (15)
-# __lcd_mcp_batch_e_pin = const(14)
-__lcd_mcp_rs_pin = const(0)
-__lcd_mcp_d4_pin = const(1)
-__lcd_mcp_d5_pin = const(2)
-__lcd_mcp_d6_pin = const(3)
-__lcd_mcp_d7_pin = const(4)
-__lcd_columns = const(16)
-__lcd_rows = const(2)
+# the expander may still be in its power-on reset - probed with bounded retries
+# every transaction ends within I2C_TIMEOUT_US, a stuck bus raises OSError instead of blocking
+_i2c_scl_pin = const(5)
+_i2c_sda_pin = const(4)
+i2c = I2C(0, scl=Pin(_i2c_scl_pin), sda=Pin(_i2c_sda_pin), freq=400_000, timeout=config.I2C_TIMEOUT_US)
+
+_gpio_mcp = startup.retry(lambda: MCP.MCP23017(i2c, 0x20), 20, 10)
+startup.phase('mcp')
+_lcd_mcp_e_pins = (5, 6, 7, 8, 9, 10, 11, 12, 13, 14)
+_buzzer_mcp_pin = (15)
+
+
+def recover_i2c():
+    # bus recovery: a transfer cut in the middle can leave the expander holding SDA low - SCL is clocked
+    # (up to 9 pulses) until SDA is released, a STOP condition ends the transfer, then the I2C peripheral
+    # is set up again and the expander gets its configuration and outputs back (shadow registers)
+    # OSError if it still does not answer
+    scl = Pin(_i2c_scl_pin, Pin.OPEN_DRAIN, value=1)
+    sda = Pin(_i2c_sda_pin, Pin.OPEN_DRAIN, value=1)
+    for i in range(9):
+        if sda.value():
+            break
+        scl.value(0)
+        time.sleep_us(5)
+        scl.value(1)
+        time.sleep_us(5)
+    sda.value(0)
+    time.sleep_us(5)
+    sda.value(1)
+    _gpio_mcp._i2c = I2C(0, scl=Pin(_i2c_scl_pin), sda=Pin(_i2c_sda_pin), freq=400_000,
+                         timeout=config.I2C_TIMEOUT_US)
+    _gpio_mcp.restore()
+
+
+# display and buzzer work on the MCP23017 bus, run() a slice of it every main loop iteration
+bus = scheduler.BusScheduler(_gpio_mcp, _buzzer_mcp_pin, config.BUS_BUDGET_US, recover_i2c)
+# _lcd_mcp_batch_e_pin = const(14)
+_lcd_mcp_rs_pin = const(0)
+_lcd_mcp_d4_pin = const(1)
+_lcd_mcp_d5_pin = const(2)
+_lcd_mcp_d6_pin = const(3)
+_lcd_mcp_d7_pin = const(4)
+_lcd_columns = const(16)
+_lcd_rows = const(2)
+_lcd_power_on_ms = const(50)    # HD44780 - more than 40 ms after Vcc before the first command
+_displays_ready = False         # init_displays() done, Display objects skip their own initialization
+_empty_text = b'     EMPTY'     # row 0 after init_displays() / clear_lcd()
 
 # LED driver initialization
-tm = tm1638.TM1638(stb=Pin(28), clk=Pin(3), dio=Pin(2))
-__seg_value = (1, 2, 4, 8, 16, 32, 64, 128, 1)
-__grid_pos = (0, 0, 0, 0, 0, 0, 0, 0, 1)
-__front_light_pos_offset = const(2)
-__back_red_light_pos_offset = const(4)
-__back_green_light_pos_offset = const(6)
+tm = tm1638.TM1638(stb=Pin(28), clk=Pin(3), dio=Pin(2), pins=(3, 2))
+_seg_value = (1, 2, 4, 8, 16, 32, 64, 128, 1)
+_grid_pos = (0, 0, 0, 0, 0, 0, 0, 0, 1)
+_front_light_pos_offset = const(2)
+_back_red_light_pos_offset = const(4)
+_back_green_light_pos_offset = const(6)
 
 # GPIO Pins for confirmation buttons
-__front_button_pins = (6, 7, 8, 9, 10, 11, 12, 13, 14)
-__back_button_pins = (15, 16, 17, 18, 19, 20, 21, 22, 26)
-__batch_button_pin = const(27)
+_front_button_pins = (6, 7, 8, 9, 10, 11, 12, 13, 14)
+_back_button_pins = (15, 16, 17, 18, 19, 20, 21, 22, 26)
+_batch_button_pin = const(27)
+
+# state of all the compartments (shelfstate.py), the Shelf attributes are views of it
+state = shelfstate.ShelfState(len(_front_button_pins))
 
 # Display data
-__disp_words = ('Quantity:', 'Order:', 'C:', 'Orders:', 'Batch:')
+_disp_words = ('Quantity:', 'Order:', 'C:', 'Orders:', 'Batch:')
+
+# multi-drop bus (config.NODE_ADDRESS set)
+_host_address = '00'
+_broadcast_address = 'FF'
+_tx_queue_len = const(32)      # frames waiting for POLL, the oldest ones are dropped
+_tx_buf_len = const(256)       # initial size of the frame buffers, they grow for longer frames
+BROADCAST_COMMANDS = ('SOUND', 'SELFTEST', 'BLIP')    # fleet-wide commands accepted from FF
 
 # miganie ledami
 t = True
 
+def init_displays():
+    # all displays share RS and D4-D7 on the MCP23017 - the HD44780 initialization, clear and 'EMPTY'
+    # are sent to all ten at once (one E pulse on every E line) instead of display by display
+    global _displays_ready
+    startup.since_reset(_lcd_power_on_ms)
+    group = D.display_group(_lcd_mcp_rs_pin, _lcd_mcp_e_pins, _lcd_mcp_d4_pin, _lcd_mcp_d5_pin,
+                            _lcd_mcp_d6_pin, _lcd_mcp_d7_pin, _lcd_columns, _lcd_rows, _gpio_mcp)
+    group.set_cursor(0, 0)
+    group.message(_empty_text)
+    _displays_ready = True
+
+
 class Display():
-    def __init__(self, disp_type, shelf_no):
+    # the text is rendered (fmt.py) into the Screen of the lcd, the bus scheduler writes it to the display
+    # (scheduler.py) - prio: priority of the update, None - the default of the display type
+    def __init__(self, disp_type, shelf_no, lcd=None):
         self.shelf_no = shelf_no
         self.disp_type = disp_type
-        self.display_init()
-
-    def display_init(self):
-        self.lcd = D.display(__lcd_mcp_rs_pin, __lcd_mcp_e_pins[self.shelf_no], __lcd_mcp_d4_pin, __lcd_mcp_d5_pin,
-                             __lcd_mcp_d6_pin, __lcd_mcp_d7_pin, __lcd_columns, __lcd_rows, __gpio_mcp)
-        self.clear_lcd()
-
-    def clear_lcd(self,message='EMPTY'):
-        self.lcd.write8(0x01)
-        self.lcd.clear()
-        self.lcd.set_cursor(5, 0)
-        self.lcd.message(message)
-
-    def __string(self, l):
-        # format text on display (centers it)
-        if l > 2: l = 2
-        __lines = [''] * l
-        if self.disp_type is 'S':
-            for i in range(l):
-                string1 = __disp_words[i]
-                if i == 0:
-                    string2 = str(self.item_no) + '/' + str(self.items_qty)
-                else:
-                    string2 = str(self.order_no)
-                spaces = 16 - len(string1 + string2)
-                __lines[i] = string1 + ' ' * spaces + string2
+        self.prio = scheduler.SHELF if disp_type == 'S' else scheduler.BATCH
+        self.lcd = lcd
+        if lcd is None:
+            self.display_init(not _displays_ready)
         else:
-            for i in range(l):
-                if i == 0:
-                    string1 = __disp_words[i + 2] + str(self.carts_qty)
-                    string2 = __disp_words[i + 3] + str(self.orders_qty)
-                else:
-                    string1 = __disp_words[i + 3]
-                    string2 = str(self.batch_no)
-                spaces = 16 - len(string1 + string2)
-                __lines[i] = string1 + ' ' * spaces + string2
-        return __lines
-
-    def update_lcd(self, l=2):
+            self.screen = bus.screen(lcd, None, shelf_no)
+
+    def display_init(self, init=True):
+        self.lcd = D.display(_lcd_mcp_rs_pin, _lcd_mcp_e_pins[self.shelf_no], _lcd_mcp_d4_pin, _lcd_mcp_d5_pin,
+                             _lcd_mcp_d6_pin, _lcd_mcp_d7_pin, _lcd_columns, _lcd_rows, _gpio_mcp, init)
+        if init:
+            self.screen = bus.screen(self.lcd, None, self.shelf_no)     # blank after the initialization
+            self.clear_lcd()
+        else:
+            self.screen = bus.screen(self.lcd, _empty_text, self.shelf_no)
+
+    def clear_lcd(self, message='EMPTY', prio=scheduler.IDLE):
+        fmt.at(self.screen.rows[0], 5, message)
+        fmt.at(self.screen.rows[1], 0, '')
+        bus.request(self.screen, prio)
+
+    def __string(self, i):
+        # renders row i of the display (label on the left, value on the right)
+        row = self.screen.rows[i]
+        if self.disp_type == 'S':
+            if i == 0:
+                return fmt.row(row, _disp_words[0], None, self.item_no, '/', self.items_qty)
+            return fmt.row(row, _disp_words[1], None, self.order_no)
+        if i == 0:
+            return fmt.row(row, _disp_words[2], self.carts_qty, _disp_words[3], self.orders_qty)
+        return fmt.row(row, _disp_words[4], None, self.batch_no)
+
+    def update_lcd(self, l=2, prio=None):
         # updates the displayed text based on the values of the object's variables
-        self.lcd.set_cursor(0, 0)
-        lines = self.__string(l)
-        for row, string in enumerate(lines):
-            self.lcd.set_cursor(0, row)
-            self.lcd.message(string)
+        if l > 2: l = 2
+        for row in range(l):
+            self.__string(row)
+        bus.request(self.screen, self.prio if prio is None else prio)
 
-    def print_message(self, string, row=0):
+    def print_message(self, string, row=0, prio=None):
         # formats any text (centers it) - and displays it
         if row > 1: row = 1
-        dlugosc = len(string)
-        spaces = 8 - int(dlugosc / 2)
-        string = ' ' * spaces + string + ' ' * spaces
-        self.lcd.set_cursor(0, row)
-        self.lcd.message(string)
+        fmt.center(self.screen.rows[row], string)
+        bus.request(self.screen, self.prio if prio is None else prio)
         
     def set_time(self, mode='end'):
         # writes the start or end time to a variable
         if mode == 'start':
             self.start_time = time.ticks_ms()
-            print('st', self.start_time)
+            if __debug__:
+                log.debug('st', self.shelf_no, self.start_time)
         else:
             self.end_time = time.ticks_ms()
-            print('et', self.end_time)
+            if __debug__:
+                log.debug('et', self.shelf_no, self.end_time)
 
     def time_diff(self):
         # count time difference
         return time.ticks_diff(self.end_time, self.start_time)
 
     def buzzer(self,hms=4,td=200,sd=200,sound='ENABLED'):
-        # emits a preset sequence of beeps
-        if sound == 'ENABLED':
-            while hms>0:
-                __gpio_mcp.pin(__buzzer_mcp_pin,mode=0,value=1)
-                time.sleep_ms(td)
-                __gpio_mcp.pin(__buzzer_mcp_pin,mode=0,value=0)
-                time.sleep_ms(sd)
-                hms -=1
-        elif sound == 'DISABLED':
-             while hms>0:
-                __gpio_mcp.pin(__buzzer_mcp_pin,mode=0,value=0)
-                time.sleep_ms(td+sd)
-                hms -=1     
+        # emits a preset sequence of beeps - queued on the bus, returns at once
+        # with the sound disabled the sequence is queued silent, it takes the same time
+        bus.beep(hms, td, sd, sound == 'ENABLED')
         
+def _flag(flag):
+    # Shelf attribute - the bit of the shelf in a flag word of the state
+    def get(self):
+        return (state.flags[flag] & self.bit) != 0
+    def put(self, value):
+        state.set(flag, self.bit, value)
+    return property(get, put)
+
+
+def _column(column):
+    # Shelf attribute - the entry of the shelf in a column of the state
+    def get(self):
+        return column[self.shelf_no]
+    def put(self, value):
+        column[self.shelf_no] = value
+    return property(get, put)
+
+
+def _order_get(self):
+    return state.order_no[self.shelf_no]
+
+
+def _order_put(self, value):
+    state.order_no[self.shelf_no] = value
+    state.set(shelfstate.ORDER, self.bit, value is not None)
+
+
 class Shelf(Display):
-    # shelf objects
+    # shelf objects - the state of the shelf is kept in ptw.state, the attributes below are views of it
+    shelf_empty = _flag(shelfstate.EMPTY)
+    shelf_full = _flag(shelfstate.FULL)
+    waiting_front_conf = _flag(shelfstate.WAIT_FRONT)
+    waiting_back_conf = _flag(shelfstate.WAIT_BACK)
+    button_front = _flag(shelfstate.BUTTON_FRONT)
+    button_back = _flag(shelfstate.BUTTON_BACK)
+    order_no = property(_order_get, _order_put)
+    item_no = _column(state.item_no)
+    items_qty = _column(state.items_qty)
+    start_time = _column(state.start_time)
+    end_time = _column(state.end_time)
+
     def __init__(self, shelf_no):
-        super().__init__('S', shelf_no)   # inherit Display methods
         self.shelf_no = shelf_no
+        self.bit = 1 << shelf_no          # bit of the shelf in the flag words
+        super().__init__('S', shelf_no)   # inherit Display methods
+        self._lon = bytearray(8)          # tm1638 registers of the shelf - led on / led off phase
+        self._loff = bytearray(8)
         self.shelf_init()
 
     def shelf_init(self):
@@ -163,13 +255,15 @@ class Shelf(Display):
         self.button_init()
 
     def button_init(self):
-        self.buttonF = Pin(__front_button_pins[self.shelf_no], Pin.IN, Pin.PULL_DOWN)
-        self.buttonB = Pin(__back_button_pins[self.shelf_no], Pin.IN, Pin.PULL_DOWN)
+        self.buttonF = Pin(_front_button_pins[self.shelf_no], Pin.IN, Pin.PULL_DOWN)
+        self.buttonB = Pin(_back_button_pins[self.shelf_no], Pin.IN, Pin.PULL_DOWN)
         self.buttonF.irq(lambda pin: self.set_button_value('Front'), Pin.IRQ_RISING, hard=True)
         self.buttonB.irq(lambda pin: self.set_button_value('Back'), Pin.IRQ_RISING, hard=True)
 
     def set_button_value(self, b_id):      
         # interrupt handling procedure after pressing a button
+        if trace.enabled:
+            trace.irq((_front_button_pins if b_id == 'Front' else _back_button_pins)[self.shelf_no])
         self.__b_id = b_id       
         if self.__b_id == 'Front' and self.waiting_front_conf and not self.waiting_back_conf and not self.shelf_full:
             self.button_front = True 
@@ -187,54 +281,62 @@ class Shelf(Display):
 
     def led_value(self):
         # calculating the register bit value for the tm1638 for the given object
-        __lon = [0, 0, 0, 0, 0, 0, 0, 0]
-        __loff = [0, 0, 0, 0, 0, 0, 0, 0]
+        # (written into the shelf's own buffers, valid until the next call)
+        __lon = self._lon
+        __loff = self._loff
+        for i in range(8):
+            __lon[i] = 0
+            __loff[i] = 0
 
         # lcd display backlight
         if self.order_no:
-            __lon[__grid_pos[self.shelf_no]] = __seg_value[self.shelf_no]
+            __lon[_grid_pos[self.shelf_no]] = _seg_value[self.shelf_no]
             if self.shelf_full and not self.shelf_empty and self.waiting_back_conf:
-                __loff[__grid_pos[self.shelf_no]] = 0
+                __loff[_grid_pos[self.shelf_no]] = 0
             else:
-                __loff[__grid_pos[self.shelf_no]] = __seg_value[self.shelf_no]
+                __loff[_grid_pos[self.shelf_no]] = _seg_value[self.shelf_no]
         else:
-            __lon[__grid_pos[self.shelf_no]] = 0
-            __loff[__grid_pos[self.shelf_no]] = 0
+            __lon[_grid_pos[self.shelf_no]] = 0
+            __loff[_grid_pos[self.shelf_no]] = 0
     
         # front light confirmation
         if not self.waiting_front_conf:
-            __lon[__grid_pos[self.shelf_no] + __front_light_pos_offset] = 0
-            __loff[__grid_pos[self.shelf_no] + __front_light_pos_offset] = 0
+            __lon[_grid_pos[self.shelf_no] + _front_light_pos_offset] = 0
+            __loff[_grid_pos[self.shelf_no] + _front_light_pos_offset] = 0
         else:
-            __lon[__grid_pos[self.shelf_no] + __front_light_pos_offset] = __seg_value[self.shelf_no]
-            __loff[__grid_pos[self.shelf_no] + __front_light_pos_offset] = 0
+            __lon[_grid_pos[self.shelf_no] + _front_light_pos_offset] = _seg_value[self.shelf_no]
+            __loff[_grid_pos[self.shelf_no] + _front_light_pos_offset] = 0
     
         # lights on back - red and green
         if not self.waiting_back_conf and not self.shelf_full:   
             # red
-            __lon[__grid_pos[self.shelf_no] + __back_red_light_pos_offset] = __seg_value[self.shelf_no]
-            __loff[__grid_pos[self.shelf_no] + __back_red_light_pos_offset] = __seg_value[self.shelf_no]    
+            __lon[_grid_pos[self.shelf_no] + _back_red_light_pos_offset] = _seg_value[self.shelf_no]
+            __loff[_grid_pos[self.shelf_no] + _back_red_light_pos_offset] = _seg_value[self.shelf_no]    
             # green
-            __lon[__grid_pos[self.shelf_no] + __back_green_light_pos_offset] = 0
-            __loff[__grid_pos[self.shelf_no] + __back_green_light_pos_offset] = 0
+            __lon[_grid_pos[self.shelf_no] + _back_green_light_pos_offset] = 0
+            __loff[_grid_pos[self.shelf_no] + _back_green_light_pos_offset] = 0
     
         else:   
             # red
-            __lon[__grid_pos[self.shelf_no] + __back_red_light_pos_offset] = 0
-            __loff[__grid_pos[self.shelf_no] + __back_red_light_pos_offset] = 0  
+            __lon[_grid_pos[self.shelf_no] + _back_red_light_pos_offset] = 0
+            __loff[_grid_pos[self.shelf_no] + _back_red_light_pos_offset] = 0  
             # green
-            __lon[__grid_pos[self.shelf_no] + __back_green_light_pos_offset] = __seg_value[self.shelf_no]
-            __loff[__grid_pos[self.shelf_no] + __back_green_light_pos_offset] = 0
+            __lon[_grid_pos[self.shelf_no] + _back_green_light_pos_offset] = _seg_value[self.shelf_no]
+            __loff[_grid_pos[self.shelf_no] + _back_green_light_pos_offset] = 0
     
         return __lon, __loff
 
 
 class Batch(Display):
-    # batch object
-    def __init__(self):
-        super().__init__('B', 9)
+    # batch object - several batches can be active at once, the first one creates the batch display
+    # and the others share its lcd, each batch owns a subset of the shelves
+    def __init__(self, lcd=None):
+        super().__init__('B', 9, lcd)
+        self.manifest = Manifest()
         self.batch_init()
-        
+        if lcd is None:
+            self.batch_button_init()
+
     def batch_init(self):
         self.batch_no = None
         self.orders_qty = 0
@@ -244,20 +346,34 @@ class Batch(Display):
         self.finished = False
         self.start_time = 0
         self.end_time = 0
-        self.batch_button_init()
+        self.shelves = 0            # bitmask of the shelves owned by the batch
+        self.finish_beeps = 0
+        self.manifest.manifest_init()
 
     def batch_button_init(self):
-        self.buttonF = Pin(__batch_button_pin, Pin.IN, Pin.PULL_DOWN)
+        self.buttonF = Pin(_batch_button_pin, Pin.IN, Pin.PULL_DOWN)
         self.buttonF.irq(lambda pin: self.set_batch_button_value(True), Pin.IRQ_RISING, hard=True)
 
     def set_batch_button_value(self, b_id):
+        if trace.enabled:
+            trace.irq(_batch_button_pin)
         self.batch_button = b_id
 
 
 class UART_com():
     # communication via UART interface, reading, writing, formatting data before sending, decoding data after receiving
+    # point to point or, with config.NODE_ADDRESS, one node on a half-duplex multi-drop bus - the node ignores frames
+    # for other addresses, queues its own frames and sends them only when the control application polls it (POLL),
+    # broadcast commands are marked with '*' in front of the command and never answered
     def __init__(self):
-        self.__rx_data = bytes()
+        self._rx_data = bytes()
+        self._rx_tail = bytes()
+        self.node = None if config.NODE_ADDRESS is None else '%02X' % config.NODE_ADDRESS
+        self.muted = False
+        self.tx_queue = []
+        self.tx_dropped = 0
+        self._payload = fmt.Text(_tx_buf_len)      # send_message renders here,
+        self._frame = fmt.Text(_tx_buf_len + 16)   # uart_write adds the framing here - no allocation per reply
         self.uart_init()
         self.update_list = []
         self.to_confirm = {}
@@ -269,68 +385,110 @@ class UART_com():
         RX_pin = Pin(1, Pin.IN, Pin.PULL_UP)
         self.uart = UART(0, baudrate=115200, tx=Pin(0), rx=Pin(1), timeout=5)
         #self.uart = UART(0, baudrate=115200, tx=TX_pin, rx=RX_pin, timeout=5)
+        self.de = None
+        if config.RS485_DE_PIN is not None:
+            self.de = Pin(config.RS485_DE_PIN, Pin.OUT, value=0)
 
     def uart_read(self):
         # reads data from the UART buffer
-        self.__rx_data = bytes()
+        # an unfinished frame (split between reads while the host streams) is kept for the next read
+        self._rx_data = self._rx_tail
+        self._rx_tail = bytes()
         while self.uart.any() > 0:
-            __onboard_led_pin.high()
-            self.__rx_data += bytes(self.uart.read(), 'ASCII')
-            __onboard_led_pin.low()
-        return self.__rx_data
+            _onboard_led_pin.high()
+            data = self.uart.read()
+            if trace.enabled:
+                trace.record(trace.RX, data)
+            self._rx_data += data
+            _onboard_led_pin.low()
+        beg = self._rx_data.rfind(b'!')
+        if beg > self._rx_data.rfind(b'%') and len(self._rx_data) - beg < 128:
+            self._rx_tail = self._rx_data[beg:]
+            self._rx_data = self._rx_data[:beg]
+        return self._rx_data
+
+    def frame(self, tx_data):
+        # frame with the addresses of the control application and this node in multi-drop mode
+        # tx_data - str, bytes or memoryview, returns a memoryview of the frame buffer (valid until the next frame)
+        frame = self._frame.clear().add('!')
+        if self.node is not None:
+            frame.add(_host_address).add(':').add(self.node).add(':')
+        return frame.add(tx_data).add('%\r\n').view()
 
     def uart_write(self, tx_data):
-        # sends data to the control application
-        __tx_data = bytes(('!' + str(tx_data) + '%\r\n'), 'ASCII')
-        __onboard_led_pin.high()
-        self.uart.write(__tx_data)
-        print('uart_write',__tx_data)
+        # sends data to the control application, on the multi-drop bus it waits for POLL
+        if self.node is None:
+            self.uart_send(self.frame(tx_data))
+            return
+        if len(self.tx_queue) >= _tx_queue_len:
+            self.tx_queue.pop(0)
+            self.tx_dropped += 1
+        self.tx_queue.append(bytes(self.frame(tx_data)))     # a queued frame needs its own copy
+
+    def uart_send(self, frame):
+        # frame - bytes, bytearray or memoryview (str is encoded)
+        if isinstance(frame, str):
+            frame = frame.encode()
+        if trace.enabled:
+            trace.record(trace.TX, frame)
+        _onboard_led_pin.high()
+        if self.de is not None:
+            self.de.high()
+        self.uart.write(frame)
+        if self.de is not None:
+            self.uart.flush()       # the last stop bit has to leave before the bus is released
+            self.de.low()
         time.sleep_ms(5)
-        __onboard_led_pin.low()
+        _onboard_led_pin.low()
+
+    def poll_reply(self):
+        # POLL - the queued frames, then END with the number of frames dropped so far
+        queue = self.tx_queue
+        self.tx_queue = []
+        for frame in queue:
+            self.uart_send(frame)
+        self.uart_send(self.frame(self._payload.clear().add('P#B#9#').add(self.tx_dropped).add('#END').view()))
 
     def receive_commands(self):
         # extracts data from a text string
+        # every '%' ends a frame, the frame starts at the last '!' before it - a stray '%' or an unterminated
+        # frame is skipped, the next '!' starts over
         self.received_commands = []
-        hmb = 0
-        hme = 0
-        counter = 0
-        hmb, hme = str(self.__rx_data).count('!'), str(self.__rx_data).count('%')
-        command_string = str(self.__rx_data)
-        if self.__rx_data is not None and hme and hmb:
-            while hme and hmb:
-                string_len = len(command_string)
-                beg = command_string.find('!')
-                end = command_string.find('%')
-                if beg < end:
+        command_string = str(self._rx_data)
+        while True:
+            end = command_string.find('%')
+            if end < 0:
+                break
+            beg = command_string.rfind('!', 0, end)
+            if beg >= 0:
+                if self.node is None:
                     self.received_commands.append(command_string[beg + 1:end].split('#'))
-                    hmb -= 1
-                    hme -= 1
-                    command_string = command_string[end + 1:]
-                else:
-                    command_string = self.__rx_data[end + 1:]
+                elif command_string[beg + 3:beg + 4] == ':' and command_string[beg + 6:beg + 7] == ':':
+                    # only the destination is checked, frames for other nodes are skipped unparsed
+                    dst = command_string[beg + 1:beg + 3]
+                    if dst == self.node:
+                        self.received_commands.append(command_string[beg + 7:end].split('#'))
+                    elif dst == _broadcast_address:
+                        command = command_string[beg + 7:end].split('#')
+                        if command[0] in BROADCAST_COMMANDS:
+                            command[0] = '*' + command[0]
+                            self.received_commands.append(command)
+            command_string = command_string[end + 1:]
         self.update_list += self.received_commands
-        print('update list from receive commands',self.update_list)
+        if __debug__ and self.received_commands:
+            log.debug('rx', self.received_commands)
         return
     
     def send_message(self,mess_type, shelf_no, command, id_number=None):
-        tx_data = ''
-        object_type = ''
-        if shelf_no < 9:
-            object_type = 'S'
-        else:
-            object_type = 'B'
-        tx_data = mess_type + '#' + object_type + '#' + str(shelf_no) + '#' + str(id_number) + '#' + str(command)
-        self.uart_write(tx_data)
+        if self.muted:
+            # broadcast command - nobody may answer on the shared bus
+            return
+        # <type>#<S|B>#<shelf_no>#<id>#<command> rendered in place (fmt.py)
+        tx = self._payload.clear().add(mess_type).add('#S#' if shelf_no < 9 else '#B#')
+        tx.add(shelf_no).add('#').add(id_number).add('#').add(command)
+        if mess_type == 'E':
+            log.warning('tx E', command, shelf_no, id_number)
+        elif __debug__ and log.level() <= log.DEBUG:
+            log.debug('tx', bytes(tx.view()).decode())
+        self.uart_write(tx.view())
         return
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,6 @@
+# ptw_host - control application side of the picking wall protocol
+# protocol.py - framing, command builders, reply decoding, wall state from snapshots / deltas
+# client.py - asyncio client over a serial device or pty (real wall or sim.bus)
+
+from .protocol import Message, Request, WallState, FrameDecoder, encode
+from .client import SerialLink, WallClient, WallTimeout
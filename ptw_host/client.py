@@ -0,0 +1,244 @@
+# client.py - asyncio client of the picking wall
+# SerialLink - one serial device or pty (non-blocking, no extra packages), shared by the walls behind it
+# WallClient - requests with pipelining and timeouts, event stream of the unsolicited messages
+#
+#   link = await SerialLink.open('/dev/ttyUSB0')
+#   wall = WallClient(link)
+#   await wall.request(protocol.register_batch('B1', 12, 2))
+#   async for message in wall.events(): ...
+#
+# On a multi-drop bus (link opened with addressed=True) every wall has its WallClient(link, node=<address>);
+# the walls answer only when polled, so the client polls its wall while it waits for replies and,
+# with start_polling(), in the background for the unsolicited messages.
+
+import asyncio
+import errno
+import os
+import termios
+import tty
+from collections import deque
+from typing import AsyncIterator, Dict, Optional
+
+from . import protocol
+from .protocol import Message, Request
+
+_BAUDRATES = {9600: termios.B9600, 19200: termios.B19200, 38400: termios.B38400,
+              57600: termios.B57600, 115200: termios.B115200}
+
+
+class WallTimeout(asyncio.TimeoutError):
+    pass
+
+
+class SerialLink:
+    # byte stream to the walls, frames are routed to the clients by their source address
+    def __init__(self, fd: int, addressed: bool = False, loop=None):
+        # created within the running loop (open() or a coroutine), the loop is never looked up outside of it
+        self.fd = fd
+        self.addressed = addressed
+        self.loop = loop or asyncio.get_running_loop()
+        self.decoder = protocol.FrameDecoder(addressed)
+        self.clients: Dict[Optional[int], 'WallClient'] = {}
+        self.bus_turn = asyncio.Lock()      # multi-drop: one poll on the bus at a time
+        self._out = bytearray()
+        self._drained: Optional[asyncio.Future] = None
+        self.closed = False
+        self.loop.add_reader(fd, self._readable)
+
+    @classmethod
+    async def open(cls, path: str, baudrate: int = 115200, addressed: bool = False) -> 'SerialLink':
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        attrs[4] = attrs[5] = _BAUDRATES[baudrate]
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        return cls(fd, addressed, asyncio.get_running_loop())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.remove_reader(self.fd)
+        if self._out:
+            self.loop.remove_writer(self.fd)
+        os.close(self.fd)
+        for client in self.clients.values():
+            client._link_closed()
+
+    def write(self, data: bytes):
+        # never blocks, what the device does not take now is sent when it becomes writable
+        if self.closed:
+            raise ConnectionError('link closed')
+        if not self._out:
+            try:
+                written = os.write(self.fd, data)
+            except BlockingIOError:
+                written = 0
+            data = data[written:]
+            if not data:
+                return
+            self.loop.add_writer(self.fd, self._writable)
+        self._out += data
+
+    async def drain(self):
+        if self._out:
+            if self._drained is None:
+                self._drained = self.loop.create_future()
+            await asyncio.shield(self._drained)
+
+    def _writable(self):
+        try:
+            written = os.write(self.fd, self._out)
+        except BlockingIOError:
+            return
+        del self._out[:written]
+        if not self._out:
+            self.loop.remove_writer(self.fd)
+            if self._drained is not None:
+                self._drained.set_result(None)
+                self._drained = None
+
+    def _readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            if e.errno != errno.EIO:    # EIO - the other side of a pty closed
+                raise
+            data = b''
+        if not data:
+            self.close()
+            return
+        for destination, source, payload in self.decoder.feed(data):
+            if self.addressed and destination != protocol.HOST_ADDRESS:
+                continue
+            client = self.clients.get(source)
+            if client is not None:
+                client._received(Message.parse(payload, source))
+
+
+class WallClient:
+    def __init__(self, link: SerialLink, node: Optional[int] = None, timeout: float = 2.0, events: int = 1000):
+        if link.addressed == (node is None):
+            raise ValueError('a node address is needed on an addressed link and only there')
+        self.link = link
+        self.node = node
+        self.timeout = timeout
+        self.events_dropped = 0
+        self._pending = deque()         # (request, future) in the order of sending
+        self._events: asyncio.Queue = asyncio.Queue(events)
+        self._poll_reply: Optional[asyncio.Future] = None
+        self._poller: Optional[asyncio.Task] = None
+        link.clients[node] = self
+
+    def send(self, request: Request):
+        # fire and forget, returns the future of the reply (None if the wall does not answer)
+        future = None
+        if request.expect is not None:
+            future = self.link.loop.create_future()
+            self._pending.append((request, future))
+        self.link.write(protocol.encode(request.payload, self.node))
+        return future
+
+    async def request(self, request: Request, timeout: Optional[float] = None) -> Optional[Message]:
+        # sends and waits for the reply, several requests may be in flight at once
+        future = self.send(request)
+        await self.link.drain()
+        if future is None:
+            return None
+        timeout = timeout or request.timeout or self.timeout
+        try:
+            if self.node is None:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            return await asyncio.wait_for(self._poll_until(future), timeout)
+        except asyncio.TimeoutError:
+            self._forget(future)
+            raise WallTimeout('no reply to %s within %.1f s' % (request.payload, timeout)) from None
+
+    async def broadcast(self, request: Request):
+        # fleet-wide SOUND / SELFTEST / BLIP to all walls on the bus, nobody answers
+        self.link.write(protocol.encode(request.payload, protocol.BROADCAST_ADDRESS))
+        await self.link.drain()
+
+    async def poll(self, timeout: float = 0.5) -> int:
+        # multi-drop: lets the wall send its queued frames, returns the number of frames it dropped
+        async with self.link.bus_turn:
+            self._poll_reply = self.link.loop.create_future()
+            self.link.write(protocol.encode('POLL', self.node))
+            try:
+                reply = await asyncio.wait_for(self._poll_reply, timeout)
+            except asyncio.TimeoutError:
+                return 0
+            finally:
+                self._poll_reply = None
+        return int(reply.ident or 0)
+
+    def start_polling(self, interval: float = 0.05):
+        # multi-drop: background polling for BFP / SFD / BBP / deltas
+        if self._poller is None:
+            self._poller = asyncio.ensure_future(self._poll_forever(interval))
+
+    def stop_polling(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    async def events(self) -> AsyncIterator[Message]:
+        # unsolicited messages and replies nobody waits for (errors of fire and forget commands)
+        while True:
+            message = await self._events.get()
+            if message is None:
+                return
+            yield message
+
+    async def next_event(self, timeout: Optional[float] = None) -> Message:
+        message = await asyncio.wait_for(self._events.get(), timeout or self.timeout)
+        if message is None:
+            raise ConnectionError('link closed')
+        return message
+
+    async def _poll_until(self, future):
+        while not future.done():
+            await self.poll()
+            if not future.done():
+                await asyncio.sleep(0.01)
+        return future.result()
+
+    async def _poll_forever(self, interval):
+        while True:
+            await self.poll()
+            await asyncio.sleep(interval)
+
+    def _forget(self, future):
+        for item in self._pending:
+            if item[1] is future:
+                self._pending.remove(item)
+                break
+
+    def _received(self, message: Message):
+        if message.kind == 'P' and self._poll_reply is not None and not self._poll_reply.done():
+            self._poll_reply.set_result(message)
+            return
+        if not message.unsolicited:
+            for item in self._pending:
+                request, future = item
+                if request.expect(message):
+                    self._pending.remove(item)
+                    if not future.done():
+                        future.set_result(message)
+                    return
+        self._event(message)
+
+    def _event(self, message):
+        if self._events.full():
+            self._events.get_nowait()
+            self.events_dropped += 1
+        self._events.put_nowait(message)
+
+    def _link_closed(self):
+        for request, future in self._pending:
+            if not future.done():
+                future.set_exception(ConnectionError('link closed'))
+        self._pending.clear()
+        self._event(None)
@@ -0,0 +1,294 @@
+# protocol.py - the picking wall UART protocol seen from the control application
+# frames: !<payload>% (point to point) or !<destination>:<source>:<payload>% (multi-drop, see config.py)
+# payload from the host: <command>#<S|B>#<shelf_no|9>#<id>#<args...>
+# payload from the wall: <type>#<S|B>#<shelf_no|9>#<id>#<command>   (UART_com.send_message)
+
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+HOST_ADDRESS = 0x00
+BROADCAST_ADDRESS = 0xFF
+BATCH_DISPLAY = 9
+
+# messages the wall sends on its own
+UNSOLICITED = ('BFP', 'SFD', 'BBP', 'BATCH FINISHED', 'QA')
+
+
+def encode(payload: str, node: Optional[int] = None, source: int = HOST_ADDRESS) -> bytes:
+    # one frame, addressed if the node address is given
+    if node is None:
+        return ('!' + payload + '%').encode('ascii')
+    return ('!%02X:%02X:%s%%' % (node, source, payload)).encode('ascii')
+
+
+class FrameDecoder:
+    # incremental frame parser, bytes may arrive in any pieces
+    def __init__(self, addressed: bool = False, limit: int = 4096):
+        self.addressed = addressed
+        self.limit = limit
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes):
+        # returns a list of (destination, source, payload), the addresses are None point to point
+        self._buffer += data
+        frames = []
+        while True:
+            beg = self._buffer.find(b'!')
+            if beg < 0:
+                self._buffer.clear()
+                break
+            end = self._buffer.find(b'%', beg)
+            if end < 0:
+                del self._buffer[:beg]
+                if len(self._buffer) > self.limit:
+                    self._buffer.clear()
+                break
+            text = self._buffer[beg + 1:end].decode('ascii', 'replace')
+            del self._buffer[:end + 1]
+            if '!' in text:
+                # the start of an unterminated frame, resync on the last '!'
+                text = text[text.rindex('!') + 1:]
+            if not self.addressed:
+                frames.append((None, None, text))
+            elif len(text) > 6 and text[2] == ':' and text[5] == ':':
+                try:
+                    frames.append((int(text[0:2], 16), int(text[3:5], 16), text[6:]))
+                except ValueError:
+                    pass
+        return frames
+
+
+@dataclass(frozen=True)
+class Message:
+    # one frame from the wall
+    kind: str                   # C, E, D, H, L, SNAP, P, UNREGISTER, SELFTEST, STATS, BUS, READY
+    target: str                 # S - shelf, B - batch
+    number: int                 # shelf_no, 9 - batch
+    ident: Optional[str]        # order_no, batch_no, SKU or generation ('None' on the wire)
+    command: str
+    source: Optional[int] = None
+
+    @classmethod
+    def parse(cls, payload: str, source: Optional[int] = None) -> 'Message':
+        fields = payload.split('#', 4)
+        fields += [''] * (5 - len(fields))
+        try:
+            number = int(fields[2])
+        except ValueError:
+            number = -1
+        ident = None if fields[3] in ('None', '') else fields[3]
+        return cls(fields[0], fields[1], number, ident, fields[4], source)
+
+    @property
+    def unsolicited(self) -> bool:
+        return (self.kind in ('D', 'L') or (self.kind == 'C' and self.command in UNSOLICITED) or
+                (self.kind == 'READY' and self.command == 'BOOTED'))
+
+    @property
+    def error(self) -> bool:
+        return self.kind == 'E'
+
+
+@dataclass
+class Request:
+    # payload to send and how to recognize its reply (None - the wall does not answer)
+    payload: str
+    expect: Optional[Callable[[Message], bool]] = None
+    timeout: Optional[float] = None
+
+
+def _reply(kind, commands, ident=None):
+    def expect(m):
+        return m.kind == kind and m.command in commands and (ident is None or m.ident == ident)
+    return expect
+
+
+def _malformed(command):
+    # E#B#9#<command>#ERROR - the wall could not parse the frame
+    return _reply('E', ('ERROR',), command)
+
+
+def _either(*checks):
+    return lambda m: any(check(m) for check in checks)
+
+
+# command builders
+
+def register_batch(batch_no: str, orders_qty: int, carts_qty: int, shelves: Optional[List[int]] = None) -> Request:
+    payload = 'U#B#9#%s#%d#%d' % (batch_no, orders_qty, carts_qty)
+    if shelves:
+        payload += '#' + ''.join(str(n) for n in sorted(shelves))
+    return Request(payload, _either(_reply('C', ('BA',), batch_no), _reply('E', ('NE', 'FI')), _malformed('U')))
+
+
+def update_shelf(shelf_no: int, order_no: str, item_no: int, items_qty: int) -> Request:
+    # next item for the compartment, errors (SA, ET, BNA) come as events
+    return Request('U#S#%d#%s#%d#%d' % (shelf_no, order_no, item_no, items_qty))
+
+
+def unregister(batch_no: str) -> Request:
+    return Request('UNREGISTER#B#9#%s' % batch_no,
+                   _either(_reply('UNREGISTER', ('BATCH UNREGISTERED', 'FAILED'), batch_no), _malformed('UNREGISTER')))
+
+
+def sound(enabled: bool) -> Request:
+    return Request('SOUND#B#9#None#%s' % ('ENABLED' if enabled else 'DISABLED'))
+
+
+def selftest() -> Request:
+    # the results come as SELFTEST events before FINISHED: command '<device> PASS|FAIL', ident - us of the probe,
+    # number - the display (LCD); FINISHED carries the number of failures
+    return Request('SELFTEST#B#9', _reply('SELFTEST', ('FINISHED',)), timeout=30.0)
+
+
+def blip(times: int, on_ms: int, off_ms: int) -> Request:
+    return Request('BLIP#B#9#%d#%d#%d' % (times, on_ms, off_ms))
+
+
+def ready() -> Request:
+    # the boot announcement READY#B#9#<ms>#BOOTED is unsolicited, not a reply
+    return Request('READY?', _reply('READY', ('SELFTEST?',)))
+
+
+def manifest_line(shelf_no: int, order_no: str, sku: str, qty: int) -> Request:
+    return Request('M#S#%d#%s#%s#%d' % (shelf_no, order_no, sku, qty))
+
+
+def queued_manifest_line(batch_no: str, order_no: str, sku: str, qty: int) -> Request:
+    return Request('M#Q#9#%s#%s#%s#%d' % (batch_no, order_no, sku, qty))
+
+
+def manifest_end(batch_no: str) -> Request:
+    return Request('M#B#9#%s#END' % batch_no,
+                   _either(_reply('C', ('MA',)), _reply('E', ('BNA', 'TE')), _malformed('M')))
+
+
+def queue_order(batch_no: str, order_no: str, items_qty: int) -> Request:
+    return Request('Q#B#9#%s#%s#%d' % (batch_no, order_no, items_qty))
+
+
+def scan(sku: str) -> Request:
+    return Request('SCAN#S#9#%s' % sku,
+                   _either(_reply('C', ('SR',)), _reply('E', ('SU', 'SW'), sku), _malformed('SCAN')))
+
+
+def snapshot() -> Request:
+    return Request('SNAPSHOT#B#9', lambda m: m.kind == 'SNAP')
+
+
+def subscribe(on: bool = True) -> Request:
+    if on:
+        return Request('SUBSCRIBE#B#9#ON', lambda m: m.kind == 'SNAP')
+    return Request('SUBSCRIBE#B#9#OFF')
+
+
+def log_level(level: int) -> Request:
+    # 10 debug, 20 info, 30 warning, 40 error
+    return Request('LOG#B#9#%d' % level)
+
+
+def log_dump() -> Request:
+    # buffered records come as L events
+    return Request('LOG#B#9#DUMP')
+
+
+def heap() -> Request:
+    # reply command: f=<free>,a=<allocated>,l=<largest block>,c=,g=<idle / automatic collections>,p=,m=<pause us>
+    return Request('HEAP#B#9', lambda m: m.kind == 'H')
+
+
+def trace(mode: str = 'FLASH') -> Request:
+    # 'FLASH', 'USB' or 'OFF' (trace.py), reply command: m=<mode>,r=<records>,b=<bytes>,d=<dropped>
+    return Request('TRACE#B#9#%s' % mode, lambda m: m.kind == 'TRACE')
+
+
+def bus() -> Request:
+    # I2C bus health (scheduler.py), reply command: e=<errors>,r=<recoveries>,t=<us recovering>,d=<1 - down>,
+    # o=<offline displays, bit per shelf_no, 9 - batch display>,w=<characters written>
+    return Request('BUS#B#9', lambda m: m.kind == 'BUS')
+
+
+def stats(reset: bool = False) -> Request:
+    # pick rate analytics (analytics.py) as STATS events: number <9 - compartment, ident - emptied orders,
+    # command f=<mean fill ms>,e=<mean empty ms>; number 9 - ident FILL, EMPTY, SCAN, BATCH (the reply),
+    # command n=<count>,a=<mean ms>,w=<window>,p50=,p90=,x=<window max ms> - only n=0,w=0 without samples
+    return Request('STATS#B#9#RESET' if reset else 'STATS#B#9', lambda m: m.kind == 'STATS' and m.ident == 'BATCH')
+
+
+def poll() -> Request:
+    return Request('POLL', lambda m: m.kind == 'P' and m.command == 'END')
+
+
+# wall state (SNAPSHOT / SUBSCRIBE, see sync.py)
+
+FLAG_EMPTY = 1
+FLAG_FULL = 2
+FLAG_WAIT_FRONT = 4
+FLAG_WAIT_BACK = 8
+
+
+@dataclass
+class BatchState:
+    batch_no: Optional[str] = None
+    orders_qty: int = 0
+    carts_qty: int = 0
+    finished: bool = False
+    shelves: int = 0
+
+
+@dataclass
+class ShelfState:
+    order_no: Optional[str] = None
+    item_no: int = 0
+    items_qty: int = 0
+    flags: int = FLAG_EMPTY
+
+
+@dataclass
+class WallState:
+    generation: int = 0
+    batches: List[BatchState] = field(default_factory=list)
+    shelves: List[ShelfState] = field(default_factory=list)
+
+    @classmethod
+    def from_snapshot(cls, message: Message) -> 'WallState':
+        batches, shelves = message.command.split('|')
+        state = cls(int(message.ident or 0))
+        for record in batches.split(';'):
+            no, orders, carts, finished, mask = record.split(',')
+            state.batches.append(BatchState(no or None, int(orders), int(carts), finished == '1', int(mask)))
+        for record in shelves.split(';'):
+            order, item, qty, flags = record.split(',')
+            state.shelves.append(ShelfState(order or None, int(item), int(qty), int(flags)))
+        return state
+
+    def apply(self, message: Message) -> bool:
+        # applies one delta, False if a delta was missed (a new snapshot is needed)
+        generation = int(message.ident or 0)
+        if generation != self.generation + 1:
+            return False
+        self.generation = generation
+        values = dict(item.split('=', 1) for item in message.command.split(',') if '=' in item)
+        if message.target == 'S':
+            shelf = self.shelves[message.number]
+            if 'o' in values:
+                shelf.order_no = values['o'] or None
+            if 'i' in values:
+                shelf.item_no = int(values['i'])
+            if 'q' in values:
+                shelf.items_qty = int(values['q'])
+            if 'f' in values:
+                shelf.flags = int(values['f'])
+        else:
+            batch = self.batches[int(values['k'])]
+            if 'n' in values:
+                batch.batch_no = values['n'] or None
+            if 'o' in values:
+                batch.orders_qty = int(values['o'])
+            if 'c' in values:
+                batch.carts_qty = int(values['c'])
+            if 'd' in values:
+                batch.finished = values['d'] == '1'
+            if 'm' in values:
+                batch.shelves = int(values['m'])
+        return True
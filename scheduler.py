@@ -0,0 +1,296 @@
+# scheduler.py - the I2C bus of the MCP23017 (ten LCDs and the buzzer) as queued, prioritized work
+# Display methods do not talk to the LCD any more: they render the text into the Screen of the display
+# (want) and request it with a priority. Every main loop iteration BusScheduler.run() writes the characters
+# that differ from what the LCD shows (shown), highest priority first, until the time budget is used up.
+# A newer update of the same display replaces the text that was not written yet - superseded updates merge.
+# Buzzer sequences are timed jobs: run() switches the buzzer when an edge is due, no sleeping. A silent sequence
+# (sound disabled) takes the same time without touching the pin, the sequences after it keep their timing.
+# Priorities: ACTIVE - the shelf the operator works with, SHELF, BATCH - batch display, IDLE - 'EMPTY' screens
+# Bus faults: a failed transaction (OSError - no ACK or the I2C timeout) does not leave run(). The bus is
+# recovered at once (recover - ptw.recover_i2c: SCL clocked out, the expander set up again from its shadow
+# registers) and the character is written again on the next try, the display initialized again first (the
+# transfer may have stopped between the nibbles) - one HD44780 init command per try, _INIT_MS apart, no sleeping. If the recovery fails the bus is down: no bus work, a new
+# recovery after a backoff doubling from I2C_BACKOFF_MS up to I2C_BACKOFF_MAX_MS. When LCD_OFFLINE_FAILS bus
+# faults in a row happen while one display is written (e.g. its cable shorts the expander pins), the display is
+# offline for its own backoff - its text is kept and written when it is back, the other displays, the LEDs and
+# the UART go on. report() - the bus health counters.
+# Only bus faults are detected: no R/W line of the displays is driven (all 16 expander pins are RS, D4-D7, the E
+# lines and the buzzer), nothing is read back, so a display that is disconnected but leaves the bus working is
+# not noticed.
+
+from micropython import const
+import time
+import config
+import log
+
+ACTIVE = const(0)
+SHELF = const(1)
+BATCH = const(2)
+IDLE = const(3)
+
+_COLS = const(16)
+_INIT_MS = const(2)             # between the HD44780 init commands, and after the last one (clear)
+_ROW_ADDRESS = (0x00, 0x40)     # HD44780 DDRAM address of the rows
+
+
+class Screen():
+    # one physical LCD - shared by the Display objects that show on it (the batches share the batch display)
+    def __init__(self, lcd, text=None, no=0):
+        self.lcd = lcd
+        self.no = no            # shelf_no of the display, 9 - the batch display
+        self.want = bytearray(b' ' * (2 * _COLS))
+        self.shown = bytearray(b' ' * (2 * _COLS))
+        if text is not None:
+            self.want[:len(text)] = text
+            self.shown[:len(text)] = text
+        self.rows = (memoryview(self.want)[0:_COLS], memoryview(self.want)[_COLS:])
+        self.cursor = -1        # index of the next character the LCD writes to, -1 - unknown
+        self.dirty = False
+        self.prio = IDLE
+        self.seq = 0            # request order within one priority
+        self.fails = 0          # bus faults in a row while this display was written
+        self.init = -1          # next HD44780 init command to write, len(commands) - settling, -1 - initialized
+        self.wait = 0           # ticks_ms when the next init command (or the text after the last) may be written
+        self.offline = False
+        self.backoff = 0        # ms offline
+        self.until = 0          # ticks_ms when an offline display is tried again
+
+
+class BusScheduler():
+    def __init__(self, gpio, buzzer_pin, budget_us, recover=None):
+        self.gpio = gpio
+        self.recover = recover  # bus recovery, OSError if the expander still does not answer
+        self.buzzer_pin = buzzer_pin
+        self.budget_us = budget_us
+        self.screens = []
+        self.seq = 0
+        self.merged = 0         # updates that replaced a pending one
+        self.writes = 0         # characters written
+        self.beeps = []         # queued buzzer sequences (times, on_ms, off_ms, audible)
+        self._edges = 0         # buzzer edges left in the current sequence
+        self._audible = True
+        self._on_ms = 0
+        self._off_ms = 0
+        self._due = 0           # ticks_ms of the next edge
+        self.errors = 0         # failed transactions and recoveries
+        self.recoveries = 0     # recoveries that brought the expander back
+        self.recovery_us = 0    # time spent recovering
+        self.down = False       # the expander does not answer, recovered again at _retry
+        self._backoff = 0
+        self._retry = 0
+
+    def screen(self, lcd, text=None, no=0):
+        # the Screen of an LCD driver, created on the first call
+        for screen in self.screens:
+            if screen.lcd is lcd:
+                return screen
+        screen = Screen(lcd, text, no)
+        self.screens.append(screen)
+        return screen
+
+    def request(self, screen, prio):
+        # the text in screen.want changed - write it with the given priority
+        if screen.dirty:
+            self.merged += 1
+            if prio < screen.prio:
+                screen.prio = prio
+            return
+        screen.dirty = True
+        screen.prio = prio
+        screen.seq = self.seq
+        self.seq += 1
+
+    def beep(self, times, on_ms, off_ms, audible=True):
+        # nothing is queued while the bus is down - the beeps would sound late
+        if times > 0 and not self.down:
+            self.beeps.append((times, max(on_ms, 0), max(off_ms, 0), audible))
+
+    def busy(self):
+        # work that can be done - nothing while the bus is down, offline displays not counted
+        if self.down:
+            return False
+        if self._edges or self.beeps:
+            return True
+        for screen in self.screens:
+            if screen.dirty and not screen.offline:
+                return True
+        return False
+
+    def run(self, budget_us=None):
+        # one slice of bus work, returns True if work is left
+        if budget_us is None:
+            budget_us = self.budget_us
+        start = time.ticks_us()
+        if self.down and not self._recover():
+            return False
+        try:
+            self._buzzer()
+        except OSError:
+            self._fault(None)
+            return True
+        while True:
+            screen = self._next()
+            if screen is None:
+                return self._edges > 0 or len(self.beeps) > 0
+            try:
+                self._write(screen)
+            except OSError:
+                self._fault(screen)
+                return True
+            if time.ticks_diff(time.ticks_us(), start) >= budget_us:
+                return True
+
+    def sleep_ms(self, ms):
+        # blocking wait that keeps the bus working - texts appear and beeps are timed during the wait
+        end = time.ticks_add(time.ticks_ms(), ms)
+        while time.ticks_diff(end, time.ticks_ms()) > 0:
+            if not self.run():
+                time.sleep_ms(1)
+
+    def flush(self):
+        # everything requested so far written and sounded
+        while self.busy():
+            self.sleep_ms(1)
+
+    def probe(self, screen):
+        # the first character of the screen written again, returns the us it took (OSError - the bus failed)
+        start = time.ticks_us()
+        screen.cursor = -1
+        try:
+            screen.lcd.write8(0x80 | _ROW_ADDRESS[0])
+            screen.lcd.write8(screen.shown[0], True)
+        except OSError:
+            self._fault(screen)
+            raise
+        screen.cursor = 1
+        return time.ticks_diff(time.ticks_us(), start)
+
+    def offline(self):
+        # bitmask of the offline displays by shelf_no (9 - the batch display), all of them while the bus is down
+        mask = 0
+        for screen in self.screens:
+            if screen.offline or self.down:
+                mask |= 1 << screen.no
+        return mask
+
+    def report(self):
+        return ('e=' + str(self.errors) + ',r=' + str(self.recoveries) + ',t=' + str(self.recovery_us) +
+                ',d=' + str(int(self.down)) + ',o=' + str(self.offline()) + ',w=' + str(self.writes))
+
+    def _next(self):
+        best = None
+        now = time.ticks_ms()
+        for screen in self.screens:
+            if screen.offline:
+                if time.ticks_diff(now, screen.until) < 0:
+                    continue
+                screen.offline = False      # tried again, initialized first
+            if screen.init >= 0 and time.ticks_diff(now, screen.wait) < 0:
+                continue
+            if screen.dirty and (best is None or screen.prio < best.prio or
+                                 (screen.prio == best.prio and screen.seq < best.seq)):
+                best = screen
+        return best
+
+    def _write(self, screen):
+        # one character that differs, the screen is clean when there is none
+        want = screen.want
+        shown = screen.shown
+        lcd = screen.lcd
+        if screen.init >= 0:
+            # the display lost the nibble order - initialized and cleared, the whole text written again
+            commands = lcd.init_commands()
+            if screen.init < len(commands):
+                lcd.write8(commands[screen.init])
+                screen.init += 1
+                screen.wait = time.ticks_add(time.ticks_ms(), _INIT_MS)
+                return
+            screen.init = -1
+            for i in range(2 * _COLS):
+                shown[i] = 32
+            screen.cursor = 0
+        i = 0
+        n = 2 * _COLS
+        while i < n and want[i] == shown[i]:
+            i += 1
+        if i == n:
+            screen.dirty = False
+            return
+        if screen.cursor != i:
+            lcd.write8(0x80 | (_ROW_ADDRESS[i // _COLS] + i % _COLS))      # set DDRAM address
+        value = want[i]
+        lcd.write8(value, True)
+        shown[i] = value
+        screen.cursor = i + 1 if (i + 1) % _COLS else -1
+        screen.fails = 0
+        screen.backoff = 0
+        self.writes += 1
+
+    def _fault(self, screen):
+        # a transaction failed - the display (None - the buzzer) is written again after the bus recovery
+        self.errors += 1
+        if screen is not None:
+            screen.cursor = -1
+            screen.init = 0
+            screen.wait = time.ticks_add(time.ticks_ms(), _INIT_MS)
+            screen.dirty = True
+            screen.fails += 1
+            if screen.fails >= config.LCD_OFFLINE_FAILS:
+                screen.fails = 0
+                screen.backoff = _backoff(screen.backoff)
+                screen.until = time.ticks_add(time.ticks_ms(), screen.backoff)
+                screen.offline = True
+                log.warning('lcd offline', screen.no, screen.backoff)
+        self._recover()
+
+    def _recover(self):
+        # returns True when the expander answers again, while the bus is down at most once per backoff
+        now = time.ticks_ms()
+        if self.down and time.ticks_diff(now, self._retry) < 0:
+            return False
+        start = time.ticks_us()
+        try:
+            if self.recover is not None:
+                self.recover()
+            if not self._edges:
+                self.gpio.pin(self.buzzer_pin, mode=0, value=0)     # the shadow may hold a beep cut off
+            ok = True
+        except OSError:
+            ok = False
+        self.recovery_us += time.ticks_diff(time.ticks_us(), start)
+        if ok:
+            if self.down:
+                log.info('bus up', self._backoff)
+            self.recoveries += 1
+            self.down = False
+            self._backoff = 0
+            return True
+        self.errors += 1
+        self._backoff = _backoff(self._backoff)
+        self._retry = time.ticks_add(now, self._backoff)
+        if not self.down:
+            log.warning('bus down', self.errors)
+            self.down = True
+            self.beeps.clear()
+            self._edges = 0
+        return False
+
+    def _buzzer(self):
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self._due) < 0:
+            return
+        if not self._edges:
+            if not self.beeps:
+                return
+            times, self._on_ms, self._off_ms, self._audible = self.beeps.pop(0)
+            self._edges = 2 * times
+        on = not self._edges & 1
+        if self._audible:
+            self.gpio.pin(self.buzzer_pin, mode=0, value=on)
+        self._due = time.ticks_add(now, self._on_ms if on else self._off_ms)
+        self._edges -= 1
+
+
+def _backoff(ms):
+    # the next wait, doubling from I2C_BACKOFF_MS up to I2C_BACKOFF_MAX_MS
+    return min(max(2 * ms, config.I2C_BACKOFF_MS), config.I2C_BACKOFF_MAX_MS)
@@ -0,0 +1,81 @@
+# selftest.py - the selftest runs next to the command processing
+# main.run_selftest() is a generator that yields the ms to wait - Task.step() in the main loop resumes it when
+# they are over, so the UART is read and commands are executed during the test. While the LEDs and the displays
+# are walked the picking commands (main.PICKING) and the buttons wait, they are handled when the walk ends.
+# Probes - quick electrical checks first, each returns (passed, us):
+#   mcp(i2c)        - the MCP23017 answers a register read (I2C ACK)
+#   tm1638(tm)      - key scan data read back from the TM1638, bits 3 and 7 of every byte are 0 on the chip
+#                     (without the chip dio floats high through the pull-up)
+#   lcd(bus, screen) - one character written to the display again, fails on an I2C error or above LCD_MAX_US
+# Results go to the host as they come: SELFTEST#<S|B>#<shelf_no|9>#<us>#<device> PASS|FAIL,
+# then SELFTEST#B#9#<failures>#FINISHED
+
+from micropython import const
+import time
+
+MCP_ADDRESS = const(0x20)
+# the probe writes the DDRAM address and one character: 4 nibbles, each 5 single register I2C writes (the data
+# on both ports, E low / high / low from the shadow latch - lcd._pulse_enable) of ~110 us at 400 kHz with the
+# MicroPython call, plus 40 us settle - about 2.4 ms; twice that is a failing display or a slow bus
+LCD_MAX_US = const(5000)
+
+_keys = bytearray(4)
+
+
+class Task():
+    # one generator stepped by the main loop, it yields the ms until it wants to run again
+    def __init__(self):
+        self._task = None
+        self._wake = 0
+
+    def start(self, task):
+        self._task = task
+        self._wake = time.ticks_ms()
+
+    def running(self):
+        return self._task is not None
+
+    def step(self):
+        if self._task is None or time.ticks_diff(time.ticks_ms(), self._wake) < 0:
+            return
+        try:
+            self._wake = time.ticks_add(time.ticks_ms(), next(self._task))
+        except StopIteration:
+            self._task = None
+
+
+def _timed(function, *args):
+    start = time.ticks_us()
+    try:
+        passed = function(*args)
+    except OSError:
+        passed = False
+    return passed, time.ticks_diff(time.ticks_us(), start)
+
+
+def _mcp(i2c):
+    i2c.readfrom_mem(MCP_ADDRESS, 0x00, 1)
+    return True
+
+
+def _tm1638(tm):
+    for value in tm.keys(_keys):
+        if value & 0x88:
+            return False
+    return True
+
+
+def mcp(i2c):
+    return _timed(_mcp, i2c)
+
+
+def tm1638(tm):
+    return _timed(_tm1638, tm)
+
+
+def lcd(bus, screen):
+    try:
+        us = bus.probe(screen)
+    except OSError:
+        return False, 0
+    return us <= LCD_MAX_US, us
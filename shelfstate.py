@@ -0,0 +1,66 @@
+# shelfstate.py - state of all the compartments of the wall, struct of arrays
+# The Shelf objects (ptw.py) keep no state of their own, their attributes are views of one entry of a column
+# or one bit of a flag word:
+#   order_no                      - list
+#   item_no, items_qty            - array('H')
+#   start_time, end_time          - array('L'), ticks_ms
+#   flags[EMPTY] ... flags[ORDER] - one word per flag, bit n - compartment n
+# Wall-wide questions are integer operations on the words, e.g. free() - the compartments without an order,
+# mask(WAIT_FRONT) - all waiting for a front confirmation, done(mask) - no order left in the compartments,
+# first(mask) - the lowest compartment of a mask.
+# The button IRQs write flags too, so a read-modify-write of a word runs with the IRQs disabled.
+
+from micropython import const
+from array import array
+import machine
+
+EMPTY = const(0)
+FULL = const(1)
+WAIT_FRONT = const(2)
+WAIT_BACK = const(3)
+BUTTON_FRONT = const(4)
+BUTTON_BACK = const(5)
+ORDER = const(6)        # order_no is not None
+_FLAGS = const(7)
+
+
+class ShelfState():
+    def __init__(self, n):
+        self.n = n
+        self.all = (1 << n) - 1
+        self.order_no = [None] * n
+        self.item_no = array('H', [0] * n)
+        self.items_qty = array('H', [0] * n)
+        self.start_time = array('L', [0] * n)
+        self.end_time = array('L', [0] * n)
+        self.flags = array('L', [0] * _FLAGS)
+
+    def set(self, flag, bits, value):
+        # bits of the flag word set (value true) or cleared
+        state = machine.disable_irq()
+        if value:
+            self.flags[flag] |= bits
+        else:
+            self.flags[flag] &= ~bits
+        machine.enable_irq(state)
+
+    def mask(self, flag):
+        return self.flags[flag]
+
+    def free(self):
+        # compartments without an order
+        return self.all & ~self.flags[ORDER]
+
+    def done(self, mask):
+        # every compartment of the mask is done - none of them holds an order (emptied or never assigned)
+        return not self.flags[ORDER] & mask
+
+    def first(self, mask):
+        # the lowest compartment in the mask, -1 for an empty mask
+        if not mask:
+            return -1
+        n = 0
+        while not mask & 1:
+            mask >>= 1
+            n += 1
+        return n
@@ -0,0 +1,7 @@
+# sim - host simulator of the picking wall firmware
+# Runs the unchanged firmware (main.py, ptw.py, lib/) under CPython with stand-ins for the MicroPython
+# modules (sim/fake) - the UART goes to a socket, the LCDs are decoded from the MCP23017 writes
+# and the buttons are pressed through a control channel.
+# runtime.py - preparing a CPython process to run the firmware
+# node.py - one firmware instance (child process)
+# bus.py - several instances on one simulated multi-drop bus behind one host pty
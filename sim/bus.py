@@ -0,0 +1,154 @@
+# bus.py - several simulated picking walls on one multi-drop bus behind one host endpoint
+# The host endpoint is a pty, so the control application (or ptw_host) opens it like the real serial port.
+# Everything the host writes reaches every node, everything a node writes reaches the host and the other
+# nodes - like on a half-duplex RS-485 bus, each node has to drop the frames that are not addressed to it.
+#
+#   python -m sim.bus --nodes 1,2,3 --speed 5
+#   python -m sim.bus                       (one wall, point to point, no addresses)
+#
+# stdin of the CLI: <node> front|back <shelf_no>, <node> batch, <node> lcd, quit
+
+import argparse
+import json
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import tty
+
+from sim import runtime
+
+
+class Node():
+    # one firmware instance in a child process
+    def __init__(self, address, speed, log):
+        self.address = address
+        self.uart, uart_child = socket.socketpair()
+        self.ctl, ctl_child = socket.socketpair()
+        self.ctl_lock = threading.Lock()
+        self.ctl_file = self.ctl.makefile('r')
+        args = [sys.executable, '-m', 'sim.node', '--uart-fd', str(uart_child.fileno()),
+                '--ctl-fd', str(ctl_child.fileno()), '--speed', str(speed)]
+        if address is not None:
+            args += ['--address', str(address)]
+        self.process = subprocess.Popen(args, cwd=runtime.ROOT, stdout=log, stderr=subprocess.STDOUT,
+                                        pass_fds=(uart_child.fileno(), ctl_child.fileno()))
+        uart_child.close()
+        ctl_child.close()
+
+    def control(self, command):
+        with self.ctl_lock:
+            self.ctl.sendall((command + '\n').encode())
+            return json.loads(self.ctl_file.readline())
+
+    def stop(self):
+        self.process.kill()
+        self.process.wait()
+        self.uart.close()
+        self.ctl.close()
+
+
+class Bus():
+    def __init__(self, nodes=(None,), speed=1.0, log_dir=None):
+        if len(nodes) > 1 and None in nodes:
+            raise ValueError('several walls need node addresses')
+        self.addresses = tuple(nodes)
+        self.speed = speed
+        self.log_dir = log_dir
+        self.nodes = {}
+        self.host_path = None
+        self.__master = None
+        self.__slave = None
+        self.__running = False
+
+    def start(self):
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__slave)
+        tty.setraw(self.__master)
+        self.host_path = os.ttyname(self.__slave)
+        for address in self.addresses:
+            log = subprocess.DEVNULL
+            if self.log_dir is not None:
+                os.makedirs(self.log_dir, exist_ok=True)
+                log = open(os.path.join(self.log_dir, 'node-%s.log' % address), 'wb')
+            self.nodes[address] = Node(address, self.speed, log)
+        self.__running = True
+        threading.Thread(target=self.__relay, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.__running = False
+        for node in self.nodes.values():
+            node.stop()
+        for fd in (self.__master, self.__slave):
+            if fd is not None:
+                os.close(fd)
+        self.__master = self.__slave = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def press(self, address, button, shelf_no=None):
+        # button: 'front', 'back' or 'batch'
+        command = button if shelf_no is None else '%s %d' % (button, shelf_no)
+        return self.nodes[address].control(command)
+
+    def lcd(self, address):
+        return self.nodes[address].control('lcd')
+
+    def buzzer(self, address):
+        return self.nodes[address].control('buzzer')
+
+    def __relay(self):
+        uarts = {node.uart: node for node in self.nodes.values()}
+        while self.__running:
+            try:
+                readable = select.select([self.__master] + list(uarts), [], [], 0.1)[0]
+            except (OSError, ValueError):
+                return
+            for source in readable:
+                if source == self.__master:
+                    data = os.read(self.__master, 4096)
+                    for uart in uarts:
+                        uart.sendall(data)
+                    continue
+                data = source.recv(4096)
+                if not data:
+                    del uarts[source]
+                    continue
+                os.write(self.__master, data)
+                for uart in uarts:
+                    if uart is not source:
+                        uart.sendall(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulated picking walls on one bus')
+    parser.add_argument('--nodes', default='', help='comma separated node addresses, empty - one point to point wall')
+    parser.add_argument('--speed', type=float, default=1.0, help='firmware clock speed-up')
+    parser.add_argument('--log-dir', default=None, help='firmware output of every node goes to node-<address>.log')
+    args = parser.parse_args()
+    nodes = [int(a) for a in args.nodes.split(',') if a] or [None]
+    with Bus(nodes, args.speed, args.log_dir) as bus:
+        print('host endpoint:', bus.host_path, flush=True)
+        for line in sys.stdin:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == 'quit':
+                break
+            address = None if words[0] == '-' else int(words[0])
+            if words[1] == 'lcd':
+                for row0, row1 in bus.lcd(address):
+                    print('|%s|  |%s|' % (row0, row1))
+            else:
+                print(bus.press(address, words[1], int(words[2]) if len(words) > 2 else None))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+# machine module stand-in for the simulator
+# Pin - IRQ handlers can be fired with press(), UART - bytes go to UART.link (a socket) if it is set,
+# I2C - one MCP23017 at 0x20 whose GPIO writes are decoded into the text of the HD44780 displays
+
+import select
+import threading
+import time
+
+
+class Pin():
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    pins = {}       # gpio number -> last Pin object created for it
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._value = 0
+        self._irq = None
+        Pin.pins[id] = self
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self._value = 1 if value else 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    __call__ = value
+
+    def high(self):
+        self._value = 1
+
+    def low(self):
+        self._value = 0
+
+    on = high
+    off = low
+
+    def irq(self, handler=None, trigger=IRQ_RISING, hard=False):
+        self._irq = handler
+
+    def press(self):
+        # rising edge on the input
+        self._value = 1
+        if self._irq is not None:
+            self._irq(self)
+        self._value = 0
+
+
+class LCD():
+    # HD44780 in 4-bit mode as seen on the MCP23017 pins
+    def __init__(self, cols=16, rows=2):
+        self.cols = cols
+        self.rows = rows
+        self.ram = bytearray(b' ' * 0x80)
+        self.addr = 0
+        self.nibble = None
+
+    def strobe(self, rs, nibble):
+        if self.nibble is None:
+            self.nibble = nibble
+            return
+        value = (self.nibble << 4) | nibble
+        self.nibble = None
+        if rs:
+            self.ram[self.addr & 0x7f] = value
+            self.addr += 1
+        elif value == 0x01:
+            self.ram[:] = b' ' * 0x80
+            self.addr = 0
+        elif value == 0x02:
+            self.addr = 0
+        elif value & 0x80:
+            self.addr = value & 0x7f
+
+    def text(self):
+        return [self.ram[0x00:0x00 + self.cols].decode('ascii', 'replace'),
+                self.ram[0x40:0x40 + self.cols].decode('ascii', 'replace')]
+
+
+class MCP23017():
+    # register file (IOCON.BANK = 0) and the displays of the picking wall
+    # pins as in ptw.py: RS 0, D4-D7 1-4, E 5-14 (batch display last), buzzer 15
+    LCD_RS = 0
+    LCD_DATA = (1, 2, 3, 4)
+    LCD_E = (5, 6, 7, 8, 9, 10, 11, 12, 13, 14)
+    BUZZER = 15
+
+    def __init__(self):
+        self.regs = bytearray(0x16)
+        self.lcds = [LCD() for _ in self.LCD_E]
+        self.buzzer_on = 0
+        self.fail = False       # True - the chip stops acknowledging (bus fault)
+
+    def gpio(self):
+        return self.regs[0x12] | (self.regs[0x13] << 8)
+
+    def read(self, reg, n):
+        return bytes(self.regs[(reg + i) % 0x16] for i in range(n))
+
+    def write(self, reg, data):
+        before = self.gpio()
+        for i in range(len(data)):
+            self.regs[(reg + i) % 0x16] = data[i]
+        after = self.gpio()
+        if before != after:
+            self.__pins_changed(before, after)
+
+    def __pins_changed(self, before, after):
+        if (after >> self.BUZZER) & 1 and not (before >> self.BUZZER) & 1:
+            self.buzzer_on += 1
+        for k in range(len(self.LCD_E)):
+            e = self.LCD_E[k]
+            if (before >> e) & 1 and not (after >> e) & 1:
+                # data is latched on the falling edge of E
+                nibble = 0
+                for bit in range(4):
+                    nibble |= ((after >> self.LCD_DATA[bit]) & 1) << bit
+                self.lcds[k].strobe((after >> self.LCD_RS) & 1, nibble)
+
+
+class I2C():
+    devices = {}        # address -> device, shared by all I2C objects like the real bus
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000, timeout=50000):
+        if 0x20 not in I2C.devices:
+            I2C.devices[0x20] = MCP23017()
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def __device(self, addr):
+        device = I2C.devices.get(addr)
+        if device is None or getattr(device, 'fail', False):
+            raise OSError(5)        # EIO - no ACK
+        return device
+
+    def scan(self):
+        return [addr for addr in sorted(I2C.devices) if not I2C.devices[addr].fail]
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        return self.__device(addr).read(memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        buf[:] = self.__device(addr).read(memaddr, len(buf))
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self.__device(addr).write(memaddr, buf)
+
+    def writeto(self, addr, buf, stop=True):
+        self.__device(addr)
+        return 1
+
+    def readfrom(self, addr, nbytes, stop=True):
+        self.__device(addr)
+        return bytes(nbytes)
+
+
+SoftI2C = I2C
+
+
+class UART():
+    link = None         # socket connected to the simulated bus, None - bytes stay in rx/tx
+    instances = {}
+
+    def __init__(self, id=0, baudrate=115200, tx=None, rx=None, timeout=0, **kwargs):
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.lock = threading.Lock()
+        UART.instances[id] = self
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def __poll(self):
+        if UART.link is None:
+            return
+        while select.select([UART.link], [], [], 0)[0]:
+            data = UART.link.recv(4096)
+            if not data:
+                raise SystemExit    # the bus went away
+            with self.lock:
+                self.rx += data
+
+    def any(self):
+        self.__poll()
+        with self.lock:
+            n = len(self.rx)
+        if not n:
+            time.sleep(0.0005)      # the firmware polls in a busy loop, do not burn the host CPU
+        return n
+
+    def read(self, nbytes=None):
+        self.__poll()
+        with self.lock:
+            if not self.rx:
+                return None
+            if nbytes is None:
+                nbytes = len(self.rx)
+            data = bytes(self.rx[:nbytes])
+            del self.rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, buf):
+        data = bytes(buf)
+        if UART.link is not None:
+            UART.link.sendall(data)
+        else:
+            with self.lock:
+                self.tx += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def txdone(self):
+        return True
+
+    def feed(self, data):
+        # bytes arriving from the host (without a link)
+        with self.lock:
+            self.rx += data
+
+    def take(self):
+        # bytes sent by the firmware (without a link)
+        with self.lock:
+            data = bytes(self.tx)
+            self.tx = bytearray()
+        return data
+
+
+class Timer():
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self._stop = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=1000, callback=None, freq=None):
+        self.deinit()
+        if freq:
+            period = 1000 / freq
+        stop = self._stop = threading.Event()
+
+        def run():
+            while not stop.wait(period / 1000 / time.sim_speed):
+                callback(self)
+                if mode == Timer.ONE_SHOT:
+                    break
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def deinit(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def freq(hz=None):
+    return 125_000_000
+
+
+def unique_id():
+    return b'\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+def reset():
+    raise SystemExit
+
+
+def soft_reset():
+    raise SystemExit
@@ -0,0 +1,42 @@
+# micropython module stand-in for the simulator
+
+
+def const(value):
+    return value
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(verbose=False):
+    pass
+
+
+def qstr_info(verbose=False):
+    pass
+
+
+def schedule(function, arg):
+    function(arg)
+    return True
+
+
+def native(function):
+    return function
+
+
+def viper(function):
+    return function
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
+
+
+def opt_level(level=None):
+    return 0
@@ -0,0 +1,2 @@
+# uasyncio stand-in for the simulator
+from asyncio import *
@@ -0,0 +1,2 @@
+# utime stand-in for the simulator - the time module patched by sim.runtime
+from time import *
@@ -0,0 +1,62 @@
+# node.py - one simulated picking wall (child process started by sim.bus)
+# UART 0 is the socket passed in --uart-fd, the control socket (--ctl-fd) takes one command per line:
+#   front <shelf_no> / back <shelf_no> / batch - press a button, reply: JSON true (false - no such button yet)
+#   lcd - reply: JSON list with the two rows of every display (batch display last)
+#   buzzer - reply: JSON number of beeps so far
+
+import argparse
+import json
+import socket
+import sys
+import threading
+
+from sim import runtime
+
+
+def control(ctl):
+    import machine
+    ptw = sys.modules['ptw']
+    pins = {'front': ptw._front_button_pins, 'back': ptw._back_button_pins}
+    for line in ctl.makefile('r'):
+        words = line.split()
+        if not words:
+            continue
+        reply = None
+        if words[0] in pins or words[0] == 'batch':
+            pin = machine.Pin.pins.get(ptw._batch_button_pin if words[0] == 'batch' else pins[words[0]][int(words[1])])
+            reply = pin is not None
+            if pin is not None:
+                pin.press()
+        elif words[0] == 'lcd':
+            reply = [lcd.text() for lcd in machine.I2C.devices[0x20].lcds]
+        elif words[0] == 'buzzer':
+            reply = machine.I2C.devices[0x20].buzzer_on
+        ctl.sendall((json.dumps(reply) + '\n').encode())
+
+
+def wait_for_firmware(ctl):
+    # buttons exist once ptw is imported and the shelves are created
+    import time
+    while 'ptw' not in sys.modules or not hasattr(sys.modules['ptw'], 'Batch'):
+        time.sleep(0.01)
+    control(ctl)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--uart-fd', type=int, required=True)
+    parser.add_argument('--ctl-fd', type=int, required=True)
+    parser.add_argument('--address', type=int, default=None)
+    parser.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args()
+
+    runtime.install(args.speed)
+    import machine
+    machine.UART.link = socket.socket(fileno=args.uart_fd)
+    ctl = socket.socket(fileno=args.ctl_fd)
+    threading.Thread(target=wait_for_firmware, args=(ctl,), daemon=True).start()
+    runtime.run_firmware(args.address)
+
+
+if __name__ == '__main__':
+    main()
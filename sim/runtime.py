@@ -0,0 +1,55 @@
+# runtime.py - prepares a CPython process to run the picking wall firmware
+# install() puts the MicroPython stand-ins (sim/fake) and the firmware (repository root, lib/) on sys.path,
+# adds the MicroPython time and gc functions to the time and gc modules and const() to the builtins.
+# speed > 1 runs the firmware clock faster than real time (all sleeps and ticks are scaled).
+
+import builtins
+import gc
+import os
+import runpy
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE = os.path.join(ROOT, 'sim', 'fake')
+LIB = os.path.join(ROOT, 'lib')
+
+_TICKS_MASK = 0x3fffffff        # ticks wrap like on the PICO (small int range)
+_TICKS_HALF = 0x20000000
+_HEAP = 192 * 1024              # gc.mem_free() + gc.mem_alloc() of the PICO
+
+
+def install(speed=1.0):
+    for path in (LIB, ROOT, FAKE):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    builtins.const = lambda value: value
+
+    start = time.monotonic_ns()
+    sleep = time.sleep
+
+    def elapsed(div):
+        return int((time.monotonic_ns() - start) * speed) // div & _TICKS_MASK
+
+    time.sim_speed = speed
+    time.sleep = lambda seconds: sleep(seconds / speed)
+    time.sleep_ms = lambda ms: sleep(ms / 1000 / speed)
+    time.sleep_us = lambda us: sleep(us / 1000000 / speed) if us >= 1000 else None
+    time.ticks_ms = lambda: elapsed(1000000)
+    time.ticks_us = lambda: elapsed(1000)
+    time.ticks_cpu = time.ticks_us
+    time.ticks_add = lambda ticks, delta: (ticks + delta) & _TICKS_MASK
+    time.ticks_diff = lambda end, begin: ((end - begin + _TICKS_HALF) & _TICKS_MASK) - _TICKS_HALF
+
+    # CPython memory is not the PICO heap, the firmware sees a constant, healthy one
+    gc.mem_alloc = lambda: _HEAP // 8
+    gc.mem_free = lambda: _HEAP - gc.mem_alloc()
+    gc.threshold = lambda amount=None: -1 if amount is None else None
+
+
+def run_firmware(node_address=None):
+    # runs main.py like the PICO does after reset, never returns
+    import config
+    config.NODE_ADDRESS = node_address
+    runpy.run_path(os.path.join(ROOT, 'main.py'), run_name='__main__')
@@ -0,0 +1,67 @@
+# startup.py - boot of the picking wall
+# Devices are probed with bounded retries instead of a fixed delay, work that is not needed before READY
+# is deferred, and the end of every boot phase is recorded (ms since reset):
+#   phase(name)          - end of a boot phase
+#   retry(function, ...) - calls function until it does not raise OSError (device still in power-on reset)
+#   since_reset(ms)      - waits until ms after reset (datasheet power-on times)
+#   later(function)      - deferred until run_later(), which main.py calls after READY is sent
+# BOOT#B#9 returns the timings: BOOT#B#9#<ms from reset to READY>#<phase>=<ms>,<phase>=<ms>,...
+
+import time
+import log
+
+_names = []
+_ticks = []
+_later = []
+
+
+def phase(name):
+    _names.append(name)
+    _ticks.append(time.ticks_ms())
+    if len(_ticks) > 1:
+        log.info('boot', name, time.ticks_diff(_ticks[-1], _ticks[-2]))
+    else:
+        log.info('boot', name, _ticks[0])
+
+
+def retry(function, tries=20, delay_ms=10):
+    for i in range(tries - 1):
+        try:
+            return function()
+        except OSError:
+            time.sleep_ms(delay_ms)
+    return function()       # the last attempt raises the error
+
+
+def since_reset(ms):
+    wait = ms - time.ticks_ms()
+    if 0 < wait <= ms:
+        time.sleep_ms(wait)
+
+
+def later(function):
+    _later.append(function)
+
+
+def run_later():
+    while _later:
+        _later.pop(0)()
+
+
+def ready_ms(name='ready'):
+    # ms from reset to the end of the phase
+    for i in range(len(_names)):
+        if _names[i] == name:
+            return _ticks[i]
+    return None
+
+
+def report():
+    text = ''
+    previous = 0
+    for i in range(len(_names)):
+        if i:
+            text += ','
+        text += _names[i] + '=' + str(time.ticks_diff(_ticks[i], previous))
+        previous = _ticks[i]
+    return text
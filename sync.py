@@ -0,0 +1,142 @@
+# sync.py - wall state for the control application
+# WallSync class - full snapshot of the batches and shelves in one frame and, after subscription,
+# pushing only the changed fields of a shelf / batch with a generation counter
+#
+# snapshot:  SNAP#B#9#<generation>#<batch>;<batch>;...|<shelf>;<shelf>;...
+#            batch = batch_no,orders_qty,carts_qty,finished,shelves bitmask (empty batch_no - free slot)
+#            shelf = order_no,item_no,items_qty,flags (empty order_no - no order)
+# delta:     D#S#<shelf_no>#<generation>#o=<order_no>,i=<item_no>,q=<items_qty>,f=<flags>
+#            D#B#9#<generation>#k=<batch slot>,n=<batch_no>,o=<orders_qty>,c=<carts_qty>,d=<finished>,m=<shelves>
+# only the changed fields are sent in a delta (k is always present), generation grows by one per delta
+# so the host knows it missed one and has to ask for a snapshot again
+# batch and order numbers are sent as they are, main.py refuses numbers holding one of the separators , ; | =
+
+from micropython import const
+from array import array
+import shelfstate
+
+# shelf flags - bit f is the flag word f of shelfstate.py
+FLAG_EMPTY = 1 << shelfstate.EMPTY
+FLAG_FULL = 1 << shelfstate.FULL
+FLAG_WAIT_FRONT = 1 << shelfstate.WAIT_FRONT
+FLAG_WAIT_BACK = 1 << shelfstate.WAIT_BACK
+_FLAG_WORDS = const(4)
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+class WallSync():
+    def __init__(self, shelves, batches, uart, state):
+        self.shelves = shelves
+        self.state = state          # shelfstate.ShelfState of the shelves
+        self.batches = batches
+        self.uart = uart
+        self.generation = 0
+        self.subscribed = False
+        # last state known to the host
+        self.s_order = [None] * len(shelves)
+        self.s_item = array('l', [0] * len(shelves))
+        self.s_qty = array('l', [0] * len(shelves))
+        self.s_flags = bytearray(len(shelves))
+        self.b_no = [None] * len(batches)
+        self.b_orders = array('l', [0] * len(batches))
+        self.b_carts = array('l', [0] * len(batches))
+        self.b_finished = bytearray(len(batches))
+        self.b_shelves = array('l', [0] * len(batches))
+
+    def snapshot(self):
+        # complete state in one compact string, the host is in sync with it afterwards
+        records = []
+        for k in range(len(self.batches)):
+            batch = self.batches[k]
+            self.__keep_batch(k, batch)
+            records.append(_text(batch.batch_no) + ',' + str(batch.orders_qty) + ',' + str(batch.carts_qty) + ',' +
+                           str(int(batch.finished)) + ',' + str(batch.shelves))
+        batches = ';'.join(records)
+        records = []
+        for shelf in self.shelves:
+            self.__keep_shelf(shelf)
+            records.append(_text(shelf.order_no) + ',' + str(shelf.item_no) + ',' + str(shelf.items_qty) + ',' +
+                           str(self.__flags(shelf.shelf_no)))
+        return batches + '|' + ';'.join(records)
+
+    def send_snapshot(self):
+        self.uart.send_message('SNAP', 9, self.snapshot(), self.generation)
+
+    def subscribe(self, on):
+        # the subscription starts with a snapshot, so one round trip is enough to resync
+        self.subscribed = on
+        if on:
+            self.send_snapshot()
+
+    def poll(self):
+        # sends deltas for everything that changed since the host saw it
+        if not self.subscribed:
+            return
+        for shelf in self.shelves:
+            self.__shelf_delta(shelf)
+        for k in range(len(self.batches)):
+            self.__batch_delta(k, self.batches[k])
+
+    def __flags(self, n):
+        # the flags of the shelf straight from the flag words
+        words = self.state.flags
+        flags = 0
+        for f in range(_FLAG_WORDS):
+            flags |= ((words[f] >> n) & 1) << f
+        return flags
+
+    def __keep_shelf(self, shelf):
+        n = shelf.shelf_no
+        self.s_order[n] = shelf.order_no
+        self.s_item[n] = shelf.item_no
+        self.s_qty[n] = shelf.items_qty
+        self.s_flags[n] = self.__flags(n)
+
+    def __keep_batch(self, k, batch):
+        self.b_no[k] = batch.batch_no
+        self.b_orders[k] = batch.orders_qty
+        self.b_carts[k] = batch.carts_qty
+        self.b_finished[k] = batch.finished
+        self.b_shelves[k] = batch.shelves
+
+    def __shelf_delta(self, shelf):
+        n = shelf.shelf_no
+        flags = self.__flags(n)
+        if (self.s_order[n] == shelf.order_no and self.s_item[n] == shelf.item_no and
+                self.s_qty[n] == shelf.items_qty and self.s_flags[n] == flags):
+            return
+        fields = []
+        if self.s_order[n] != shelf.order_no:
+            fields.append('o=' + _text(shelf.order_no))
+        if self.s_item[n] != shelf.item_no:
+            fields.append('i=' + str(shelf.item_no))
+        if self.s_qty[n] != shelf.items_qty:
+            fields.append('q=' + str(shelf.items_qty))
+        if self.s_flags[n] != flags:
+            fields.append('f=' + str(flags))
+        self.__keep_shelf(shelf)
+        self.generation += 1
+        self.uart.send_message('D', n, ','.join(fields), self.generation)
+
+    def __batch_delta(self, k, batch):
+        if (self.b_no[k] == batch.batch_no and self.b_orders[k] == batch.orders_qty and
+                self.b_carts[k] == batch.carts_qty and self.b_finished[k] == batch.finished and
+                self.b_shelves[k] == batch.shelves):
+            return
+        fields = ['k=' + str(k)]
+        if self.b_no[k] != batch.batch_no:
+            fields.append('n=' + _text(batch.batch_no))
+        if self.b_orders[k] != batch.orders_qty:
+            fields.append('o=' + str(batch.orders_qty))
+        if self.b_carts[k] != batch.carts_qty:
+            fields.append('c=' + str(batch.carts_qty))
+        if self.b_finished[k] != batch.finished:
+            fields.append('d=' + str(int(batch.finished)))
+        if self.b_shelves[k] != batch.shelves:
+            fields.append('m=' + str(batch.shelves))
+        self.__keep_batch(k, batch)
+        self.generation += 1
+        self.uart.send_message('D', 9, ','.join(fields), self.generation)
@@ -0,0 +1,104 @@
+# test_client.py - ptw_host.client: request / reply matching, pipelining, timeouts and the event stream
+# the wall is the other end of a socket pair, the test writes its frames and reads what the client sent
+
+import asyncio
+import os
+import socket
+import unittest
+
+from ptw_host import protocol
+from ptw_host.client import SerialLink, WallClient, WallTimeout
+
+
+class WallClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.host, self.wall = socket.socketpair()
+        self.host.setblocking(False)
+        self.wall.setblocking(False)
+        self.link = SerialLink(os.dup(self.host.fileno()))
+        self.client = WallClient(self.link, timeout=0.5)
+
+    async def asyncTearDown(self):
+        self.link.close()
+        self.host.close()
+        self.wall.close()
+
+    def answer(self, *payloads):
+        self.wall.send(b''.join(protocol.encode(payload) for payload in payloads))
+
+    async def received(self):
+        # what the client sent, once it is on the wire
+        await asyncio.sleep(0.01)
+        return self.wall.recv(4096)
+
+    async def test_request(self):
+        task = asyncio.ensure_future(self.client.request(protocol.register_batch('B1', 12, 2)))
+        self.assertEqual(await self.received(), b'!U#B#9#B1#12#2%')
+        self.answer('C#B#9#B1#BA')
+        reply = await task
+        self.assertEqual((reply.kind, reply.ident, reply.command), ('C', 'B1', 'BA'))
+
+    async def test_pipelining_out_of_order(self):
+        # replies are matched to the requests by content, not by order
+        first = asyncio.ensure_future(self.client.request(protocol.heap()))
+        second = asyncio.ensure_future(self.client.request(protocol.register_batch('B1', 12, 2)))
+        third = asyncio.ensure_future(self.client.request(protocol.unregister('B0')))
+        await self.received()
+        self.answer('UNREGISTER#B#9#B0#BATCH UNREGISTERED', 'C#B#9#B1#BA', 'H#B#9#None#f=1')
+        self.assertEqual((await first).kind, 'H')
+        self.assertEqual((await second).command, 'BA')
+        self.assertEqual((await third).command, 'BATCH UNREGISTERED')
+
+    async def test_malformed_reply(self):
+        task = asyncio.ensure_future(self.client.request(protocol.register_batch('B,1', 12, 2)))
+        await self.received()
+        self.answer('E#B#9#U#ERROR')
+        self.assertTrue((await task).error)
+
+    async def test_same_request_twice(self):
+        # two requests with the same reply get the replies in the order they were sent
+        first = asyncio.ensure_future(self.client.request(protocol.heap()))
+        second = asyncio.ensure_future(self.client.request(protocol.heap()))
+        await self.received()
+        self.answer('H#B#9#None#f=1', 'H#B#9#None#f=2')
+        self.assertEqual((await first).command, 'f=1')
+        self.assertEqual((await second).command, 'f=2')
+
+    async def test_timeout(self):
+        with self.assertRaises(WallTimeout):
+            await self.client.request(protocol.heap(), timeout=0.05)
+        self.assertEqual(len(self.client._pending), 0)
+        # a late reply is an event, the next request gets its own reply
+        self.answer('H#B#9#None#f=1')
+        self.assertEqual((await self.client.next_event()).command, 'f=1')
+        task = asyncio.ensure_future(self.client.request(protocol.heap()))
+        await self.received()
+        self.answer('H#B#9#None#f=2')
+        self.assertEqual((await task).command, 'f=2')
+
+    async def test_events(self):
+        # unsolicited messages never complete a request, even one that would match them
+        task = asyncio.ensure_future(self.client.request(protocol.ready()))
+        await self.received()
+        self.answer('READY#B#9#812#BOOTED', 'C#S#1#O1#BFP', 'READY#B#9#None#SELFTEST?')
+        self.assertEqual((await task).command, 'SELFTEST?')
+        self.assertEqual((await self.client.next_event()).command, 'BOOTED')
+        self.assertEqual((await self.client.next_event()).command, 'BFP')
+
+    async def test_fire_and_forget(self):
+        self.assertIsNone(await self.client.request(protocol.update_shelf(0, 'O1', 1, 3)))
+        self.assertEqual(await self.received(), b'!U#S#0#O1#1#3%')
+        self.answer('E#S#0#O1#BNA')
+        self.assertTrue((await self.client.next_event()).error)
+
+    async def test_link_closed(self):
+        task = asyncio.ensure_future(self.client.request(protocol.heap()))
+        await self.received()
+        self.wall.close()
+        with self.assertRaises(ConnectionError):
+            await task
+        self.assertTrue(self.link.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# test_protocol.py - ptw_host.protocol: framing, message decoding, request matching, wall state
+# python -m unittest discover tests (or pytest), CPython only
+
+import unittest
+
+from ptw_host import protocol
+from ptw_host.protocol import FrameDecoder, Message, WallState
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def test_split_frames(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(b'!C#S#1#O1#BF'), [])
+        self.assertEqual(decoder.feed(b'P%!C#B#9#B1#'), [(None, None, 'C#S#1#O1#BFP')])
+        self.assertEqual(decoder.feed(b'BA%!D#S#0#1#f=1%'), [(None, None, 'C#B#9#B1#BA'), (None, None, 'D#S#0#1#f=1')])
+
+    def test_noise_between_frames(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(b'garbage%\r\n!H#B#9#None#f=1%xx'), [(None, None, 'H#B#9#None#f=1')])
+        self.assertEqual(decoder.feed(b'!P#B#9#0#END%'), [(None, None, 'P#B#9#0#END')])
+
+    def test_resync_on_unterminated_frame(self):
+        # a frame cut off by a reset: the next '!' starts over
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(b'!C#S#1#O1#B!READY#B#9#812#BOOTED%'), [(None, None, 'READY#B#9#812#BOOTED')])
+
+    def test_limit(self):
+        decoder = FrameDecoder(limit=16)
+        self.assertEqual(decoder.feed(b'!' + b'x' * 32), [])
+        self.assertEqual(decoder.feed(b'%!C#B#9#B1#BA%'), [(None, None, 'C#B#9#B1#BA')])
+
+    def test_addressed(self):
+        decoder = FrameDecoder(addressed=True)
+        frames = decoder.feed(b'!00:02:C#B#9#B1#BA%!00:zz:C#B#9#B1#BA%!short%')
+        self.assertEqual(frames, [(0x00, 0x02, 'C#B#9#B1#BA')])
+
+    def test_encode(self):
+        self.assertEqual(protocol.encode('POLL'), b'!POLL%')
+        self.assertEqual(protocol.encode('POLL', 0x0A), b'!0A:00:POLL%')
+
+
+class MessageTest(unittest.TestCase):
+    def test_parse(self):
+        m = Message.parse('C#S#3#ORD1#BFP', 2)
+        self.assertEqual((m.kind, m.target, m.number, m.ident, m.command, m.source), ('C', 'S', 3, 'ORD1', 'BFP', 2))
+        self.assertTrue(m.unsolicited)
+        self.assertFalse(m.error)
+
+    def test_parse_short_and_none(self):
+        m = Message.parse('E#B#x#None')
+        self.assertEqual((m.kind, m.number, m.ident, m.command), ('E', -1, None, ''))
+        self.assertTrue(m.error)
+        m = Message.parse('P')
+        self.assertEqual((m.kind, m.target, m.number, m.ident, m.command), ('P', '', -1, None, ''))
+
+    def test_command_keeps_separators(self):
+        m = Message.parse('SNAP#B#9#4#B1,2,1,0,3;,0,0,0,0|O1,1,2,4')
+        self.assertEqual(m.command, 'B1,2,1,0,3;,0,0,0,0|O1,1,2,4')
+
+    def test_unsolicited(self):
+        self.assertTrue(Message.parse('READY#B#9#812#BOOTED').unsolicited)
+        self.assertFalse(Message.parse('READY#B#9#812#SELFTEST?').unsolicited)
+        self.assertTrue(Message.parse('D#S#0#1#f=1').unsolicited)
+        self.assertFalse(Message.parse('C#B#9#B1#BA').unsolicited)
+
+    def test_expect(self):
+        request = protocol.register_batch('B1', 12, 2)
+        self.assertTrue(request.expect(Message.parse('C#B#9#B1#BA')))
+        self.assertTrue(request.expect(Message.parse('E#B#9#B1#NE')))
+        self.assertFalse(request.expect(Message.parse('C#B#9#B2#BA')))
+        self.assertFalse(protocol.ready().expect(Message.parse('READY#B#9#812#BOOTED')))
+        self.assertIsNone(protocol.update_shelf(0, 'O1', 1, 3).expect)
+
+    def test_expect_malformed(self):
+        # a frame the wall could not parse is answered E#B#9#<command>#ERROR - the reply, not a timeout
+        error = Message.parse('E#B#9#U#ERROR')
+        self.assertTrue(protocol.register_batch('B,1', 12, 2).expect(error))
+        self.assertFalse(protocol.register_batch('B1', 12, 2).expect(Message.parse('E#B#9#M#ERROR')))
+        self.assertTrue(protocol.manifest_end('B1').expect(Message.parse('E#B#9#M#ERROR')))
+        self.assertTrue(protocol.scan('').expect(Message.parse('E#B#9#SCAN#ERROR')))
+        self.assertTrue(protocol.unregister('B1').expect(Message.parse('E#B#9#UNREGISTER#ERROR')))
+
+
+class WallStateTest(unittest.TestCase):
+    def setUp(self):
+        self.state = WallState.from_snapshot(Message.parse('SNAP#B#9#4#B1,2,1,0,3;,0,0,0,0|O1,1,2,4;,0,0,1'))
+
+    def test_snapshot(self):
+        state = self.state
+        self.assertEqual(state.generation, 4)
+        self.assertEqual(state.batches[0], protocol.BatchState('B1', 2, 1, False, 3))
+        self.assertEqual(state.batches[1], protocol.BatchState())
+        self.assertEqual(state.shelves[0], protocol.ShelfState('O1', 1, 2, protocol.FLAG_WAIT_FRONT))
+        self.assertEqual(state.shelves[1], protocol.ShelfState())
+
+    def test_apply(self):
+        state = self.state
+        self.assertTrue(state.apply(Message.parse('D#S#0#5#i=2,f=2')))
+        self.assertEqual(state.shelves[0], protocol.ShelfState('O1', 2, 2, protocol.FLAG_FULL))
+        self.assertTrue(state.apply(Message.parse('D#B#9#6#k=0,d=1')))
+        self.assertTrue(state.batches[0].finished)
+        self.assertTrue(state.apply(Message.parse('D#S#0#7#o=,i=0,q=0,f=1')))
+        self.assertEqual(state.shelves[0], protocol.ShelfState())
+        self.assertTrue(state.apply(Message.parse('D#B#9#8#k=1,n=B2,o=5,c=1,m=2')))
+        self.assertEqual(state.batches[1], protocol.BatchState('B2', 5, 1, False, 2))
+        self.assertEqual(state.generation, 8)
+
+    def test_missed_delta(self):
+        state = self.state
+        self.assertFalse(state.apply(Message.parse('D#S#0#6#i=2')))
+        self.assertFalse(state.apply(Message.parse('D#S#0#4#i=2')))
+        self.assertEqual(state.generation, 4)
+        self.assertEqual(state.shelves[0].item_no, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
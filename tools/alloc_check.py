@@ -0,0 +1,90 @@
+# alloc_check.py - a shelf display update, writing it to the lcd, a SKU lookup and a reply must not allocate
+# MicroPython on the PICO with the wall connected and main.py stopped (mpremote run tools/alloc_check.py)
+# Every case runs once to warm up (characters interned, frame views cached) and then with the heap locked -
+# any allocation raises MemoryError. Under CPython (the simulator) heap_lock() does nothing, run it on the PICO.
+
+import gc
+import micropython
+import ptw
+import log
+
+log.level(log.INFO)     # debug records copy the frame
+log.set_sink(None)
+
+shelf = ptw.Shelf(0)
+shelf.order_no = 'ORD12345'
+shelf.items_qty = 12
+batch = ptw.Batch()
+batch.batch_no = 'B1'
+batch.orders_qty = 9
+batch.carts_qty = 2
+batch.manifest.add(0, 'ORD12345', 'SKU-4711-XL', 3)
+u = ptw.UART_com()
+
+
+def shelf_update():
+    shelf.item_no = (shelf.item_no + 1) % 13
+    shelf.update_lcd(1)
+
+
+def shelf_display():
+    shelf.update_lcd(2)
+
+
+def batch_display():
+    batch.update_lcd(2)
+
+
+def batch_message():
+    batch.print_message('Batch completed', 0)
+
+
+def bus_write():
+    # the characters that changed written to the lcd by the bus scheduler
+    shelf_update()
+    ptw.bus.flush()
+
+
+def front_button():
+    # the hard IRQ handler, it writes the state words and columns through the Shelf views (shelfstate.py)
+    shelf.item_no = 0
+    shelf.waiting_front_conf = True
+    shelf.set_button_value('Front')
+
+
+def sku_lookup():
+    # the hash and the index lookup of a scanned SKU (SCAN#S#9#<sku>)
+    batch.manifest.resolve('SKU-4711-XL')
+
+
+def reply():
+    u.send_message('C', shelf.shelf_no, 'BFP', shelf.order_no)
+
+
+def reply_number():
+    u.send_message('C', 9, 'MA', 120)
+
+
+def check(name, function):
+    function()
+    gc.collect()
+    before = gc.mem_alloc()
+    error = None
+    micropython.heap_lock()
+    try:
+        function()
+    except MemoryError as e:
+        error = e
+    micropython.heap_unlock()
+    allocated = gc.mem_alloc() - before
+    print('%-16s %s  %d bytes' % (name, 'FAIL' if error else 'ok  ', allocated))
+    return error is None and allocated <= 0
+
+
+results = [check('shelf update', shelf_update), check('shelf display', shelf_display),
+           check('batch display', batch_display), check('batch message', batch_message),
+           check('bus write', bus_write), check('front button', front_button),
+           check('sku lookup', sku_lookup),
+           check('reply', reply), check('reply number', reply_number)]
+assert all(results), 'heap allocation on a zero allocation path'
+print('no allocations')
@@ -0,0 +1,48 @@
+# build_mpy.py - precompiled firmware modules for a faster boot
+# Compiles the firmware modules with mpy-cross (pip install mpy-cross) into build/, the PICO then loads
+# bytecode instead of compiling the sources at every power-on:
+#   python tools/build_mpy.py            (-O1: asserts and "if __debug__:" debug logging removed)
+#   python tools/build_mpy.py -O0        (debug build)
+#   mpremote cp -r build/. :
+# main.py and config.py stay sources - MicroPython only starts main.py, config.py differs between walls.
+# A .py next to a .mpy of the same name wins, remove the old sources from the PICO (mpremote rm :ptw.py ...).
+# For the fastest boot freeze the modules into the firmware instead, see frozen_manifest.py.
+
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD = os.path.join(ROOT, 'build')
+MODULES = ('ptw.py', 'manifest.py', 'sync.py', 'log.py', 'heap.py', 'fmt.py', 'startup.py', 'hotloops.py',
+           'native.py', 'scheduler.py', 'trace.py', 'selftest.py', 'shelfstate.py', 'analytics.py',
+           'lib/tm1638.py', 'lib/i2c23_lcd1602.py', 'lib/mcp23017.py')
+SOURCES = ('main.py', 'config.py')
+
+
+def mpy_cross():
+    path = shutil.which('mpy-cross')
+    if path:
+        return [path]
+    return [sys.executable, '-m', 'mpy_cross']
+
+
+def main(argv):
+    opt = '-O1'
+    for arg in argv:
+        if arg.startswith('-O'):
+            opt = arg
+    compiler = mpy_cross()
+    for module in MODULES:
+        target = os.path.join(BUILD, module[:-3] + '.mpy')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        subprocess.check_call(compiler + [opt, '-march=armv6m', '-o', target, os.path.join(ROOT, module)])
+        print(module, '->', os.path.relpath(target, ROOT), os.path.getsize(target), 'bytes')
+    for source in SOURCES:
+        shutil.copy(os.path.join(ROOT, source), os.path.join(BUILD, source))
+        print(source, '(source)')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,16 @@
+# frozen_manifest.py - the firmware modules frozen into a custom MicroPython build for the PICO
+# Frozen bytecode runs from flash: nothing is compiled or loaded into RAM at boot.
+#   cd micropython/ports/rp2
+#   make BOARD=RPI_PICO FROZEN_MANIFEST=<this repository>/tools/frozen_manifest.py
+# main.py and config.py are copied to the PICO as sources. The filesystem comes before the frozen modules
+# on sys.path, so no copies of the frozen modules may be left on the PICO.
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+for name in ("ptw.py", "manifest.py", "sync.py", "log.py", "heap.py", "fmt.py", "startup.py", "hotloops.py",
+             "native.py", "scheduler.py", "trace.py", "selftest.py", "shelfstate.py",
+             "analytics.py"):
+    module(name, base_path="..", opt=1)
+
+for name in ("tm1638.py", "i2c23_lcd1602.py", "mcp23017.py"):
+    module(name, base_path="../lib", opt=1)
@@ -0,0 +1,238 @@
+# fuzz.py - malformed and random frames through the UART command path of the firmware
+#   python tools/fuzz.py                          the corpus, then 5000 generated chunks (seed 1)
+#   python tools/fuzz.py --chunks 100000 --seed 7
+#   python tools/fuzz.py --corpus-only
+# main.py runs in this process up to its main loop, against the simulator devices (sim/fake) with a fast clock
+# (the waits of the firmware take microseconds). Every chunk of bytes goes through the code of the main loop -
+# uart_read(), receive_commands(), update_ptw() - and is checked:
+#   - no exception escapes, and every command is answered or dropped (update_list is empty afterwards)
+#   - processing takes less than --max-ms (host time); --hang-ms stops one that never returns (SIGALRM)
+# The chunks come from generators: valid commands, mutations of them (missing / empty / non-numeric fields,
+# '%' before '!', frames cut or split between reads) and raw bytes. A failing chunk is saved together with the
+# chunks before it to tools/fuzz_corpus/<crc>.txt (one Python bytes literal per line); the corpus is replayed
+# first on every run, so a crash that was fixed stays fixed.
+# Prints the chunks and frames per second parsed and dispatched (the UART read of the simulator not counted).
+
+import argparse
+import ast
+import os
+import random
+import signal
+import sys
+import time
+import traceback
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(ROOT, 'tools', 'fuzz_corpus')
+CONTEXT = 16        # chunks saved before a failing one
+sys.path.insert(0, ROOT)
+
+
+class Hang(Exception):
+    pass
+
+
+def firmware(speed):
+    # main.py up to the main loop, returns its globals
+    from sim import runtime
+    runtime.install(speed)
+    import config
+    config.LOG_SINK = None
+    config.TRACE = None
+    with open(os.path.join(ROOT, 'main.py')) as f:
+        source = f.read()
+    source = source[:source.index('\n# main loop\n')]
+    g = {'__name__': '__main__'}
+    exec(compile(source, os.path.join(ROOT, 'main.py'), 'exec'), g)
+    g['blink_timer']('off')     # the LED timer is not part of the command path
+    return g
+
+
+# generators
+
+SHELF = ('0', '1', '4', '8')
+NUMBER = ('0', '1', '2', '3', '10', '99')
+BATCHES = ('B1', 'B2', 'B3')
+ORDERS = ('O1', 'O2', 'O3', 'O4')
+SKUS = ('A', 'B', 'C')
+BAD = ('', '-1', '9', '10', '1000000000000', 'x', '1.5', ' 1', '#', 'None', '\xff')
+
+
+def valid(rng):
+    # one well formed payload
+    c = rng.choice
+    return c((
+        lambda: 'U#B#9#%s#%s#%s' % (c(BATCHES), c(NUMBER), c(NUMBER)),
+        lambda: 'U#B#9#%s#%s#%s#%s' % (c(BATCHES), c(NUMBER), c(NUMBER), ''.join(rng.sample('012345678', 3))),
+        lambda: 'U#S#%s#%s#%s#%s' % (c(SHELF), c(ORDERS), c(NUMBER), c(NUMBER)),
+        lambda: 'M#S#%s#%s#%s#%s' % (c(SHELF), c(ORDERS), c(SKUS), c(NUMBER)),
+        lambda: 'M#Q#9#%s#%s#%s#%s' % (c(BATCHES), c(ORDERS), c(SKUS), c(NUMBER)),
+        lambda: 'M#B#9#%s#END' % c(BATCHES),
+        lambda: 'Q#B#9#%s#%s#%s' % (c(BATCHES), c(ORDERS), c(NUMBER)),
+        lambda: 'SCAN#S#9#%s' % c(SKUS),
+        lambda: 'UNREGISTER#B#9#%s' % c(BATCHES),
+        lambda: 'SOUND#B#9#0#%s' % c(('ENABLED', 'DISABLED')),
+        lambda: 'BLIP#B#9#%s#%s#%s' % (c(NUMBER), c(NUMBER), c(NUMBER)),
+        lambda: c(('SNAPSHOT#B#9', 'SUBSCRIBE#B#9#ON', 'SUBSCRIBE#B#9#OFF', 'BOOT#B#9', 'HEAP#B#9', 'POLL',
+                   'READY?', 'LOG#B#9#20', 'LOG#B#9#DUMP', 'SELFTEST#B#9', 'STATS#B#9', 'STATS#B#9#RESET', 'BUS#B#9')),
+    ))()
+
+
+def mutate(rng, payload):
+    fields = payload.split('#')
+    i = rng.randrange(len(fields))
+    how = rng.randrange(6)
+    if how == 0:
+        del fields[i:]                          # cut short
+    elif how == 1:
+        fields[i] = rng.choice(BAD)             # empty, negative, huge, not a number
+    elif how == 2:
+        fields.insert(i, rng.choice(BAD))       # shifted
+    elif how == 3:
+        fields[i] = fields[i] * rng.randrange(2, 40)
+    elif how == 4:
+        fields = fields[:i] + fields[i + 1:]    # a field missing in the middle
+    else:
+        fields[i] = ''.join(rng.choice('!%#:0aZ\x00 ') for n in range(rng.randrange(1, 6)))
+    return '#'.join(fields)
+
+
+def chunks(rng):
+    # endless chunks of UART bytes
+    while True:
+        kind = rng.random()
+        if kind < 0.45:
+            yield ('!' + valid(rng) + '%').encode('latin-1')
+        elif kind < 0.8:
+            yield ('!' + mutate(rng, valid(rng)) + '%').encode('latin-1')
+        elif kind < 0.9:
+            # framing: '%' first, '!' twice, no end, two frames, a frame split between reads
+            frame = ('!' + valid(rng) + '%').encode('latin-1')
+            cut = rng.randrange(1, len(frame))
+            yield rng.choice((b'%' + frame, b'!' + frame, frame[:cut], frame + frame, frame[cut:],
+                              frame[:cut] + b'!' + frame))
+        else:
+            yield bytes(rng.randrange(256) for n in range(rng.randrange(1, 40)))
+
+
+# checks
+
+def step(g, chunk, max_ms, hang_ms):
+    # one chunk through the main loop code, returns (us of parse + dispatch, frames) or raises AssertionError
+    u = g['u']
+    uart = u.uart
+    uart.feed(chunk)
+    signal.setitimer(signal.ITIMER_REAL, hang_ms / 1000)
+    try:
+        u.uart_read()
+        start = time.perf_counter()
+        frames = 0
+        if u._rx_data:
+            u.receive_commands()
+            frames = len(u.received_commands)
+            if u.received_commands:
+                g['update_ptw']()
+        spent = time.perf_counter() - start
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    uart.take()
+    assert not u.update_list, 'left in update_list: %r' % (u.update_list[0],)
+    assert spent * 1000 < max_ms, 'took %.1f ms' % (spent * 1000)
+    return spent, frames
+
+
+def load_corpus():
+    cases = []
+    if os.path.isdir(CORPUS):
+        for name in sorted(os.listdir(CORPUS)):
+            if name.endswith('.txt'):
+                with open(os.path.join(CORPUS, name)) as f:
+                    cases.append((name, [ast.literal_eval(line) for line in f if line.strip()]))
+    return cases
+
+
+def save(case):
+    os.makedirs(CORPUS, exist_ok=True)
+    text = ''.join(repr(chunk) + '\n' for chunk in case)
+    path = os.path.join(CORPUS, '%08x.txt' % zlib.crc32(text.encode()))
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def run(g, case, args, stats):
+    # returns None or (index of the failing chunk, what failed, kind of failure), after a failure the commands
+    # left over are dropped so that the next chunk starts clean
+    for n in range(len(case)):
+        try:
+            spent, frames = step(g, case[n], args.max_ms, args.hang_ms)
+        except Hang:
+            failure = kind = 'no return in %d ms' % args.hang_ms
+        except AssertionError as e:
+            failure = str(e)
+            kind = failure.split(':')[0]
+        except Exception as e:
+            where = traceback.extract_tb(e.__traceback__)[-1]
+            failure = '%s: %s (%s:%d)' % (type(e).__name__, e, os.path.basename(where[0]), where[1])
+            kind = failure.split(': ')[0] + failure[failure.rindex(' ('):]
+        else:
+            stats[0] += 1
+            stats[1] += frames
+            stats[2] += spent
+            continue
+        g['u'].update_list.clear()
+        g['u']._rx_tail = bytes()
+        return n, failure, kind
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fuzz the UART command path')
+    parser.add_argument('--chunks', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--speed', type=float, default=1000.0, help='firmware clock speed-up (sim/runtime.py)')
+    parser.add_argument('--max-ms', type=float, default=50.0, help='longest processing of one chunk')
+    parser.add_argument('--hang-ms', type=int, default=2000)
+    parser.add_argument('--corpus-only', action='store_true')
+    parser.add_argument('--no-save', action='store_true', help='failing chunks are not added to the corpus')
+    args = parser.parse_args()
+
+    def alarm(signum, frame):
+        raise Hang()
+    signal.signal(signal.SIGALRM, alarm)
+
+    g = firmware(args.speed)
+    stats = [0, 0, 0.0]      # chunks, frames, seconds
+    failures = 0
+    for name, case in load_corpus():
+        failure = run(g, case, args, stats)
+        if failure is not None:
+            failures += 1
+            print('corpus %s: chunk %d %r - %s' % (name, failure[0], case[failure[0]], failure[1]))
+    if not args.corpus_only:
+        rng = random.Random(args.seed)
+        source = chunks(rng)
+        recent = []
+        seen = set()        # one corpus entry per kind of failure
+        for n in range(args.chunks):
+            chunk = next(source)
+            recent = (recent + [chunk])[-CONTEXT:]
+            failure = run(g, [chunk], args, stats)
+            if failure is not None:
+                failures += 1
+                where = ''
+                if not args.no_save and failure[2] not in seen:
+                    seen.add(failure[2])
+                    where = ' -> ' + os.path.relpath(save(recent), ROOT)
+                print('chunk %d %r - %s%s' % (n, chunk, failure[1], where))
+                recent = []
+    if stats[2]:
+        print('%d chunks, %d frames: %.0f chunks/s, %.0f frames/s parsed and dispatched' %
+              (stats[0], stats[1], stats[0] / stats[2], stats[1] / stats[2]))
+    print('%d failures' % failures)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
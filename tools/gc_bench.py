@@ -0,0 +1,112 @@
+# gc_bench.py - GC pauses in the picking wall loop, automatic collection versus the heap.py policy
+# MicroPython with the firmware files (PICO: mpremote run tools/gc_bench.py)
+# Every iteration runs a "critical" section with the allocations of the firmware (frame received with
+# bytes +=, split('#'), LCD text concatenation, led_value lists) and a quiet window of LOOP_MS. The duration of
+# the critical sections is recorded - a collection landing in one shows up as a long tail.
+#   auto    - MicroPython defaults, the heap fills up and collects wherever it happens to be
+#   managed - heap.init() and heap.idle() in the quiet window, as in the main loop; the idle() calls that
+#             collected are timed too - their pauses include the largest free block probe (heap.probe(),
+#             every PROBE_MS here instead of config.HEAP_PROBE_MS so it shows up in a short run)
+
+import gc
+import time
+from array import array
+import config
+import heap
+import log
+
+ITERATIONS = 2000
+LOOP_MS = 1                 # quiet window of one loop iteration
+PROBE_MS = 500
+_ballast = []               # long living objects, the heap of the firmware is not empty
+_probe = heap.probe
+probed = False
+
+
+def counted_probe():
+    global probed
+    probed = True
+    _probe()
+
+
+def critical(n):
+    rx = b''
+    for part in (b'!U#S#', b'3#ORD', str(n).encode(), b'#2#5%'):
+        rx += part
+    data = rx.decode()[1:-1].split('#')
+    text = 'Order: ' + data[3] + ' ' + data[4] + '/' + data[5]
+    leds = [[0] * 8 for i in range(2)]
+    leds[0][n & 7] |= 1
+    return len(text) + leds[0][0]
+
+
+def run(managed):
+    global probed
+    gc.collect()
+    if managed:
+        heap.init()
+    else:
+        gc.threshold(-1)
+    durations = array('L', [0] * ITERATIONS)
+    pauses = array('L', [0] * ITERATIONS)       # idle() calls that collected
+    probes = array('L', [0] * ITERATIONS)       # ... and probed the largest block
+    collected = 0
+    probed_count = 0
+    for n in range(ITERATIONS):
+        start = time.ticks_us()
+        critical(n)
+        durations[n] = time.ticks_diff(time.ticks_us(), start)
+        if managed:
+            probed = False
+            start = time.ticks_us()
+            if heap.idle():
+                pause = time.ticks_diff(time.ticks_us(), start)
+                pauses[collected] = pause
+                collected += 1
+                if probed:
+                    probes[probed_count] = pause
+                    probed_count += 1
+        time.sleep_ms(LOOP_MS)
+    gc.threshold(-1)
+    return durations, pauses[:collected], probes[:probed_count]
+
+
+def report(name, durations):
+    values = sorted(durations)
+    count = len(values)
+    slow = 0
+    for value in values:
+        if value > 4 * values[count // 2]:
+            slow += 1
+    print('%-8s p50 %5d us  p90 %5d us  p99 %5d us  max %6d us  slow %4d' % (
+        name, values[count // 2], values[count * 9 // 10], values[count * 99 // 100], values[-1], slow))
+
+
+def report_pauses(name, pauses):
+    if not pauses:
+        print('%-8s none' % name)
+        return
+    values = sorted(pauses)
+    print('%-8s %4d  p50 %6d us  max %6d us' % (name, len(values), values[len(values) // 2], values[-1]))
+
+
+def main():
+    log.level(log.WARNING)      # heap.probe() logs every probe
+    config.HEAP_PROBE_MS = PROBE_MS
+    heap.probe = counted_probe
+    for i in range(200):
+        _ballast.append(('shelf', i, [0] * 8))
+    print('heap free', gc.mem_free(), 'allocated', gc.mem_alloc(), 'iterations', ITERATIONS)
+    durations, pauses, probes = run(False)
+    report('auto', durations)
+    durations = None
+    durations, pauses, probes = run(True)
+    report('managed', durations)
+    report_pauses('idle', pauses)
+    report_pauses('probe', probes)
+    print('automatic collections under the policy', heap.auto, ' largest free block', heap.largest)
+    print('slow - critical sections longer than 4x the median (a collection ran inside)')
+    print('idle - heap.idle() calls that collected, probe - those that also measured the largest free block')
+
+
+main()
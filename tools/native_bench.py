@@ -0,0 +1,65 @@
+# native_bench.py - per-call cost of the hot loops, bytecode versus native / viper (hotloops.py, native.py)
+# MicroPython unix port (x64 has both emitters), from the repository root:
+#   micropython tools/native_bench.py
+# or on the PICO (main.py stopped, the modules copied): mpremote run tools/native_bench.py
+# On the PICO the SIO version of the TM1638 byte toggles GPIO 3 / 2 with STB high - the chip ignores it.
+
+import sys
+sys.path.append('')
+sys.path.append('lib')
+import time
+import hotloops
+
+CALLS = 2000
+
+
+class FakePin():
+    # stands in for machine.Pin on the unix port
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self, value):
+        self.value = value
+
+
+def per_call_us(function, *args):
+    start = time.ticks_us()
+    for i in range(CALLS):
+        function(*args)
+    return time.ticks_diff(time.ticks_us(), start) / CALLS
+
+
+def compare(name, slow, quick):
+    if quick is None:
+        print('%-12s bytecode %7.2f us   (no native emitter)' % (name, slow))
+    else:
+        print('%-12s bytecode %7.2f us   native %7.2f us   x%.1f' % (name, slow, quick, slow / quick))
+
+
+def fast(function, bytecode, *args):
+    # per call cost of the machine code version, None if the bytecode one is in use
+    if function is bytecode:
+        return None
+    return per_call_us(function, *args)
+
+
+def main():
+    print('platform', sys.platform, 'native' if hotloops.NATIVE else 'bytecode only', 'calls', CALLS)
+    tm_byte, lcd_nibble, led_merge = hotloops.bytecode
+    if sys.platform == 'rp2':
+        from machine import Pin
+        clk, dio = Pin(3, Pin.OUT), Pin(2, Pin.OUT)
+    else:
+        clk, dio = FakePin(), FakePin()
+    slow = per_call_us(tm_byte, clk, dio, 0xA5)
+    compare('tm1638 byte', slow, fast(hotloops.tm_byte, tm_byte, clk, dio, 0xA5))
+    if hotloops.tm_byte_sio is not None:
+        compare('tm1638 sio', slow, per_call_us(hotloops.tm_byte_sio, 1 << 3, 1 << 2, 0xA5, 16))
+    pins = bytes((1, 2, 3, 4))
+    compare('lcd nibble', per_call_us(lcd_nibble, 0x0B, pins), fast(hotloops.lcd_nibble, lcd_nibble, 0x0B, pins))
+    on, off = bytearray(8), bytearray(8)
+    shelf_on, shelf_off = bytearray(b'\x01\x00\x01\x00\x01\x00\x00\x00'), bytearray(8)
+    compare('led merge', per_call_us(led_merge, on, off, shelf_on, shelf_off),
+            fast(hotloops.led_merge, led_merge, on, off, shelf_on, shelf_off))
+
+main()
@@ -0,0 +1,257 @@
+# replay.py - a captured trace (trace.py) fed into the simulator and compared with a baseline
+#   python tools/replay.py capture.bin                        original timing, compared with the capture
+#   python tools/replay.py capture.bin --fast                 the next input once the previous one is answered
+#   python tools/replay.py capture.bin --save base.bin        the trace of the replay kept as a baseline
+#   python tools/replay.py capture.bin --baseline base.bin    ... and a later replay compared with it
+#   python tools/replay.py capture.bin --show                 the records of the capture, nothing replayed
+# capture - the trace file of the PICO (mpremote cp :trace.bin .) or a console log with the '@T' lines
+# The firmware runs in this process (sim/runtime.py) and records its own trace of the replay, so both sides
+# are decoded the same way. UART bytes and button presses are fed at the times of the capture, relative
+# to the start of the capture. Compared:
+#   frames  - the frames sent, in order (READY, BOOT, H, TRACE and L frames carry times and are skipped)
+#   latency - us from an input (R - UART bytes, B - button) to every frame sent before the next input,
+#             per stage <input>><type>#<command>, e.g. R>C#SR or B>C#BFP; a stage is slower when its p95
+#             exceeds the baseline p95 by more than --tolerance (and --slack-us)
+# Latencies of a capture from the PICO are hardware times - compare replays with replays for regressions.
+# Exit status 1 - the frames differ or a stage is slower.
+
+import argparse
+import base64
+import difflib
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+START = 0x53
+RX = 0x52
+TX = 0x54
+BUTTON = 0x42
+MAGIC = b'PTWT\x01'
+SKIPPED = ('READY', 'BOOT', 'H', 'TRACE', 'L')
+
+
+def load(path):
+    # trace bytes from a trace file or from the '@T' lines of a console log
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(MAGIC):
+        return data
+    chunks = []
+    for line in data.splitlines():
+        if line.startswith(b'@T '):
+            chunks.append(base64.b64decode(line[3:].strip()))
+    return b''.join(chunks)
+
+
+def _varint(data, i):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, i
+        shift += 7
+
+
+def decode(data):
+    # [(us from the start of the capture, kind, data)], captures after the first one continue its time line
+    records = []
+    t = 0
+    i = 0
+    while i < len(data):
+        if data.startswith(MAGIC, i):
+            i += len(MAGIC)
+            continue
+        kind = data[i]
+        dt, i = _varint(data, i + 1)
+        length, i = _varint(data, i)
+        t += dt
+        records.append((t, kind, data[i:i + length]))
+        i += length
+    return records
+
+
+def fields(frame):
+    # '!C#S#0#O1#SR%\r\n' (or '!00:01:C#...%') -> ['C', 'S', '0', 'O1', 'SR']
+    text = frame.decode(errors='replace').strip()
+    if text.startswith('!'):
+        text = text[1:]
+    if text.endswith('%'):
+        text = text[:-1]
+    if text[2:3] == ':' and text[5:6] == ':':
+        text = text[6:]
+    return text.split('#')
+
+
+def frames(records):
+    result = []
+    for t, kind, data in records:
+        if kind == TX:
+            f = fields(data)
+            if f[0] not in SKIPPED:
+                result.append('#'.join(f))
+    return result
+
+
+def latencies(records):
+    # {stage: [us]}
+    stages = {}
+    last = None
+    for t, kind, data in records:
+        if kind in (RX, BUTTON):
+            last = (t, 'R' if kind == RX else 'B')
+        elif kind == TX and last is not None:
+            f = fields(data)
+            if f[0] in SKIPPED:
+                continue
+            stage = last[1] + '>' + f[0] + '#' + (f[4] if len(f) > 4 else '')
+            stages.setdefault(stage, []).append(t - last[0])
+    return stages
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def show(records):
+    names = {START: 'S', RX: 'R', TX: 'T', BUTTON: 'B'}
+    for t, kind, data in records:
+        if kind == START:
+            text = 'ticks_ms %d' % int.from_bytes(data, 'little')
+        else:
+            text = str(data[0]) if kind == BUTTON else data.decode(errors='replace').strip()
+        print('%12d %s %s' % (t, names.get(kind, '?'), text))
+
+
+def replay(records, fast=False, gap_ms=500, speed=1.0, tail_ms=2000, address=None):
+    # runs the firmware, feeds the inputs of the records, returns the records of its own trace
+    from sim import runtime
+    runtime.install(speed)
+    import time
+    import config
+    import machine
+    path = os.path.join(tempfile.mkdtemp(), 'replay.bin')
+    config.TRACE = 'FLASH'
+    config.TRACE_FILE = path
+    config.TRACE_MAX = 1 << 30
+    config.LOG_SINK = None
+    threading.Thread(target=runtime.run_firmware, args=(address,), daemon=True).start()
+    while 'trace' not in sys.modules or not sys.modules['trace'].enabled:
+        time.sleep(0.01)
+    trace = sys.modules['trace']
+    uart = machine.UART.instances[0]
+    inputs = [i for i in range(len(records)) if records[i][1] in (RX, BUTTON)]
+    start = time.ticks_us()
+    offset = 0
+    sent = 0            # frames written by the replay so far
+    expected = 0        # ... and in the capture up to the current input
+    for n in range(len(inputs)):
+        t, kind, data = records[inputs[n]]
+        if n:
+            gap = t - records[inputs[n - 1]][0]
+            if fast:
+                # the next input as soon as the firmware answered the previous one like in the capture
+                deadline = time.ticks_add(time.ticks_us(), gap)
+                while sent < expected and time.ticks_diff(deadline, time.ticks_us()) > 0:
+                    time.sleep(0.001)
+                    sent += uart.take().count(b'%\r\n')
+                gap = min(gap, gap_ms * 1000)
+                start = time.ticks_us()
+                offset = 0
+            offset += gap
+        wait = time.ticks_diff(time.ticks_add(start, offset), time.ticks_us())
+        if wait > 0:
+            time.sleep(wait / 1000000)
+        sent += uart.take().count(b'%\r\n')
+        if kind == RX:
+            uart.feed(data)
+        else:
+            machine.Pin.pins[data[0]].press()
+        end = inputs[n + 1] if n + 1 < len(inputs) else len(records)
+        expected += sum(1 for r in records[inputs[n]:end] if r[1] == TX)
+    time.sleep(tail_ms / 1000)
+    trace.enabled = False       # the main loop records nothing more,
+    time.sleep(0.05)
+    trace.stop()                # ... the buffer is written
+    uart.take()
+    with open(path, 'rb') as f:
+        return decode(f.read())
+
+
+def compare(base, run, tolerance, slack_us):
+    ok = True
+    a, b = frames(base), frames(run)
+    if a != b:
+        ok = False
+        print('frames differ (baseline %d, replay %d):' % (len(a), len(b)))
+        for line in list(difflib.unified_diff(a, b, 'baseline', 'replay', lineterm='', n=1))[:40]:
+            print('  ' + line)
+    else:
+        print('frames: %d identical' % len(a))
+    base_stages, run_stages = latencies(base), latencies(run)
+    print('%-24s %6s %10s %10s %10s %10s' % ('stage', 'n', 'base p50', 'base p95', 'p50', 'p95'))
+    for stage in sorted(set(base_stages) | set(run_stages)):
+        row = [stage, len(run_stages.get(stage, ()))]
+        for stages in (base_stages, run_stages):
+            values = stages.get(stage)
+            row += [percentile(values, 50), percentile(values, 95)] if values else ['-', '-']
+        slower = (stage in base_stages and stage in run_stages and
+                  row[5] > row[3] * (1 + tolerance) + slack_us)
+        ok = ok and not slower
+        print('%-24s %6s %10s %10s %10s %10s%s' % tuple(row + [' SLOWER' if slower else '']))
+    return ok
+
+
+def encode(records):
+    # records back to one trace
+    out = bytearray(MAGIC)
+    t = 0
+    for at, kind, data in records:
+        out.append(kind)
+        for value in (at - t, len(data)):
+            while value > 0x7f:
+                out.append(value & 0x7f | 0x80)
+                value >>= 7
+            out.append(value)
+        out += data
+        t = at
+    return bytes(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay a captured trace in the simulator')
+    parser.add_argument('capture')
+    parser.add_argument('--baseline', default=None, help='trace to compare with, default - the capture')
+    parser.add_argument('--save', default=None, help='write the trace of the replay here')
+    parser.add_argument('--fast', action='store_true', help='the next input once the frames of the previous one are sent (+ --gap-ms)')
+    # the wall waits up to 500 ms after some inputs (a confirmation, UNREGISTER) - closer inputs would
+    # change what it does, not only how fast
+    parser.add_argument('--gap-ms', type=int, default=500)
+    parser.add_argument('--speed', type=float, default=1.0, help='firmware clock speed-up (sim/runtime.py)')
+    parser.add_argument('--tail-ms', type=int, default=2000, help='firmware time after the last input')
+    parser.add_argument('--address', type=int, default=None, help='node address of a multi-drop capture')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--slack-us', type=int, default=2000)
+    parser.add_argument('--show', action='store_true')
+    args = parser.parse_args()
+
+    records = decode(load(args.capture))
+    if args.show:
+        show(records)
+        return 0
+    run = replay(records, args.fast, args.gap_ms, args.speed, args.tail_ms, args.address)
+    if args.save:
+        with open(args.save, 'wb') as f:
+            f.write(encode(run))
+    base = records if args.baseline is None else decode(load(args.baseline))
+    return 0 if compare(base, run, args.tolerance, args.slack_us) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# trace.py - capture of the wall traffic for replay in the simulator (tools/replay.py)
+# Every byte received on the UART, every frame sent and every button IRQ is recorded with its ticks_us time:
+#   config.TRACE  None    - off, the hooks in ptw.py cost one test of trace.enabled
+#                 'FLASH' - appended to config.TRACE_FILE on the PICO filesystem (mpremote cp :trace.bin .)
+#                 'USB'   - streamed over the USB console as '@T <base64>' lines, log lines may come between them
+# TRACE#B#9#FLASH|USB|OFF starts / stops a capture at runtime.
+# The trace is binary: MAGIC at the start of every capture, then the records
+#   kind (1 byte) | us since the previous record (varint) | length (varint) | data
+#   S - start of the capture (data - ticks_ms), R - bytes read from the UART, T - frame written to the UART,
+#   B - button IRQ (data - GPIO number of the button)
+# The IRQ handlers only store the pin and the time in preallocated arrays, records are built in the main loop
+# and collected in RAM - drain() writes them out every TRACE_FLUSH_MS, a full buffer is written at once.
+
+from micropython import const
+from array import array
+import machine
+import time
+import config
+
+START = const(0x53)     # 'S'
+RX = const(0x52)        # 'R'
+TX = const(0x54)        # 'T'
+BUTTON = const(0x42)    # 'B'
+MAGIC = b'PTWT\x01'
+
+_IRQ_SIZE = const(16)
+_RECORD_MAX = const(11)     # kind and two varints
+
+enabled = False
+mode = None
+records = 0         # records of the current capture
+written = 0         # bytes in the trace file / sent to the console
+dropped = 0         # records lost - IRQs faster than the main loop, TRACE_MAX reached
+_buf = None
+_n = 0
+_last = 0           # ticks_us of the previous record
+_flushed = 0        # ticks_ms of the last write
+_irq_pin = bytearray(_IRQ_SIZE)
+_irq_ticks = array('L', [0] * _IRQ_SIZE)
+_irq_head = 0
+_irq_count = 0
+
+
+def start(sink=None):
+    # sink - 'FLASH' or 'USB', None - config.TRACE; returns False if the capture is off
+    global enabled, mode, records, written, _buf, _n, _last, _flushed
+    stop()
+    mode = config.TRACE if sink is None else sink
+    if mode not in ('FLASH', 'USB'):
+        mode = None
+        return False
+    if _buf is None:
+        _buf = bytearray(config.TRACE_BUFFER)
+    written = 0
+    if mode == 'FLASH':
+        import os
+        try:
+            written = os.stat(config.TRACE_FILE)[6]
+        except OSError:
+            pass
+    records = 0
+    _buf[0:len(MAGIC)] = MAGIC
+    _n = len(MAGIC)
+    _last = time.ticks_us()
+    _flushed = time.ticks_ms()
+    enabled = True
+    t = time.ticks_ms()
+    _put(START, _last, bytes((t & 0xff, t >> 8 & 0xff, t >> 16 & 0xff, t >> 24 & 0xff)))
+    return True
+
+
+def stop():
+    global enabled
+    if enabled:
+        _irqs()
+    enabled = False
+    _write()
+
+
+def irq(pin):
+    # button pressed - called from the hard IRQ handler, must not allocate
+    global _irq_count, dropped
+    if _irq_count == _IRQ_SIZE:
+        dropped += 1
+        return
+    i = _irq_head + _irq_count
+    if i >= _IRQ_SIZE:
+        i -= _IRQ_SIZE
+    _irq_pin[i] = pin
+    _irq_ticks[i] = time.ticks_us()
+    _irq_count += 1
+
+
+def record(kind, data):
+    # RX / TX record stamped now - the button IRQs before it are recorded first
+    if _irq_count:
+        _irqs()
+    _put(kind, time.ticks_us(), data)
+
+
+def drain():
+    # main loop - IRQ records, and the buffer written out every TRACE_FLUSH_MS
+    if not enabled:
+        return
+    if _irq_count:
+        _irqs()
+    if _n and time.ticks_diff(time.ticks_ms(), _flushed) >= config.TRACE_FLUSH_MS:
+        _write()
+
+
+def report():
+    return 'm=' + str(mode) + ',r=' + str(records) + ',b=' + str(written + _n) + ',d=' + str(dropped)
+
+
+def _irqs():
+    global _irq_head, _irq_count
+    while _irq_count:
+        state = machine.disable_irq()
+        i = _irq_head
+        pin, t = _irq_pin[i], _irq_ticks[i]
+        _irq_head = i + 1 if i + 1 < _IRQ_SIZE else 0
+        _irq_count -= 1
+        machine.enable_irq(state)
+        _put(BUTTON, t, pin)
+
+
+def _varint(value):
+    global _n
+    while value > 0x7f:
+        _buf[_n] = value & 0x7f | 0x80
+        _n += 1
+        value >>= 7
+    _buf[_n] = value
+    _n += 1
+
+
+def _put(kind, t, data):
+    # data - bytes / bytearray / memoryview, or one byte as an int
+    global _n, _last, records, dropped
+    length = 1 if isinstance(data, int) else len(data)
+    if _n + length + _RECORD_MAX > len(_buf):
+        _write()
+        if length + _RECORD_MAX > len(_buf):
+            dropped += 1
+            return
+    if mode == 'FLASH' and written + _n + length + _RECORD_MAX > config.TRACE_MAX:
+        dropped += 1
+        return
+    dt = time.ticks_diff(t, _last)
+    if dt < 0:
+        dt = 0          # an IRQ stamped before the previous record
+    else:
+        _last = t
+    _buf[_n] = kind
+    _n += 1
+    _varint(dt)
+    _varint(length)
+    if isinstance(data, int):
+        _buf[_n] = data
+    else:
+        _buf[_n:_n + length] = data
+    _n += length
+    records += 1
+
+
+def _write():
+    global _n, written, _flushed
+    _flushed = time.ticks_ms()
+    if not _n:
+        return
+    data = memoryview(_buf)[:_n]
+    if mode == 'FLASH':
+        with open(config.TRACE_FILE, 'ab') as f:
+            f.write(data)
+    else:
+        import binascii
+        print('@T', binascii.b2a_base64(data).decode().strip())
+    written += _n
+    _n = 0